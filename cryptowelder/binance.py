@@ -1,5 +1,4 @@
 from threading import Thread
-from time import sleep
 
 from cryptowelder.context import CryptowelderContext, Ticker
 
@@ -25,19 +24,9 @@ class BinanceWelder:
 
         self.__logger.info('Processing : %s', self.__endpoint)
 
-        while not self.__context.is_closed():
-
-            threads = [
-                Thread(target=self._process_ticker)
-            ]
-
-            for t in threads:
-                t.start()
-
-            for t in threads:
-                t.join()
-
-            sleep(float(self.__context.get_property(self._ID, 'interval', default_interval)))
+        self.__context.run_schedule(self._ID, [
+            ('ticker', self._process_ticker),
+        ], default_interval=default_interval)
 
         self.__logger.info('Terminated.')
 
@@ -47,16 +36,24 @@ class BinanceWelder:
 
             now = self.__context.get_now()
 
-            trades = self.__context.requests_get(self.__endpoint + '/api/v3/ticker/price')
+            codes = self.__context.get_property(self._ID, 'codes', 'BTCUSDT,ETHBTC').split(',')
+
+            symbols = set(codes)
+
+            select = lambda o: 'symbol' not in o or o['symbol'] in symbols
 
-            quotes = self.__context.requests_get(self.__endpoint + '/api/v3/ticker/bookTicker')
+            trades = self.__context.requests_get(self.__endpoint + '/api/v3/ticker/price', select=select)
+
+            quotes = self.__context.requests_get(self.__endpoint + '/api/v3/ticker/bookTicker', select=select)
 
             if trades is None and quotes is None:
                 return
 
-            values = []
+            trades = {t.get('symbol'): t for t in trades if t is not None} if trades is not None else {}
 
-            codes = self.__context.get_property(self._ID, 'codes', 'BTCUSDT,ETHBTC').split(',')
+            quotes = {q.get('symbol'): q for q in quotes if q is not None} if quotes is not None else {}
+
+            values = []
 
             for code in codes:
 
@@ -65,16 +62,16 @@ class BinanceWelder:
                 ticker.tk_code = code
                 ticker.tk_time = now
 
-                for trade in trades if trades is not None else []:
-                    if code == trade.get('symbol'):
-                        ticker.tk_ltp = trade.get('price')
-                        break
+                trade = trades.get(code)
+
+                if trade is not None:
+                    ticker.tk_ltp = trade.get('price')
+
+                quote = quotes.get(code)
 
-                for quote in quotes if quotes is not None else []:
-                    if code == quote.get('symbol'):
-                        ticker.tk_ask = quote.get('askPrice')
-                        ticker.tk_bid = quote.get('bidPrice')
-                        break
+                if quote is not None:
+                    ticker.tk_ask = quote.get('askPrice')
+                    ticker.tk_bid = quote.get('bidPrice')
 
                 values.append(ticker)
 
@@ -2,7 +2,6 @@ from decimal import Decimal
 from hashlib import sha256
 from hmac import new
 from threading import Thread, Lock
-from time import sleep
 from urllib import parse
 
 from cryptowelder.context import CryptowelderContext, Ticker, Transaction, Balance, AccountType, UnitType, \
@@ -32,29 +31,22 @@ class BitbankWelder:
 
         self.__logger.info('Processing : %s', self.__endpoint)
 
-        while not self.__context.is_closed():
+        self.__context.run_schedule(self._ID, [
+            ('ticker', self._process_tickers),
+            ('balance', self._process_balance),
+            ('transaction', self._process_transactions),
+        ], default_interval=default_interval)
 
-            threads = [
-                Thread(target=self._process_balance),
-            ]
-
-            pairs = self.__context.get_property(
-                self._ID, 'pairs', 'btc_jpy,eth_btc'
-            ).split(',')
-
-            for pair in pairs:
-                threads.append(Thread(target=self._process_ticker, args=(pair,)))
-                threads.append(Thread(target=self._process_transaction, args=(pair,)))
-
-            for t in threads:
-                t.start()
+        self.__logger.info('Terminated.')
 
-            for t in threads:
-                t.join()
+    def _get_pairs(self):
+        return self.__context.get_property(self._ID, 'pairs', 'btc_jpy,eth_btc').split(',')
 
-            sleep(float(self.__context.get_property(self._ID, 'interval', default_interval)))
+    def _process_tickers(self):
+        self.__context.run_tasks(self._ID, [(self._process_ticker, pair) for pair in self._get_pairs()])
 
-        self.__logger.info('Terminated.')
+    def _process_transactions(self):
+        self.__context.run_tasks(self._ID, [(self._process_transaction, pair) for pair in self._get_pairs()])
 
     def _process_ticker(self, pair):
 
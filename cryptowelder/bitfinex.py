@@ -1,5 +1,4 @@
 from threading import Thread
-from time import sleep
 
 from cryptowelder.context import CryptowelderContext, Ticker
 
@@ -25,21 +24,17 @@ class BitfinexWelder:
 
         self.__logger.info('Processing : %s', self.__endpoint)
 
-        while not self.__context.is_closed():
+        self.__context.run_schedule(self._ID, [
+            ('ticker', self._process_tickers),
+        ], default_interval=default_interval)
 
-            codes = self.__context.get_property(self._ID, 'codes', 'btcusd,ethbtc').split(',')
-
-            threads = [Thread(target=self._process_ticker, args=(code,)) for code in codes]
-
-            for t in threads:
-                t.start()
+        self.__logger.info('Terminated.')
 
-            for t in threads:
-                t.join()
+    def _process_tickers(self):
 
-            sleep(float(self.__context.get_property(self._ID, 'interval', default_interval)))
+        codes = self.__context.get_property(self._ID, 'codes', 'btcusd,ethbtc').split(',')
 
-        self.__logger.info('Terminated.')
+        self.__context.run_tasks(self._ID, [(self._process_ticker, code) for code in codes])
 
     def _process_ticker(self, code):
 
@@ -1,10 +1,11 @@
+from argparse import ArgumentParser
 from datetime import datetime, timedelta
 from decimal import Decimal
+from functools import partial
 from hashlib import sha256
 from hmac import new
 from re import compile
 from threading import Thread
-from time import sleep
 
 from pytz import utc
 
@@ -41,32 +42,34 @@ class BitflyerWelder:
 
         self.__logger.info('Processing : %s', self.__endpoint)
 
-        while not self.__context.is_closed():
+        self.__context.run_schedule(self._ID, [
+            ('ticker', partial(self._process_markets, position=False, transaction=False)),
+            ('position', partial(self._process_markets, ticker=False, transaction=False)),
+            ('transaction', partial(self._process_markets, ticker=False, position=False)),
+            ('balance', self._process_balances),
+        ], default_interval=20)
 
-            threads = [
-                Thread(target=self._process_markets),
-                Thread(target=self._process_cash),
-                Thread(target=self._process_margin),
-            ]
-
-            for t in threads:
-                t.start()
+        self.__logger.info('Terminated.')
 
-            for t in threads:
-                t.join()
+    def _process_balances(self):
 
-            sleep(float(self.__context.get_property(self._ID, 'interval', 20)))
+        tasks = [
+            (self._process_cash,),
+            (self._process_margin,),
+        ]
 
-        self.__logger.info('Terminated.')
+        self.__context.run_tasks(self._ID, tasks)
 
-    def _process_markets(self):
+    def _process_markets(self, *, ticker=True, position=True, transaction=True):
 
         try:
 
             # [{"product_code": "BTCJPYddMMMyyyy", "alias": "BTCJPY_MAT1WK"}, ...]
-            markets = self.__context.requests_get(self.__endpoint + '/v1/markets')
+            markets = self.__context.requests_cached(
+                self.__endpoint + '/v1/markets', ttl=self.__context.get_property(self._ID, 'markets_ttl', 300)
+            )
 
-            threads = []
+            tasks = []
 
             codes = []
             includes = [c for c in self.__context.get_property(self._ID, 'codes_include', '').split(',') if len(c) > 0]
@@ -83,21 +86,18 @@ class BitflyerWelder:
 
                 codes.append(code)
 
-                threads.append(Thread(target=self._process_product, args=(code,)))
-
-                threads.append(Thread(target=self._process_evaluation, args=(code,)))
-
-                threads.append(Thread(target=self._process_ticker, args=(code,)))
+                if ticker:
+                    tasks.append((self._process_product, code))
+                    tasks.append((self._process_evaluation, code))
+                    tasks.append((self._process_ticker, code))
 
-                threads.append(Thread(target=self._process_position, args=(code,)))
+                if position:
+                    tasks.append((self._process_position, code))
 
-                threads.append(Thread(target=self._process_transaction, args=(code,)))
+                if transaction:
+                    tasks.append((self._process_transaction, code))
 
-            for t in threads:
-                t.start()
-
-            for t in threads:
-                t.join()
+            self.__context.run_tasks(self._ID, tasks)
 
             self.__logger.debug('Markets : %s', codes)
 
@@ -298,59 +298,123 @@ class BitflyerWelder:
 
             is_cash = 'FX_BTC_JPY' != code and not self.__is_futures(code)
 
+            account = AccountType.CASH if is_cash else AccountType.MARGIN
+
             limit = int(self.__context.get_property(self._ID, 'tx_limit', 100))
 
+            # Only the executions newer than the last-seen id, when known.
+            cursor = self.__context.fetch_cursor(self._ID, code, account)
+
+            after = cursor.cr_seq if cursor is not None else None
+
             sequence = None
 
+            latest = None
+
             while True:
 
                 path = '/v1/me/getexecutions?count=%s&product_code=%s' % (limit, code)
 
+                if after is not None:
+                    path = path + '&after=%s' % after
+
                 if sequence is not None:
                     path = path + '&before=%s' % sequence
 
                 executions = self._query_private(path)
 
                 if executions is None:
+                    latest = None  # Incomplete, retry from the same cursor.
                     break
 
                 values = []
 
                 for execution in executions:
                     exec_id = execution.get('id')  # Self-cross has same ids.
-                    exec_od = execution.get('child_order_id')
-                    exec_ts = execution.get('exec_date')
-                    exec_sd = execution.get('side')
-                    exec_in = execution.get('size')
-                    exec_px = execution.get('price')
-                    exec_cm = execution.get('commission', self._ZERO)
 
                     sequence = exec_id if sequence is None else min(exec_id, sequence)
 
-                    value = Transaction()
-                    value.tx_site = self._ID
-                    value.tx_code = code
-                    value.tx_type = TransactionType.TRADE
-                    value.tx_acct = AccountType.CASH if is_cash else AccountType.MARGIN
-                    value.tx_oid = exec_od
-                    value.tx_eid = str(exec_id)
-                    value.tx_time = self.__context.parse_iso_timestamp(exec_ts)
-                    value.tx_inst = (exec_in * self._SIDE[exec_sd]) - exec_cm
-                    value.tx_fund = (exec_in * self._SIDE[exec_sd]) * exec_px * -1
+                    value = self._convert_execution(code, account, execution)
 
                     values.append(value)
 
+                    if latest is None or exec_id > latest[0]:
+                        latest = (exec_id, value.tx_time)
+
                 self.__logger.debug('Transactions : %s - fetched=[%s] sequence=[%s]', code, len(values), sequence)
 
                 results = self.__context.save_transactions(values)
 
-                if len(results) <= 0:
-                    break
+                if after is not None:
+
+                    # Walk down to the cursor, since the known ones may have gaps behind them.
+                    if len(executions) < limit:
+                        break
+
+                elif len(results) <= 0:
+                    break  # Reached the known ones.
+
+            if latest is not None:
+                self.__context.save_cursor(self._ID, code, account, latest[0], latest[1])
 
         except Exception as e:
 
             self.__logger.warn('Transaction Failure - %s : %s - %s', code, type(e), e.args)
 
+    def _convert_execution(self, code, account, execution):
+        exec_id = execution.get('id')
+        exec_od = execution.get('child_order_id')
+        exec_ts = execution.get('exec_date')
+        exec_sd = execution.get('side')
+        exec_in = execution.get('size')
+        exec_px = execution.get('price')
+        exec_cm = execution.get('commission', self._ZERO)
+
+        value = Transaction()
+        value.tx_site = self._ID
+        value.tx_code = code
+        value.tx_type = TransactionType.TRADE
+        value.tx_acct = account
+        value.tx_oid = exec_od
+        value.tx_eid = str(exec_id)
+        value.tx_time = self.__context.parse_iso_timestamp(exec_ts)
+        value.tx_inst = (exec_in * self._SIDE[exec_sd]) - exec_cm
+        value.tx_fund = (exec_in * self._SIDE[exec_sd]) * exec_px * -1
+        return value
+
+    def _fetch_executions(self, code, lower, upper):
+
+        account = AccountType.CASH if 'FX_BTC_JPY' != code and not self.__is_futures(code) else AccountType.MARGIN
+
+        limit = int(self.__context.get_property(self._ID, 'tx_limit', 100))
+
+        sequence = upper
+
+        while True:
+
+            # Newest first within (lower, sequence), which shrinks as the pages are fetched.
+            path = '/v1/me/getexecutions?count=%s&product_code=%s&after=%s&before=%s' % (limit, code, lower, sequence)
+
+            executions = self._query_private(path)
+
+            if executions is None:
+                raise Exception('No executions : %s' % path)
+
+            if len(executions) <= 0:
+                break
+
+            sequence = min(e.get('id') for e in executions)
+
+            self.__logger.debug('Backfill : %s - fetched=[%s] range=(%s, %s)', code, len(executions), lower, sequence)
+
+            yield [self._convert_execution(code, account, e) for e in executions]
+
+    def backfill_transactions(self, code, start_id, end_id, *, span=100000):
+
+        ranges = [(code, lower - 1, min(lower + span, end_id)) for lower in range(start_id, end_id, span)]
+
+        return self.__context.backfill_transactions(self._ID, ranges, self._fetch_executions)
+
     def _process_cash(self):
         self._process_balance('/v1/me/getbalance', AccountType.CASH)
 
@@ -428,5 +492,24 @@ def main_historical():
         maturity = maturity + timedelta(days=7)
 
 
+def main_backfill():
+    parser = ArgumentParser(description='Backfill the executions with ids within [start, end).')
+    parser.add_argument('code', help='Product code (e.g. FX_BTC_JPY)')
+    parser.add_argument('start', type=int, help='Inclusive start execution id')
+    parser.add_argument('end', type=int, help='Exclusive end execution id')
+    parser.add_argument('--config', default='~/.cryptowelder', help='Configuration file')
+    parser.add_argument('--span', type=int, default=100000, help='Number of execution ids per range')
+    args = parser.parse_args()
+
+    context = CryptowelderContext(config=args.config, read_only=False, debug=False)
+
+    target = BitflyerWelder(context)
+    stats = target.backfill_transactions(args.code, args.start, args.end, span=args.span)
+
+    if stats['failed'] > 0 or stats['write_failed'] > 0:
+        parser.exit(1, 'Backfill incomplete : %s ranges failed, %s rows failed to write\n'
+                    % (stats['failed'], stats['write_failed']))
+
+
 if __name__ == '__main__':
     main()
@@ -1,11 +1,13 @@
-from datetime import timedelta
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
 from decimal import Decimal
 from hashlib import sha256
 from hmac import new
 from threading import Thread, Lock
-from time import sleep
 from urllib.parse import urlencode
 
+from pytz import utc
+
 from cryptowelder.context import CryptowelderContext, Ticker, Balance, AccountType, UnitType, Transaction, \
     TransactionType
 
@@ -35,21 +37,11 @@ class BitmexWelder:
 
         self.__logger.info('Processing : %s', self.__endpoint)
 
-        while not self.__context.is_closed():
-
-            threads = [
-                Thread(target=self._process_ticker),
-                Thread(target=self._process_margin),
-                Thread(target=self._process_transaction),
-            ]
-
-            for t in threads:
-                t.start()
-
-            for t in threads:
-                t.join()
-
-            sleep(float(self.__context.get_property(self._ID, 'interval', default_interval)))
+        self.__context.run_schedule(self._ID, [
+            ('ticker', self._process_ticker),
+            ('balance', self._process_margin),
+            ('transaction', self._process_transaction),
+        ], default_interval=default_interval)
 
         self.__logger.info('Terminated.')
 
@@ -175,7 +167,7 @@ class BitmexWelder:
 
         cutoff = self.__context.get_now() - timedelta(hours=1)
 
-        threads = []
+        tasks = []
 
         for code, details in self.__code_cache.items():
 
@@ -186,13 +178,9 @@ class BitmexWelder:
 
             multiplier = details[1]
 
-            threads.append(Thread(target=self._fetch_transaction, args=(code, multiplier)))
-
-        for t in threads:
-            t.start()
+            tasks.append((self._fetch_transaction, code, multiplier))
 
-        for t in threads:
-            t.join()
+        self.__context.run_tasks(self._ID, tasks)
 
     def _fetch_transaction(self, code, multiplier, *, limit=100):
 
@@ -205,66 +193,146 @@ class BitmexWelder:
                 'symbol': code,
             }
 
+            # Execution ids are not ordered, so resume in ascending order from the last-seen time when known.
+            cursor = self.__context.fetch_cursor(self._ID, code, AccountType.MARGIN)
+
+            if cursor is not None:
+                parameters['reverse'] = False
+                parameters['startTime'] = cursor.cr_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+            latest = None
+
             while True:
 
                 executions = self._query_private('/api/v1/execution/tradeHistory?' + urlencode(parameters))
 
+                if executions is None and cursor is not None:
+                    latest = None  # Incomplete, retry from the same cursor.
+                    break
+
                 values = []
 
                 for execution in executions if executions is not None else []:
 
-                    value = Transaction()
-                    value.tx_site = self._ID
-                    value.tx_code = execution.get('symbol')
-                    value.tx_acct = AccountType.MARGIN
-                    value.tx_oid = execution.get('orderID')
-                    value.tx_eid = execution.get('execID')
-                    value.tx_time = self.__context.parse_iso_timestamp(execution.get('transactTime'))
+                    value = self._convert_execution(execution, multiplier)
 
-                    side = execution.get('side', '')
-                    comm = Decimal(execution.get('execComm', 0))
+                    values.append(value)
 
-                    if side == '':
+                    if latest is None or value.tx_time > latest[1]:
+                        latest = (value.tx_eid, value.tx_time)
 
-                        value.tx_type = TransactionType.SWAP
+                self.__logger.debug('Transactions - %s : extracted=[%s] offset=[%s]',
+                                    code, len(values), parameters.get('start'))
 
-                        if multiplier >= 0:
-                            value.tx_inst = self._ZERO
-                            value.tx_fund = self._SATOSHI * -comm
-                        else:
-                            value.tx_inst = self._SATOSHI * -comm
-                            value.tx_fund = self._ZERO
+                results = self.__context.save_transactions(values)
 
-                    else:
+                if cursor is None and len(results) <= 0:
+                    break  # Reached the known ones.
 
-                        value.tx_type = TransactionType.TRADE
+                if cursor is not None and len(values) < limit:
+                    break  # Reached the newest one.
 
-                        sign = +1 if side == 'Buy' else -1 if side == 'Sell' else 0
-                        size = Decimal(execution.get('lastQty') * sign)
-                        last = Decimal(execution.get('lastPx'))
+                parameters['start'] = parameters['start'] + len(values)
 
-                        if multiplier >= 0:
-                            value.tx_inst = (+size)
-                            value.tx_fund = (-size * multiplier * last - comm) * self._SATOSHI
-                        else:
-                            value.tx_inst = (-size * multiplier / last - comm) * self._SATOSHI
-                            value.tx_fund = (-size)
+            if latest is not None and (cursor is None or latest[1] > cursor.cr_time):
+                self.__context.save_cursor(self._ID, code, AccountType.MARGIN, latest[0], latest[1])
 
-                    values.append(value)
+        except Exception as e:
 
-                self.__logger.debug('Transactions - %s : extracted=[%s] offset=[%s]',
-                                    code, len(values), parameters.get('start'))
+            self.__logger.warn('Transaction Failure - %s : %s - %s', code, type(e), e.args)
 
-                results = self.__context.save_transactions(values)
+    def _convert_execution(self, execution, multiplier):
 
-                if len(results) <= 0:
-                    break
+        value = Transaction()
+        value.tx_site = self._ID
+        value.tx_code = execution.get('symbol')
+        value.tx_acct = AccountType.MARGIN
+        value.tx_oid = execution.get('orderID')
+        value.tx_eid = execution.get('execID')
+        value.tx_time = self.__context.parse_iso_timestamp(execution.get('transactTime'))
 
-                parameters['start'] = parameters['start'] + len(values)
+        side = execution.get('side', '')
+        comm = Decimal(execution.get('execComm', 0))
 
-        except Exception as e:
+        if side == '':
 
-            self.__logger.warn('Transaction Failure - %s : %s - %s', code, type(e), e.args)
+            value.tx_type = TransactionType.SWAP
+
+            if multiplier >= 0:
+                value.tx_inst = self._ZERO
+                value.tx_fund = self._SATOSHI * -comm
+            else:
+                value.tx_inst = self._SATOSHI * -comm
+                value.tx_fund = self._ZERO
+
+        else:
+
+            value.tx_type = TransactionType.TRADE
+
+            sign = +1 if side == 'Buy' else -1 if side == 'Sell' else 0
+            size = Decimal(execution.get('lastQty') * sign)
+            last = Decimal(execution.get('lastPx'))
+
+            if multiplier >= 0:
+                value.tx_inst = (+size)
+                value.tx_fund = (-size * multiplier * last - comm) * self._SATOSHI
+            else:
+                value.tx_inst = (-size * multiplier / last - comm) * self._SATOSHI
+                value.tx_fund = (-size)
+
+        return value
+
+    def _fetch_executions(self, code, multiplier, start, end):
+
+        limit = int(self.__context.get_property(self._ID, 'tx_limit', 500))
+
+        parameters = {
+            'reverse': False,
+            'count': limit,
+            'start': 0,
+            'symbol': code,
+            'startTime': start.astimezone(utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            'endTime': end.astimezone(utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+        }
+
+        while True:
+
+            executions = self._query_private('/api/v1/execution/tradeHistory?' + urlencode(parameters))
+
+            if executions is None:
+                raise Exception('No executions : %s' % parameters)
+
+            if len(executions) <= 0:
+                break
+
+            self.__logger.debug('Backfill - %s : fetched=[%s] range=[%s, %s) offset=[%s]',
+                                code, len(executions), start, end, parameters['start'])
+
+            # Both ends are inclusive, so the ones at the end time are dropped for the next range.
+            values = [self._convert_execution(e, multiplier) for e in executions]
+
+            yield [v for v in values if v.tx_time < end]
+
+            parameters['start'] = parameters['start'] + len(executions)
+
+    def backfill_transactions(self, code, start, end, *, span=timedelta(days=1)):
+
+        instruments = self.__context.requests_get(
+            self.__endpoint + '/api/v1/instrument?' + urlencode({'symbol': code, 'count': 1})
+        )
+
+        if instruments is None or len(instruments) <= 0:
+            raise Exception('Unknown symbol : %s' % code)
+
+        multiplier = instruments[0].get('multiplier')
+
+        ranges = []
+
+        while start < end:
+            ranges.append((code, multiplier, start, min(start + span, end)))
+            start = start + span
+
+        return self.__context.backfill_transactions(self._ID, ranges, self._fetch_executions)
 
 
 def main():
@@ -275,5 +343,30 @@ def main():
     target.run()
 
 
+def main_backfill():
+    parser = ArgumentParser(description='Backfill the executions within [start, end).')
+    parser.add_argument('code', help='Symbol (e.g. XBTUSD)')
+    parser.add_argument('start', help='Inclusive start time in ISO 8601 (e.g. 2019-01-01T00:00:00Z)')
+    parser.add_argument('end', nargs='?', help='Exclusive end time in ISO 8601 (default: now)')
+    parser.add_argument('--config', default='~/.cryptowelder', help='Configuration file')
+    parser.add_argument('--span', type=int, default=24, help='Number of hours per range')
+    args = parser.parse_args()
+
+    start = CryptowelderContext._parse_iso_timestamp(args.start)
+    end = CryptowelderContext._parse_iso_timestamp(args.end) if args.end else datetime.now(tz=utc)
+
+    if start is None or end is None:
+        parser.error('Invalid timestamp : %s, %s' % (args.start, args.end))
+
+    context = CryptowelderContext(config=args.config, read_only=False, debug=False)
+
+    target = BitmexWelder(context)
+    stats = target.backfill_transactions(args.code, start, end, span=timedelta(hours=args.span))
+
+    if stats['failed'] > 0 or stats['write_failed'] > 0:
+        parser.exit(1, 'Backfill incomplete : %s ranges failed, %s rows failed to write\n'
+                    % (stats['failed'], stats['write_failed']))
+
+
 if __name__ == '__main__':
     main()
@@ -1,7 +1,6 @@
 from datetime import timedelta
 from decimal import Decimal
 from threading import Thread
-from time import sleep
 
 from cryptowelder.context import CryptowelderContext, Ticker, Balance, AccountType, UnitType, Transaction, \
     TransactionType
@@ -32,25 +31,26 @@ class BitpointWelder:
 
         self.__logger.info('Processing : %s', self.__endpoint)
 
-        while not self.__context.is_closed():
+        self.__context.run_schedule(self._ID, [
+            ('balance', self._process_balances),
+            ('transaction', self._process_trades),
+        ], default_interval=default_interval)
 
-            token = self._fetch_token()
+        self.__logger.info('Terminated.')
 
-            threads = [
-                Thread(target=self._process_cash, args=(token,)),
-                Thread(target=self._process_coin, args=(token,)),
-                Thread(target=self._process_trade, args=(token,)),
-            ]
+    def _process_balances(self):
 
-            for t in threads:
-                t.start()
+        token = self._fetch_token()
 
-            for t in threads:
-                t.join()
+        tasks = [
+            (self._process_cash, token),
+            (self._process_coin, token),
+        ]
 
-            sleep(float(self.__context.get_property(self._ID, 'interval', default_interval)))
+        self.__context.run_tasks(self._ID, tasks)
 
-        self.__logger.info('Terminated.')
+    def _process_trades(self):
+        self._process_trade(self._fetch_token())
 
     def _fetch_token(self, *, force=False):
 
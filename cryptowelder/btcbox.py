@@ -2,7 +2,6 @@ from decimal import Decimal
 from hashlib import md5, sha256
 from hmac import new
 from threading import Thread, Lock
-from time import sleep
 
 from cryptowelder.context import CryptowelderContext, Ticker, Balance, AccountType, UnitType
 
@@ -30,26 +29,18 @@ class BtcboxWelder:
 
         self.__logger.info('Processing : %s', self.__endpoint)
 
-        while not self.__context.is_closed():
+        self.__context.run_schedule(self._ID, [
+            ('ticker', self._process_tickers),
+            ('balance', self._process_balance),
+        ], default_interval=default_interval)
 
-            threads = [
-                Thread(target=self._process_balance),
-            ]
-
-            coins = self.__context.get_property(self._ID, 'coins', 'btc,eth').split(',')
-
-            for coin in coins:
-                threads.append(Thread(target=self._process_ticker, args=(coin,)))
-
-            for t in threads:
-                t.start()
+        self.__logger.info('Terminated.')
 
-            for t in threads:
-                t.join()
+    def _process_tickers(self):
 
-            sleep(float(self.__context.get_property(self._ID, 'interval', default_interval)))
+        coins = self.__context.get_property(self._ID, 'coins', 'btc,eth').split(',')
 
-        self.__logger.info('Terminated.')
+        self.__context.run_tasks(self._ID, [(self._process_ticker, coin) for coin in coins])
 
     def _process_ticker(self, coin):
 
@@ -2,7 +2,6 @@ from decimal import Decimal
 from hashlib import sha256
 from hmac import new
 from threading import Thread, Lock
-from time import sleep
 from urllib.parse import urlencode
 
 from cryptowelder.context import CryptowelderContext, Ticker, Balance, AccountType, UnitType, Transaction, \
@@ -31,24 +30,22 @@ class CoincheckWelder:
 
         self.__logger.info('Processing : %s', self.__endpoint)
 
-        while not self.__context.is_closed():
+        self.__context.run_schedule(self._ID, [
+            ('ticker', self._process_ticker),
+            ('balance', self._process_balances),
+            ('transaction', self._process_transaction),
+        ], default_interval=default_interval)
 
-            threads = [
-                Thread(target=self._process_ticker),
-                Thread(target=self._process_transaction),
-                Thread(target=self._process_cash),
-                Thread(target=self._process_margin),
-            ]
-
-            for t in threads:
-                t.start()
+        self.__logger.info('Terminated.')
 
-            for t in threads:
-                t.join()
+    def _process_balances(self):
 
-            sleep(float(self.__context.get_property(self._ID, 'interval', default_interval)))
+        tasks = [
+            (self._process_cash,),
+            (self._process_margin,),
+        ]
 
-        self.__logger.info('Terminated.')
+        self.__context.run_tasks(self._ID, tasks)
 
     def _process_ticker(self, *, code='btc_jpy'):
 
@@ -112,6 +109,15 @@ class CoincheckWelder:
                 'order': 'desc',
             }
 
+            # Transactions of all the pairs, in ascending order after the last-seen id when known.
+            cursor = self.__context.fetch_cursor(self._ID, '*', AccountType.CASH)
+
+            if cursor is not None:
+                page[pk] = int(cursor.cr_seq)
+                page['order'] = 'asc'
+
+            latest = None
+
             while True:
 
                 if pk not in page:
@@ -127,6 +133,7 @@ class CoincheckWelder:
                     key = 'data'
 
                 if result is None:
+                    latest = None  # Incomplete, retry from the same cursor.
                     break
 
                 if not result.get('success', True):
@@ -135,7 +142,12 @@ class CoincheckWelder:
                 values = []
 
                 for execution in result.get(key, []):
-                    page[pk] = execution['id'] if pk not in page else min(execution['id'], page[pk])
+                    if pk not in page:
+                        page[pk] = execution['id']
+                    elif cursor is None:
+                        page[pk] = min(execution['id'], page[pk])  # Older
+                    else:
+                        page[pk] = max(execution['id'], page[pk])  # Newer
 
                     value = Transaction()
                     value.tx_site = self._ID
@@ -150,12 +162,21 @@ class CoincheckWelder:
 
                     values.append(value)
 
+                    if latest is None or execution['id'] > latest[0]:
+                        latest = (execution['id'], value.tx_time)
+
                 self.__logger.debug('Transactions : fetched=[%s] sequence=[%s]', len(values), page.get(pk))
 
                 results = self.__context.save_transactions(values)
 
-                if len(results) <= 0:
-                    break
+                if cursor is None and len(results) <= 0:
+                    break  # Reached the known ones.
+
+                if cursor is not None and len(values) <= 0:
+                    break  # Reached the newest one.
+
+            if latest is not None:
+                self.__context.save_cursor(self._ID, '*', AccountType.CASH, latest[0], latest[1])
 
         except Exception as e:
 
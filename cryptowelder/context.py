@@ -1,27 +1,41 @@
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
-from collections import namedtuple
+from collections import namedtuple, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait
 from configparser import ConfigParser
 from datetime import datetime, timedelta
 from decimal import Decimal
+from email.utils import parsedate_to_datetime
 from enum import auto, Enum
+from functools import partial
+from http.cookiejar import DefaultCookiePolicy
 from json import loads
 from logging import Formatter, StreamHandler, DEBUG, INFO, getLogger
 from logging.handlers import TimedRotatingFileHandler, BufferingHandler
 from math import nan
 from os import path
 from re import compile
-from threading import Lock
-from time import sleep
+from queue import Queue, Empty, Full
+from threading import Lock, Thread
+from time import sleep, monotonic, time
 from urllib import parse
 
-from prometheus_client import Gauge, start_http_server, Counter
+from prometheus_client import Gauge, start_http_server, Counter, Histogram
 from pytz import utc
-from requests import get, post, exceptions
-from sqlalchemy import create_engine, Column, String, DateTime, Numeric, Integer, Enum as Type, and_, or_, func, cast
+from requests import Session, exceptions
+from requests.adapters import HTTPAdapter
+from sqlalchemy import create_engine, Column, String, DateTime, Numeric, Integer, Enum as Type, and_, or_, func, \
+    tuple_, case, true, select
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session, aliased
 from sqlalchemy.sql import functions
 
+try:
+    import orjson
+except ImportError:  # Optional
+    orjson = None
+
 
 class CryptowelderContext:
     ENTITY_BASE = declarative_base()
@@ -65,6 +79,35 @@ class CryptowelderContext:
         # Cache
         self.__nonce_lock = defaultdict(lambda: Lock())
         self.__nonce_time = {}
+        self.__known_lock = Lock()
+        self.__known_keys = defaultdict(lambda: OrderedDict())
+        self.__known_warm = False
+        self.__ticker_lock = Lock()
+        self.__ticker_index = None
+        self.__ticker_floor = None
+        self.__bucket_lock = Lock()
+        self.__bucket_sums = {}
+        self.__bucket_range = None
+        self.__bucket_dirty = set()
+        self.__bucket_windows = []
+        self.__bucket_marks = {}
+        self.__purge_cutoffs = {}
+        self.__cursor_lock = Lock()
+        self.__cursor_cache = {}
+        self.__write_lock = Lock()
+        self.__write_queue = None
+        self.__write_thread = None
+        self.__cache_lock = Lock()
+        self.__cache_entries = {}
+        self.__http_lock = Lock()
+        self.__http_sessions = {}
+        self.__http_counts = {}
+        self.__limit_lock = Lock()
+        self.__limit_buckets = {}
+        self.__task_lock = Lock()
+        self.__task_executor = None
+        self.__task_pending = defaultdict(lambda: deque())
+        self.__task_running = defaultdict(lambda: 0)
 
     def _create_config(self, paths):
 
@@ -158,14 +201,50 @@ class CryptowelderContext:
         method(int(port), addr=host)
 
     @staticmethod
-    def _parse(json):
+    def _parse(json, *, decoder=None, select=None):
 
-        if json is None or json == '':
+        if json is None or len(json) == 0:
             return None
 
+        if select is not None:
+            # Unselected objects are dropped as soon as they are decoded, instead of after the whole graph is built.
+            return loads(json, parse_float=Decimal, object_hook=lambda o: o if select(o) else None)
+
+        if decoder == 'orjson' and orjson is not None:
+
+            value = orjson.loads(json)
+
+            if not CryptowelderContext._has_float(value):
+                return value
+
+            # Floats are binary, so fall back to retain the exact Decimal values.
+
         return loads(json, parse_float=Decimal)
 
-    def _request(self, method, *, label='N/A', counter=None):
+    @staticmethod
+    def _has_float(value):
+
+        for v in value.values() if type(value) is dict else value if type(value) is list else [value]:
+
+            t = type(v)
+
+            if t is float:
+                return True
+
+            if (t is dict or t is list) and CryptowelderContext._has_float(v):
+                return True
+
+        return False
+
+    def _get_decoder(self, url):
+
+        host = parse.urlparse(url).netloc
+
+        decoder = self.get_property(self._SECTION, "request_decoder@" + host, None)
+
+        return decoder if decoder is not None else self.get_property(self._SECTION, "request_decoder", 'json')
+
+    def _request(self, method, *, label='N/A', counter=None, limit=None, decoder=None, select=None):
 
         attempt = int(self.get_property(self._SECTION, "request_retry", 2)) + 1
 
@@ -175,6 +254,9 @@ class CryptowelderContext:
 
             count = count + 1
 
+            if limit is not None:
+                self._acquire(limit)
+
             try:
 
                 with method() as r:
@@ -182,11 +264,17 @@ class CryptowelderContext:
                     if counter:
                         counter(r.status_code)
 
+                    delay = self._throttle(limit, r) if limit is not None else None
+
                     if r.ok:
-                        return self._parse(r.text)
+                        return self._parse(r.content, decoder=decoder, select=select)
 
                     self.__logger.debug('[%s %s][%s/%s] %s', r.status_code, r.reason, count, attempt, label)
 
+                    if r.status_code == 429 and delay is not None and count < attempt \
+                            and delay <= float(self.get_property(self._SECTION, "request_timeout", 60)):
+                        continue  # Wait for the bucket to reopen.
+
                     if r.status_code < 500 or count >= attempt:
                         raise Exception(
                             r.status_code,
@@ -206,6 +294,119 @@ class CryptowelderContext:
 
             sleep(float(self.get_property(self._SECTION, "request_sleep", 3.0)))
 
+    def _limit_key(self, url, private):
+
+        host = parse.urlparse(url).netloc
+
+        return host + '/private' if private else host
+
+    def _get_bucket(self, key):
+
+        bucket = self.__limit_buckets.get(key)
+
+        if bucket is None:
+
+            def fetch(name):
+                # "foo@api.example.com/private" -> "foo@api.example.com" -> "foo"
+                for candidate in [name + '@' + key, name + '@' + key.split('/')[0], name]:
+                    value = self.get_property(self._SECTION, candidate, None)
+                    if value is not None:
+                        return float(value)
+                return None
+
+            rate = fetch('request_rate')
+            burst = fetch('request_burst')
+            burst = burst if burst is not None else max(rate if rate is not None else 1.0, 1.0)
+
+            bucket = {'rate': rate, 'burst': burst, 'tokens': burst, 'time': monotonic(), 'until': 0.0}
+
+            self.__limit_buckets[key] = bucket
+
+        return bucket
+
+    def _acquire(self, key, *, counter=Counter('cryptowelder_request_throttle_seconds_total',
+                                               'Total time spent waiting for the HTTP rate limiter.', ['limit'])):
+
+        while True:
+
+            with self.__limit_lock:
+
+                bucket = self._get_bucket(key)
+
+                now = monotonic()
+
+                if bucket['rate'] is not None:
+                    bucket['tokens'] = min(bucket['burst'], bucket['tokens'] + (now - bucket['time']) * bucket['rate'])
+                    bucket['time'] = now
+
+                if bucket['until'] > now:
+                    delay = bucket['until'] - now
+                elif bucket['rate'] is None:
+                    return
+                elif bucket['tokens'] >= 1:
+                    bucket['tokens'] = bucket['tokens'] - 1
+                    return
+                else:
+                    delay = (1 - bucket['tokens']) / bucket['rate']
+
+            counter.labels(limit=key).inc(delay)
+
+            sleep(delay)
+
+    @staticmethod
+    def _parse_delay(value, *, epoch=1000000000):
+
+        if value is None:
+            return None
+
+        try:
+
+            seconds = float(value)
+
+            if seconds >= epoch * 1000:
+                seconds = seconds / 1000 - time()  # Epoch millis
+            elif seconds >= epoch:
+                seconds = seconds - time()  # Epoch seconds
+
+        except ValueError:
+
+            try:
+                seconds = parsedate_to_datetime(value).timestamp() - time()  # HTTP-date
+            except (TypeError, ValueError):
+                return None
+
+        return max(seconds, 0.0)
+
+    def _throttle(self, key, response):
+
+        headers = response.headers if response.headers is not None else {}
+
+        delay = self._parse_delay(headers.get('Retry-After'))
+
+        try:
+            remaining = float(headers.get('X-RateLimit-Remaining'))
+        except (TypeError, ValueError):
+            remaining = None
+
+        if remaining is not None and remaining < 1:
+
+            reset = self._parse_delay(headers.get('X-RateLimit-Reset'))
+
+            if reset is not None:
+                delay = reset if delay is None else max(delay, reset)
+
+        with self.__limit_lock:
+
+            bucket = self._get_bucket(key)
+
+            if remaining is not None and bucket['rate'] is not None:
+                bucket['tokens'] = min(bucket['tokens'], remaining)
+
+            if delay is not None:
+                bucket['until'] = max(bucket['until'], monotonic() + delay)
+
+        return delay
+
     def counter_lambda(self, url, method, *, counter=Counter('cryptowelder_requests_total',
                                                              'Total number of HTTP requests.',
                                                              ['method', 'url_host', 'url_path', 'status'])):
@@ -216,7 +417,69 @@ class CryptowelderContext:
             method=method, url_host=parsed.netloc, url_path=parsed.path, status=code
         ).inc()
 
-    def requests_get(self, url, params=None, **kwargs):
+    def _get_session(self, url):
+
+        parsed = parse.urlparse(url)
+
+        key = parsed.scheme + '://' + parsed.netloc
+
+        with self.__http_lock:
+
+            session = self.__http_sessions.get(key)
+
+            if session is None:
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=int(self.get_property(self._SECTION, "request_pool", 10)),
+                    max_retries=int(self.get_property(self._SECTION, "request_pool_retry", 0)),
+                )
+
+                session = Session()
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))  # Stateless, as before.
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+
+                self.__http_sessions[key] = session
+
+        return session
+
+    def _count_connections(self, url, session, *, counter=Counter('cryptowelder_connections_total',
+                                                                    'Total number of HTTP requests by connection.',
+                                                                    ['url_host', 'type'])):
+
+        parsed = parse.urlparse(url)
+
+        connections = 0
+
+        requests = 0
+
+        for adapter in session.adapters.values():
+
+            managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+
+            for manager in managers:
+
+                for key in manager.pools.keys():
+
+                    try:
+                        pool = manager.pools[key]
+                    except KeyError:
+                        continue  # Evicted
+
+                    connections = connections + pool.num_connections
+                    requests = requests + pool.num_requests
+
+        with self.__http_lock:
+            previous = self.__http_counts.get(id(session), (0, 0))
+            self.__http_counts[id(session)] = (connections, requests)
+
+        created = max(connections - previous[0], 0)
+        reused = max(requests - previous[1] - created, 0)
+
+        counter.labels(url_host=parsed.netloc, type='new').inc(created)
+        counter.labels(url_host=parsed.netloc, type='reused').inc(reused)
+
+    def requests_get(self, url, params=None, *, select=None, **kwargs):
 
         kwargs.setdefault('timeout', int(self.get_property(self._SECTION, "request_timeout", 60)))
 
@@ -224,7 +487,75 @@ class CryptowelderContext:
 
         counter = self.counter_lambda(url, 'GET')
 
-        return self._request(lambda: get(url, params=params, **kwargs), label=url, counter=counter)
+        limit = self._limit_key(url, kwargs.get('headers') is not None)
+
+        session = self._get_session(url)
+
+        try:
+            return self._request(lambda: session.get(url, params=params, **kwargs), label=url, counter=counter,
+                                 limit=limit, decoder=self._get_decoder(url), select=select)
+        finally:
+            self._count_connections(url, session)
+
+    def requests_cached(self, url, params=None, *, ttl=300, **kwargs):
+
+        key = (url, tuple(sorted(params.items())) if params is not None else None)
+
+        return self.get_cached(key, partial(self.requests_get, url, params, **kwargs), ttl=ttl)
+
+    def get_cached(self, key, loader, *, ttl=300,
+                   counter=Counter('cryptowelder_cache_total', 'Reference data cache lookups.', ['result'])):
+
+        # Stale-while-revalidate : expired values are still served, while a single refresh runs in the background.
+        with self.__cache_lock:
+
+            entry = self.__cache_entries.get(key)
+
+            if entry is not None and monotonic() - entry['time'] < float(ttl):
+                counter.labels(result='hit').inc()
+                return entry['value']
+
+            refresh = entry is not None and not entry['loading']
+
+            if entry is not None:
+                entry['loading'] = True
+
+        if entry is None:
+            counter.labels(result='miss').inc()
+            return self._load_cached(key, loader)
+
+        counter.labels(result='stale').inc()
+
+        if refresh:
+            self._get_executor().submit(self._refresh_cached, key, loader)
+
+        return entry['value']
+
+    def _load_cached(self, key, loader):
+
+        value = None
+
+        try:
+
+            value = loader()
+
+            return value
+
+        finally:
+
+            with self.__cache_lock:
+
+                if value is not None:
+                    self.__cache_entries[key] = {'value': value, 'time': monotonic(), 'loading': False}
+                elif key in self.__cache_entries:
+                    self.__cache_entries[key]['loading'] = False
+
+    def _refresh_cached(self, key, loader):
+
+        try:
+            self._load_cached(key, loader)
+        except BaseException as e:
+            self.__logger.warn('Cache Failure : %s - %s - %s', key, type(e), e.args)
 
     def requests_post(self, url, data=None, json=None, **kwargs):
 
@@ -234,7 +565,191 @@ class CryptowelderContext:
 
         counter = self.counter_lambda(url, 'POST')
 
-        return self._request(lambda: post(url, data=data, json=json, **kwargs), label=url, counter=counter)
+        limit = self._limit_key(url, kwargs.get('headers') is not None)
+
+        session = self._get_session(url)
+
+        try:
+            return self._request(lambda: session.post(url, data=data, json=json, **kwargs), label=url, counter=counter,
+                                 limit=limit, decoder=self._get_decoder(url))
+        finally:
+            self._count_connections(url, session)
+
+    def _get_executor(self):
+
+        with self.__task_lock:
+
+            if self.__task_executor is None:
+                self.__task_executor = ThreadPoolExecutor(
+                    max_workers=int(self.get_property(self._SECTION, "task_workers", 32)),
+                    thread_name_prefix='cryptowelder-task',
+                )
+
+        return self.__task_executor
+
+    def _get_task_limit(self, key):
+
+        value = self.get_property(key, "task_limit", None)
+
+        return int(value if value is not None else self.get_property(self._SECTION, "task_limit", 4))
+
+    def _dispatch_tasks(self, key):
+
+        executor = self._get_executor()
+
+        with self.__task_lock:
+
+            pending = self.__task_pending[key]
+
+            limit = self._get_task_limit(key)
+
+            while len(pending) > 0 and self.__task_running[key] < limit:
+
+                task = pending.popleft()
+
+                if task['claimed']:
+                    continue  # Taken by the caller.
+
+                task['claimed'] = True
+
+                self.__task_running[key] = self.__task_running[key] + 1
+
+                executor.submit(self._execute_task, key, task, True)
+
+    def _execute_task(self, key, task, pooled, *,
+                      waits=Histogram('cryptowelder_task_wait_seconds',
+                                      'Time spent by welder tasks waiting for a worker.', ['exchange', 'task']),
+                      durations=Histogram('cryptowelder_task_seconds',
+                                          'Time spent by welder tasks running.', ['exchange', 'task'])):
+
+        name = getattr(task['func'], '__name__', type(task['func']).__name__)
+
+        start = monotonic()
+
+        waits.labels(exchange=key, task=name).observe(start - task['time'])
+
+        try:
+
+            task['future'].set_result(task['func'](*task['args']))
+
+        except BaseException as e:
+
+            self.__logger.warn('Task Failure : %s %s - %s - %s', key, name, type(e), e.args)
+
+            task['future'].set_exception(e)
+
+        finally:
+
+            durations.labels(exchange=key, task=name).observe(monotonic() - start)
+
+            if pooled:
+
+                with self.__task_lock:
+                    self.__task_running[key] = self.__task_running[key] - 1
+
+                self._dispatch_tasks(key)
+
+    def run_tasks(self, key, tasks):
+
+        now = monotonic()
+
+        entries = [{
+            'func': t[0], 'args': t[1:], 'time': now, 'claimed': False, 'future': Future()
+        } for t in tasks]
+
+        with self.__task_lock:
+            self.__task_pending[key].extend(entries)
+
+        self._dispatch_tasks(key)
+
+        # Caller runs whatever the pool has not started yet, so that nested fan-out
+        # (e.g. markets -> products) always progresses even when the quota is saturated.
+        for task in entries:
+
+            with self.__task_lock:
+                claimed = task['claimed']
+                task['claimed'] = True
+
+            if not claimed:
+                self._execute_task(key, task, False)
+
+        futures = [task['future'] for task in entries]
+
+        wait(futures)
+
+        return futures
+
+    def _run_scheduled(self, key, name, func):
+
+        try:
+            func()
+        except BaseException as e:
+            self.__logger.warn('Schedule Failure : %s %s - %s - %s', key, name, type(e), e.args)
+
+    def _get_interval(self, key, name, default_interval):
+
+        value = self.get_property(key, name + '_interval', None)
+
+        if value is None:
+            value = self.get_property(key, 'interval', default_interval)
+
+        return float(value)
+
+    def run_schedule(self, key, jobs, *, default_interval=20, resolution=1.0,
+                     lags=Gauge('cryptowelder_schedule_lag_seconds',
+                                'Delay of scheduled tasks behind their deadlines.', ['exchange', 'task']),
+                     skips=Counter('cryptowelder_schedule_skipped_total',
+                                   'Scheduled runs skipped while the previous run is active.', ['exchange', 'task'])):
+
+        # Each job is (name, func[, interval]), where the interval is either seconds or a callable
+        # re-evaluated on every slot. Without one, '<name>_interval' then 'interval' is looked up.
+        # Deadlines are on a wall-clock grid aligned to the epoch (and therefore to the minute
+        # buckets), independently of how long the previous run took.
+        states = [{
+            'name': j[0], 'func': j[1], 'deadline': None, 'future': None,
+            'interval': j[2] if len(j) > 2 else partial(self._get_interval, key, j[0], default_interval),
+        } for j in jobs]
+
+        while not self.is_closed():
+
+            now = time()
+
+            wake = now + resolution
+
+            for state in states:
+
+                interval = state['interval']
+
+                period = max(float(interval() if callable(interval) else interval), 0.001)
+
+                if state['deadline'] is None:
+                    state['deadline'] = now - now % period  # Current slot, fired immediately.
+
+                if now >= state['deadline']:
+
+                    future = state['future']
+
+                    if future is not None and not future.done():
+
+                        self.__logger.debug('Schedule Skipped : %s %s', key, state['name'])
+
+                        skips.labels(exchange=key, task=state['name']).inc()
+
+                    else:
+
+                        lags.labels(exchange=key, task=state['name']).set(now - state['deadline'])
+
+                        # Runs on the shared task workers, instead of a new thread for every firing.
+                        state['future'] = self._get_executor().submit(
+                            self._run_scheduled, key, state['name'], state['func'])
+
+                    state['deadline'] = now - now % period + period  # Missed slots are coalesced.
+
+                wake = min(wake, state['deadline'])
+
+            sleep(max(wake - time(), 0.0))
+
+        wait([state['future'] for state in states if state['future'] is not None])
 
     def _fetch_proxies(self):
 
@@ -264,6 +779,91 @@ class CryptowelderContext:
     def _is_read_only(self):
         return self.__read_only
 
+    def _upsert(self, session, entity, rows):
+
+        table = entity.__table__
+
+        keys = [c.name for c in table.primary_key.columns]
+
+        # Last one wins within the batch, same as sequential merges.
+        values = list({tuple(r[k] for k in keys): r for r in rows}.values())
+
+        dialect = self.__engine.dialect.name
+
+        if dialect == 'postgresql':
+
+            statement = postgresql.insert(table).values(values)
+
+            statement = statement.on_conflict_do_update(
+                index_elements=keys,
+                set_={c.name: statement.excluded[c.name] for c in table.columns if c.name not in keys}
+            )
+
+            session.execute(statement)
+
+        elif dialect == 'sqlite':
+
+            session.execute(table.insert().prefix_with('OR REPLACE'), values)
+
+        else:
+
+            for v in values:
+                session.merge(entity(**v))
+
+    def _warm_known_keys(self, session):
+
+        with self.__known_lock:
+
+            if self.__known_warm:
+                return
+
+            size = int(self.get_property(self._SECTION, 'known_size', 4096))
+
+            for entity, columns in (
+                    (Product, (Product.pr_site, Product.pr_code)),
+                    (Evaluation, (Evaluation.ev_site, Evaluation.ev_unit)),
+            ):
+                keys = self.__known_keys[entity.__tablename__]
+
+                for r in session.query(*columns).limit(size).all():
+                    keys[tuple(r)] = True
+
+            self.__known_warm = True
+
+    def _is_known(self, entity, key):
+
+        with self.__known_lock:
+
+            keys = self.__known_keys[entity.__tablename__]
+
+            if key not in keys:
+                return False
+
+            keys.move_to_end(key)
+
+            return True
+
+    def _add_known(self, entity, key):
+
+        size = int(self.get_property(self._SECTION, 'known_size', 4096))
+
+        with self.__known_lock:
+
+            keys = self.__known_keys[entity.__tablename__]
+
+            keys[key] = True
+
+            keys.move_to_end(key)
+
+            while len(keys) > size:
+                keys.popitem(last=False)
+
+    def _clear_known(self):
+
+        with self.__known_lock:
+            self.__known_keys.clear()
+            self.__known_warm = False
+
     def save_products(self, products):
 
         candidates = {}
@@ -281,12 +881,18 @@ class CryptowelderContext:
                 if p is None:
                     continue
 
+                self._warm_known_keys(session)
+
+                if self._is_known(Product, (p.pr_site, p.pr_code)):
+                    continue  # Skip Cached
+
                 first = session.query(Product).filter(
                     Product.pr_site == p.pr_site,
                     Product.pr_code == p.pr_code,
                 ).first()
 
                 if first is not None:
+                    self._add_known(Product, (p.pr_site, p.pr_code))
                     continue  # Skip Existing
 
                 value = Product()
@@ -303,12 +909,17 @@ class CryptowelderContext:
                 session.add_all(candidates.values())
                 session.commit()
 
+            for value in candidates.values():
+                self._add_known(Product, (value.pr_site, value.pr_code))
+
         except BaseException as e:
 
             self.__logger.error('Product - %s : %s', type(e), e.args)
 
             session.rollback()
 
+            self._clear_known()
+
             raise e
 
         finally:
@@ -334,12 +945,18 @@ class CryptowelderContext:
                 if candidate is None:
                     continue
 
+                self._warm_known_keys(session)
+
+                if self._is_known(Evaluation, (candidate.ev_site, candidate.ev_unit)):
+                    continue  # Skip Cached
+
                 first = session.query(Evaluation).filter(
                     Evaluation.ev_site == candidate.ev_site,
                     Evaluation.ev_unit == candidate.ev_unit,
                 ).first()
 
                 if first is not None:
+                    self._add_known(Evaluation, (candidate.ev_site, candidate.ev_unit))
                     continue  # Skip Existing
 
                 value = Evaluation()
@@ -356,12 +973,17 @@ class CryptowelderContext:
                 session.add_all(candidates.values())
                 session.commit()
 
+            for value in candidates.values():
+                self._add_known(Evaluation, (value.ev_site, value.ev_unit))
+
         except BaseException as e:
 
             self.__logger.error('Evaluation - %s : %s', type(e), e.args)
 
             session.rollback()
 
+            self._clear_known()
+
             raise e
 
         finally:
@@ -370,37 +992,180 @@ class CryptowelderContext:
 
         return candidates.keys()
 
-    def save_tickers(self, tickers):
-
-        merged = []
+    def fetch_evaluations(self):
 
         session = self.__session()
 
         try:
 
-            for t in tickers if tickers is not None else []:
+            return session.query(Evaluation).all()
 
-                if self._is_read_only():
-                    self.__logger.debug("Skipping : %s", t)
-                    continue
+        finally:
 
-                if t is None:
+            session.close()
+
+    def _is_write_behind(self):
+        return int(self.get_property(self._SECTION, 'write_queue', 0)) > 0
+
+    def _start_writer(self, *, gauge=Gauge('cryptowelder_write_queue', 'Entities pending in the write-behind queue.')):
+
+        with self.__write_lock:
+
+            if self.__write_thread is not None:
+                return
+
+            self.__write_queue = Queue(maxsize=int(self.get_property(self._SECTION, 'write_queue', 0)))
+
+            gauge.set_function(self.__write_queue.qsize)
+
+            self.__write_thread = Thread(daemon=True, target=self._write_loop)
+            self.__write_thread.start()
+
+    def _enqueue(self, entity, values, *, counter=Counter('cryptowelder_write_overflow_total',
+                                                          'Number of entities not queued for write-behind.',
+                                                          ['table', 'policy'])):
+
+        if self._is_read_only():
+
+            for v in values if values is not None else []:
+                self.__logger.debug("Skipping : %s", v)
+
+            return []
+
+        queued = [v for v in values if v is not None] if values is not None else []
+
+        self._start_writer()
+
+        policy = self.get_property(self._SECTION, 'write_policy', 'direct')
+
+        for i, v in enumerate(queued):
+
+            try:
+
+                self.__write_queue.put((entity, v), block=policy == 'block')
+
+            except Full:
+
+                counter.labels(table=entity.__tablename__, policy=policy).inc(len(queued) - i)
+
+                if policy == 'drop':
+                    self.__logger.warning('Dropping %s : %s', entity.__tablename__, len(queued) - i)
+                    return queued[:i]
+
+                self._write(entity, queued[i:])
+
+                break
+
+        return queued
+
+    def _write(self, entity, values):
+
+        writers = {
+            Ticker: self._write_tickers,
+            Balance: self._write_balances,
+            Position: self._write_positions,
+            Metric: self._write_metrics,
+        }
+
+        return writers[entity](values)
+
+    def _write_loop(self):
+
+        while True:
+
+            try:
+
+                items = [self.__write_queue.get(timeout=1.0)]
+
+            except Empty:
+
+                if self.is_closed():
+                    break
+
+                continue
+
+            size = int(self.get_property(self._SECTION, 'write_size', 1000))
+
+            deadline = monotonic() + float(self.get_property(self._SECTION, 'write_latency', 1.0))
+
+            while len(items) < size:
+
+                remaining = deadline - monotonic()
+
+                if remaining <= 0:
+                    break
+
+                try:
+                    items.append(self.__write_queue.get(timeout=remaining))
+                except Empty:
+                    break
+
+            self._flush(items)
+
+    def _flush(self, items, *, gauge=Gauge('cryptowelder_write_flush_seconds',
+                                           'Duration of the last write-behind flush.', ['table'])):
+
+        batches = defaultdict(list)
+
+        for entity, value in items:
+            batches[entity].append(value)
+
+        for entity, values in batches.items():
+
+            start = monotonic()
+
+            try:
+
+                self._write(entity, values)
+
+            except BaseException as e:
+
+                self.__logger.warning('Flush %s - %s : %s', entity.__tablename__, type(e), e.args)
+
+            gauge.labels(table=entity.__tablename__).set(monotonic() - start)
+
+    def save_tickers(self, tickers):
+
+        if self._is_write_behind():
+            return self._enqueue(Ticker, tickers)
+
+        return self._write_tickers(tickers)
+
+    def _write_tickers(self, tickers):
+
+        rows = []
+
+        merged = []
+
+        session = self.__session()
+
+        try:
+
+            for t in tickers if tickers is not None else []:
+
+                if self._is_read_only():
+                    self.__logger.debug("Skipping : %s", t)
                     continue
 
-                truncated = Ticker()
-                truncated.tk_site = t.tk_site
-                truncated.tk_code = t.tk_code
-                truncated.tk_time = self._truncate_datetime(t.tk_time)
-                truncated.tk_ask = t.tk_ask
-                truncated.tk_bid = t.tk_bid
-                truncated.tk_ltp = t.tk_ltp
+                if t is None:
+                    continue
 
-                session.merge(truncated)
+                rows.append({
+                    'tk_site': t.tk_site,
+                    'tk_code': t.tk_code,
+                    'tk_time': self._truncate_datetime(t.tk_time),
+                    'tk_ask': t.tk_ask,
+                    'tk_bid': t.tk_bid,
+                    'tk_ltp': t.tk_ltp,
+                })
 
                 merged.append(t)
 
-            if len(merged) > 0:
+            if len(rows) > 0:
+                self._upsert(session, Ticker, rows)
+                self._update_watermarks(session, [r['tk_time'] for r in rows])
                 session.commit()
+                self._update_ticker_index(rows)
 
         except BaseException as e:
 
@@ -418,6 +1183,15 @@ class CryptowelderContext:
 
     def save_balances(self, balances):
 
+        if self._is_write_behind():
+            return self._enqueue(Balance, balances)
+
+        return self._write_balances(balances)
+
+    def _write_balances(self, balances):
+
+        rows = []
+
         merged = []
 
         session = self.__session()
@@ -430,275 +1204,1703 @@ class CryptowelderContext:
                     self.__logger.debug("Skipping : %s", b)
                     continue
 
-                if b is None:
-                    continue
+                if b is None:
+                    continue
+
+                rows.append({
+                    'bc_site': b.bc_site,
+                    'bc_acct': b.bc_acct,
+                    'bc_unit': b.bc_unit,
+                    'bc_time': self._truncate_datetime(b.bc_time),
+                    'bc_amnt': b.bc_amnt,
+                })
+
+                merged.append(b)
+
+            if len(rows) > 0:
+                self._upsert(session, Balance, rows)
+                self._update_watermarks(session, [r['bc_time'] for r in rows])
+                session.commit()
+
+        except BaseException as e:
+
+            self.__logger.error('Balance - %s : %s', type(e), e.args)
+
+            session.rollback()
+
+            raise e
+
+        finally:
+
+            session.close()
+
+        return merged
+
+    def save_positions(self, positions):
+
+        if self._is_write_behind():
+            return self._enqueue(Position, positions)
+
+        return self._write_positions(positions)
+
+    def _write_positions(self, positions):
+
+        rows = []
+
+        merged = []
+
+        session = self.__session()
+
+        try:
+
+            for p in positions if positions is not None else []:
+
+                if self._is_read_only():
+                    self.__logger.debug("Skipping : %s", p)
+                    continue
+
+                if p is None:
+                    continue
+
+                rows.append({
+                    'ps_site': p.ps_site,
+                    'ps_code': p.ps_code,
+                    'ps_time': self._truncate_datetime(p.ps_time),
+                    'ps_inst': p.ps_inst,
+                    'ps_fund': p.ps_fund,
+                })
+
+                merged.append(p)
+
+            if len(rows) > 0:
+                self._upsert(session, Position, rows)
+                self._update_watermarks(session, [r['ps_time'] for r in rows])
+                session.commit()
+
+        except BaseException as e:
+
+            self.__logger.error('Position - %s : %s', type(e), e.args)
+
+            session.rollback()
+
+            raise e
+
+        finally:
+
+            session.close()
+
+        return merged
+
+    def save_transactions(self, transactions):
+
+        candidates = {}
+
+        session = self.__session()
+
+        try:
+
+            for t in transactions if transactions is not None else []:
+
+                if self._is_read_only():
+                    self.__logger.debug("Skipping : %s", t)
+                    continue
+
+                if t is None:
+                    continue
+
+                truncated = Transaction()
+                truncated.tx_site = t.tx_site
+                truncated.tx_code = t.tx_code
+                truncated.tx_type = t.tx_type
+                truncated.tx_acct = t.tx_acct
+                truncated.tx_oid = t.tx_oid
+                truncated.tx_eid = t.tx_eid
+                truncated.tx_time = t.tx_time.astimezone(utc)
+                truncated.tx_inst = t.tx_inst
+                truncated.tx_fund = t.tx_fund
+
+                candidates[t] = truncated
+
+            existing = self._fetch_transaction_keys(session, candidates.values())
+
+            for t, truncated in list(candidates.items()):
+
+                key = self._transaction_key(truncated)
+
+                if key in existing:
+                    del candidates[t]  # Skip Existing, or duplicate within the batch.
+                    continue
+
+                existing.add(key)
+
+            if len(candidates) > 0:
+
+                session.add_all(candidates.values())
+
+                self._mark_buckets(session, [t.tx_time for t in candidates.values()])
+
+                self._update_watermarks(session, [t.tx_time for t in candidates.values()])
+
+                session.commit()
+
+        except BaseException as e:
+
+            self.__logger.error('Transaction - %s : %s', type(e), e.args)
+
+            session.rollback()
+
+            raise e
+
+        finally:
+
+            session.close()
+
+        return candidates.keys()
+
+    def backfill_transactions(self, key, ranges, fetch, *, batch=1000):
+
+        # Ranges are fetched concurrently under the task quota (and the request rate limits) of the key,
+        # while a single writer bulk-saves the parsed pages as they arrive.
+        pages = Queue(maxsize=max(int(self.get_property(self._SECTION, 'backfill_queue', 64)), 1))
+
+        stats = {'total': len(ranges), 'ranges': 0, 'failed': 0, 'fetched': 0, 'saved': 0, 'write_failed': 0}
+
+        lock = Lock()
+
+        writer = Thread(target=self._write_backfill, args=(key, pages, lock, stats, max(batch, 1)))
+        writer.start()
+
+        try:
+
+            tasks = [(self._fetch_backfill, pages, lock, stats, fetch) + tuple(r) for r in ranges]
+
+            futures = self.run_tasks(key, tasks)
+
+            stats['failed'] = len([f for f in futures if f.exception() is not None])
+
+        finally:
+
+            pages.put(None)
+
+            writer.join()
+
+        self.__logger.info('Backfill : %s - %s ranges (%s failed), fetched=%s saved=%s write_failed=%s', key,
+                           stats['total'], stats['failed'], stats['fetched'], stats['saved'], stats['write_failed'])
+
+        return stats
+
+    def _fetch_backfill(self, pages, lock, stats, fetch, *args):
+
+        for page in fetch(*args):
+            pages.put(page)
+
+        with lock:
+            stats['ranges'] = stats['ranges'] + 1
+
+    def _write_backfill(self, key, pages, lock, stats, batch):
+
+        started = monotonic()
+
+        values = []
+
+        while True:
+
+            page = pages.get()
+
+            if page is not None:
+                values.extend(page)
+
+            if len(values) >= batch or (page is None and len(values) > 0):
+
+                failed = 0
+
+                try:
+
+                    saved = len(self.save_transactions(values))
+
+                except BaseException as e:
+
+                    self.__logger.warn('Backfill Failure : %s - %s - %s', key, type(e), e.args)
+
+                    saved = 0
+
+                    failed = len(values)
+
+                with lock:
+
+                    stats['fetched'] = stats['fetched'] + len(values)
+                    stats['saved'] = stats['saved'] + saved
+                    stats['write_failed'] = stats['write_failed'] + failed
+
+                    elapsed = monotonic() - started
+
+                    self.__logger.info('Backfill : %s - %s/%s ranges, fetched=%s saved=%s (%.2f rows/sec)',
+                                       key, stats['ranges'], stats['total'], stats['fetched'], stats['saved'],
+                                       stats['fetched'] / elapsed if elapsed > 0 else 0)
+
+                values = []
+
+            if page is None:
+                break
+
+    @staticmethod
+    def _transaction_key(t):
+        return t.tx_site, t.tx_code, t.tx_type, t.tx_acct, t.tx_oid, t.tx_eid
+
+    def _fetch_transaction_keys(self, session, transactions):
+
+        columns = (
+            Transaction.tx_site,
+            Transaction.tx_code,
+            Transaction.tx_type,
+            Transaction.tx_acct,
+            Transaction.tx_oid,
+            Transaction.tx_eid,
+        )
+
+        keys = list(dict.fromkeys(self._transaction_key(t) for t in transactions))
+
+        size = max(int(self.get_property(self._SECTION, 'query_batch', 100)), 1)
+
+        existing = set()
+
+        for i in range(0, len(keys), size):
+
+            batch = keys[i:i + size]
+
+            if self.__engine.dialect.name == 'postgresql':
+                condition = tuple_(*columns).in_(batch)
+            else:
+                condition = or_(*[and_(*[c == v for c, v in zip(columns, k)]) for k in batch])
+
+            existing.update(tuple(r) for r in session.query(*columns).filter(condition).all())
+
+        return existing
+
+    def save_metrics(self, metrics):
+
+        if self._is_write_behind():
+            return self._enqueue(Metric, metrics)
+
+        return self._write_metrics(metrics)
+
+    def _write_metrics(self, metrics, *,
+                       gauge=Gauge('cryptowelder_metrics', 'Saved metrics values', ('type', 'name'))
+                       ):
+
+        merged = []
+
+        rows = []
+
+        session = self.__session()
+
+        try:
+
+            for m in metrics if metrics is not None else []:
+
+                if self._is_read_only():
+                    self.__logger.debug("Skipping : %s", m)
+                    continue
+
+                if m is None:
+                    continue
+
+                rows.append({
+                    'mc_type': m.mc_type,
+                    'mc_time': m.mc_time.astimezone(utc),
+                    'mc_name': m.mc_name,
+                    'mc_amnt': m.mc_amnt,
+                })
+
+                merged.append(m)
+
+            if len(merged) > 0:
+                self._upsert(session, Metric, rows)
+                session.commit()
+
+            for m in merged:
+                g = m.mc_amnt if m.mc_amnt is not None else nan
+                gauge.labels(m.mc_type, m.mc_name).set(g)
+
+        except BaseException as e:
+
+            self.__logger.error('Metric - %s : %s', type(e), e.args)
+
+            session.rollback()
+
+            raise e
+
+        finally:
+
+            session.close()
+
+        return merged
+
+    @staticmethod
+    def _purge_ranges(start, end, exclude_minutes):
+
+        if exclude_minutes is None or len(exclude_minutes) == 0:
+            return [(start, end)]
+
+        # Time ranges between the excluded minutes, instead of extracting the minute of each row.
+        ranges = []
+
+        hour = start.replace(minute=0, second=0, microsecond=0)
+
+        while hour < end:
+
+            for minute in range(0, 60):
+
+                if minute in exclude_minutes:
+                    continue
+
+                lo = max(hour + timedelta(minutes=minute), start)
+                hi = min(hour + timedelta(minutes=minute + 1), end)
+
+                if lo >= hi:
+                    continue
+
+                if len(ranges) > 0 and ranges[-1][1] == lo:
+                    ranges[-1] = (ranges[-1][0], hi)
+                else:
+                    ranges.append((lo, hi))
+
+            hour = hour + timedelta(hours=1)
+
+        return ranges
+
+    def _find_purge_start(self, session, start, cutoff, exclude_minutes):
+
+        # Next row to be purged, sought by plain time ranges on the index, so that the empty history is not walked
+        # chunk by chunk. Retained rows found on the way are stepped over, instead of filtered by their minutes.
+        while True:
+
+            query = session.query(functions.min(Metric.mc_time)).filter(Metric.mc_time < cutoff.replace(tzinfo=utc))
+
+            if start is not None:
+                query = query.filter(Metric.mc_time >= start.replace(tzinfo=utc))
+
+            first = query.scalar()
+
+            if first is None:
+                return None
+
+            first = self._to_naive(first)
+
+            if first.minute not in exclude_minutes:
+                return first
+
+            start = first.replace(second=0, microsecond=0) + timedelta(minutes=1)
+
+    def delete_metrics(self, cutoff_time, *, exclude_minutes=None):
+
+        key = tuple(sorted(exclude_minutes)) if exclude_minutes is not None else ()
+
+        cutoff = self._to_naive(cutoff_time)
+
+        chunk = timedelta(minutes=max(int(self.get_property(self._SECTION, 'purge_chunk', 60)), 1))
+
+        count = 0
+
+        session = self.__session()
+
+        try:
+
+            if self._is_read_only():
+
+                self.__logger.debug("Skipping delete : cutoff=[%s], exclude=[%s]", cutoff_time, str(exclude_minutes))
+
+                return count
+
+            # Rows before the last cutoff are already purged, unless written afterwards by another process.
+            start = self.__purge_cutoffs.get(key)
+
+            while start is None or start < cutoff:
+
+                first = self._find_purge_start(session, start, cutoff, key)
+
+                if first is None:
+                    self.__purge_cutoffs[key] = max(self.__purge_cutoffs.get(key, cutoff), cutoff)
+                    break
+
+                start = self._to_naive(first)
+
+                end = min(start + chunk, cutoff)
+
+                ranges = self._purge_ranges(start, end, key)
+
+                began = monotonic()
+
+                deleted = 0
+
+                if len(ranges) > 0:
+
+                    deleted = session.query(Metric).filter(or_(*[and_(
+                        Metric.mc_time >= lo.replace(tzinfo=utc),
+                        Metric.mc_time < hi.replace(tzinfo=utc),
+                    ) for lo, hi in ranges])).delete(synchronize_session=False)
+
+                    session.commit()
+
+                elapsed = monotonic() - began
+
+                self.__logger.debug('Delete : [%s, %s) %s rows (%.1f rows/sec)',
+                                    start, end, deleted, deleted / elapsed if elapsed > 0 else 0)
+
+                count = count + deleted
+
+                start = end
+
+                self.__purge_cutoffs[key] = max(self.__purge_cutoffs.get(key, start), start)
+
+        except BaseException as e:
+
+            self.__logger.error('Delete - %s : %s', type(e), e.args)
+
+            session.rollback()
+
+            raise e
+
+        finally:
+
+            session.close()
+
+        return count
+
+    def save_checkpoint(self, name, step, start_time, end_time):
+
+        session = self.__session()
+
+        try:
+
+            if self._is_read_only():
+                self.__logger.debug("Skipping checkpoint : %s/%s [%s, %s)", name, step, start_time, end_time)
+                return
+
+            checkpoint = Checkpoint()
+            checkpoint.ck_name = name
+            checkpoint.ck_step = step
+            checkpoint.ck_start = start_time.astimezone(utc)
+            checkpoint.ck_end = end_time.astimezone(utc)
+            checkpoint.ck_time = self.get_now().astimezone(utc)
+
+            session.merge(checkpoint)
+
+            session.commit()
+
+        except BaseException as e:
+
+            self.__logger.error('Checkpoint - %s : %s', type(e), e.args)
+
+            session.rollback()
+
+            raise e
+
+        finally:
+
+            session.close()
+
+    def fetch_checkpoints(self, name, step, start_time, end_time):
+
+        session = self.__session()
+
+        try:
+
+            return session.query(Checkpoint).filter(
+                Checkpoint.ck_name == name,
+                Checkpoint.ck_step == step,
+                Checkpoint.ck_start >= start_time,
+                Checkpoint.ck_end <= end_time,
+            ).all()
+
+        finally:
+
+            session.close()
+
+    def fetch_cursor(self, site, code, account):
+
+        key = (site, code, account)
+
+        with self.__cursor_lock:
+
+            if key in self.__cursor_cache:
+                return self.__cursor_cache[key]
+
+        session = self.__session()
+
+        try:
+
+            row = session.query(Cursor).filter(
+                Cursor.cr_site == site,
+                Cursor.cr_code == code,
+                Cursor.cr_acct == account,
+            ).first()
+
+            cursor = None
+
+            if row is not None:
+                cursor = Cursor()
+                cursor.cr_site = row.cr_site
+                cursor.cr_code = row.cr_code
+                cursor.cr_acct = row.cr_acct
+                cursor.cr_seq = row.cr_seq
+                cursor.cr_time = row.cr_time.replace(tzinfo=utc) if row.cr_time is not None else None
+
+        finally:
+
+            session.close()
+
+        with self.__cursor_lock:
+            return self.__cursor_cache.setdefault(key, cursor)
+
+    def save_cursor(self, site, code, account, sequence, time):
+
+        cursor = Cursor()
+        cursor.cr_site = site
+        cursor.cr_code = code
+        cursor.cr_acct = account
+        cursor.cr_seq = str(sequence) if sequence is not None else None
+        cursor.cr_time = time.astimezone(utc) if time is not None else None
+
+        # Kept in memory even when read-only, so that the process itself still syncs incrementally.
+        with self.__cursor_lock:
+            self.__cursor_cache[(site, code, account)] = cursor
+
+        session = self.__session()
+
+        try:
+
+            if self._is_read_only():
+                self.__logger.debug("Skipping cursor : %s", cursor)
+                return
+
+            stored = Cursor()
+            stored.cr_site = cursor.cr_site
+            stored.cr_code = cursor.cr_code
+            stored.cr_acct = cursor.cr_acct
+            stored.cr_seq = cursor.cr_seq
+            stored.cr_time = cursor.cr_time
+            stored.cr_updt = self.get_now().astimezone(utc)
+
+            session.merge(stored)
+
+            session.commit()
+
+        except BaseException as e:
+
+            self.__logger.error('Cursor - %s : %s', type(e), e.args)
+
+            session.rollback()
+
+            raise e
+
+        finally:
+
+            session.close()
+
+    def _fetch_latest_tickers(self, session, time):
+
+        return session.query(
+            Ticker.tk_site,
+            Ticker.tk_code,
+            functions.max(Ticker.tk_time).label('tk_time')
+        ).filter(
+            Ticker.tk_time <= time,
+            or_(
+                and_(Ticker.tk_ask.isnot(None), Ticker.tk_ask != self._ZERO),
+                and_(Ticker.tk_bid.isnot(None), Ticker.tk_bid != self._ZERO),
+                and_(Ticker.tk_ltp.isnot(None), Ticker.tk_ltp != self._ZERO),
+            )
+        ).group_by(
+            Ticker.tk_site,
+            Ticker.tk_code,
+        ).subquery()
+
+    @staticmethod
+    def _to_naive(time):
+        return time.astimezone(utc).replace(tzinfo=None) if time.tzinfo is not None else time
+
+    @staticmethod
+    def _to_decimal(value):
+        return value if value is None or isinstance(value, Decimal) else Decimal(str(value))
+
+    def _is_ticker_indexed(self):
+        return int(self.get_property(self._SECTION, 'ticker_index', 0)) > 0
+
+    def _put_ticker_index(self, ticker, cutoff):
+
+        key = (ticker.tk_site, ticker.tk_code)
+
+        times, values = self.__ticker_index.setdefault(key, ([], []))
+
+        timestamp = self._to_naive(ticker.tk_time)
+
+        priced = [p for p in (ticker.tk_ask, ticker.tk_bid, ticker.tk_ltp) if p is not None and p != self._ZERO]
+
+        i = bisect_left(times, timestamp)
+
+        if i < len(times) and times[i] == timestamp:
+
+            if len(priced) > 0:
+                values[i] = ticker
+            else:
+                del times[i]  # Overwritten without prices, same as skipped by the query.
+                del values[i]
+
+        elif len(priced) > 0:
+
+            times.insert(i, timestamp)
+            values.insert(i, ticker)
+
+        # Retain the latest one before the cutoff, so that anything after the cutoff is still resolvable.
+        i = bisect_right(times, cutoff) - 1
+
+        if i > 0:
+            del times[:i]
+            del values[:i]
+
+    def _warm_ticker_index(self, session):
+
+        minutes = int(self.get_property(self._SECTION, 'ticker_index', 0))
+
+        cutoff = self.get_now() - timedelta(minutes=minutes)
+
+        latest = self._fetch_latest_tickers(session, cutoff)
+
+        tickers = session.query(Ticker).join(latest, and_(
+            Ticker.tk_site == latest.c.tk_site,
+            Ticker.tk_code == latest.c.tk_code,
+            Ticker.tk_time == latest.c.tk_time,
+        )).all() + session.query(Ticker).filter(Ticker.tk_time > cutoff).all()
+
+        self.__ticker_index = {}
+
+        self.__ticker_floor = self._to_naive(cutoff)
+
+        for t in tickers:
+            self._put_ticker_index(t, self.__ticker_floor)
+
+        self.__logger.debug('Ticker Index : %s keys (%s rows)', len(self.__ticker_index), len(tickers))
+
+    def _update_ticker_index(self, rows):
+
+        if not self._is_ticker_indexed():
+            return
+
+        minutes = int(self.get_property(self._SECTION, 'ticker_index', 0))
+
+        cutoff = self._to_naive(self.get_now() - timedelta(minutes=minutes))
+
+        with self.__ticker_lock:
+
+            if self.__ticker_index is None:
+                return  # Not used yet, loaded from the database at first.
+
+            for r in rows:
+
+                ticker = Ticker()
+                ticker.tk_site = r['tk_site']
+                ticker.tk_code = r['tk_code']
+                ticker.tk_time = self._to_naive(r['tk_time'])  # Same as the ones loaded from the database.
+                ticker.tk_ask = self._to_decimal(r['tk_ask'])
+                ticker.tk_bid = self._to_decimal(r['tk_bid'])
+                ticker.tk_ltp = self._to_decimal(r['tk_ltp'])
+
+                self._put_ticker_index(ticker, cutoff)
+
+            self.__ticker_floor = max(self.__ticker_floor, cutoff)
+
+    def _fetch_indexed_tickers(self, time, include_expired):
+
+        session = self.__session()
+
+        try:
+
+            with self.__ticker_lock:
+
+                if self.__ticker_index is None:
+                    self._warm_ticker_index(session)
+
+                target = self._to_naive(time)
+
+                if target < self.__ticker_floor:
+                    return None
+
+                tickers = []
+
+                for times, values in self.__ticker_index.values():
+
+                    i = bisect_right(times, target)
+
+                    if i > 0:
+                        tickers.append(values[i - 1])
+
+            products = {(p.pr_site, p.pr_code): p for p in session.query(Product).all()}
+
+            evaluations = {(e.ev_site, e.ev_unit): e for e in session.query(Evaluation).all()}
+
+        finally:
+
+            session.close()
+
+        results = []
+
+        for t in tickers:
+
+            p = products.get((t.tk_site, t.tk_code))
+
+            if p is None:
+                continue
+
+            if not include_expired and p.pr_expr is not None and self._to_naive(p.pr_expr) < target:
+                continue
+
+            results.append((t, p, evaluations.get((p.pr_site, p.pr_inst)), evaluations.get((p.pr_site, p.pr_fund))))
+
+        return results
+
+    def fetch_tickers(self, time, *, include_expired=False,
+                      counter=Counter('cryptowelder_ticker_index_total',
+                                      'Number of ticker fetches by the in-memory index.', ['result'])):
+
+        dto = namedtuple('TickerDto', ('ticker', 'product', 'inst', 'fund'))
+
+        if self._is_ticker_indexed():
+
+            results = self._fetch_indexed_tickers(time, include_expired)
+
+            counter.labels(result='miss' if results is None else 'hit').inc()
+
+            if results is not None:
+                return [dto(*r) for r in results]
+
+        session = self.__session()
+
+        try:
+
+            latest = self._fetch_latest_tickers(session, time)
+
+            inst = aliased(Evaluation, name='ev_inst')
+            fund = aliased(Evaluation, name='ev_fund')
+
+            results = session.query(
+                Ticker, Product, inst, fund
+            ).join(latest, and_(
+                Ticker.tk_site == latest.c.tk_site,
+                Ticker.tk_code == latest.c.tk_code,
+                Ticker.tk_time == latest.c.tk_time,
+            )).join(Product, and_(
+                Product.pr_site == Ticker.tk_site,
+                Product.pr_code == Ticker.tk_code,
+                or_(
+                    Product.pr_expr.is_(None),
+                    Product.pr_expr >= time,
+                    include_expired,
+                ),
+            )).outerjoin(inst, and_(
+                inst.ev_site == Product.pr_site,
+                inst.ev_unit == Product.pr_inst,
+            )).outerjoin(fund, and_(
+                fund.ev_site == Product.pr_site,
+                fund.ev_unit == Product.pr_fund,
+            )).all()
+
+        finally:
+
+            session.close()
+
+        return [dto(*r) for r in results]
+
+    def _get_query_strategy(self):
+
+        if self.__engine.dialect.name != 'postgresql':
+            return 'portable'
+
+        return self.get_property(self._SECTION, 'query_strategy', 'lateral')
+
+    def _query_latest(self, session, entity, column, time, *, strategy=None):
+
+        # Primary key without the time column : (site, acct, unit) for balances, (site, code) for positions.
+        keys = [c for c in entity.__mapper__.primary_key if c.key != column.key]
+
+        if (strategy or self._get_query_strategy()) == 'lateral':
+
+            # Keys are taken from their master table, and each key descends the primary key index once for its
+            # latest row, instead of scanning all of its history up to the time as DISTINCT ON or GROUP BY do.
+            masters = {
+                Balance: (Account.ac_site, Account.ac_acct, Account.ac_unit),
+                Position: (Product.pr_site, Product.pr_code),
+            }
+
+            lateral = session.query(entity).filter(
+                *[k == m for k, m in zip(keys, masters[entity])], column <= time
+            ).order_by(column.desc()).limit(1).subquery().lateral()
+
+            latest = session.query(lateral).select_from(masters[entity][0].class_).join(lateral, true()).subquery()
+
+        else:
+
+            grouped = session.query(*keys, functions.max(column).label(column.key)).filter(
+                column <= time
+            ).group_by(*keys).subquery()
+
+            latest = session.query(entity).join(grouped, and_(
+                *[c == grouped.c[c.key] for c in keys + [column]]
+            )).subquery()
+
+        return aliased(entity, latest)
+
+    def fetch_balances(self, time):
+
+        session = self.__session()
+
+        try:
+
+            balance = self._query_latest(session, Balance, Balance.bc_time, time)
+
+            results = session.query(
+                balance, Account, Evaluation
+            ).join(Account, and_(
+                Account.ac_site == balance.bc_site,
+                Account.ac_acct == balance.bc_acct,
+                Account.ac_unit == balance.bc_unit,
+            )).join(Evaluation, and_(
+                Evaluation.ev_site == balance.bc_site,
+                Evaluation.ev_unit == balance.bc_unit,
+            )).all()
+
+        finally:
+
+            session.close()
+
+        dto = namedtuple('BalanceDto', ('balance', 'account', 'evaluation'))
+
+        return [dto(*r) for r in results]
+
+    def fetch_positions(self, time):
+
+        session = self.__session()
+
+        try:
+
+            position = self._query_latest(session, Position, Position.ps_time, time)
+
+            inst = aliased(Evaluation, name='ev_inst')
+            fund = aliased(Evaluation, name='ev_fund')
+
+            results = session.query(
+                position, Product, inst, fund
+            ).join(Product, and_(
+                Product.pr_site == position.ps_site,
+                Product.pr_code == position.ps_code,
+                or_(
+                    Product.pr_expr.is_(None),
+                    Product.pr_expr >= time,
+                ),
+            )).outerjoin(inst, and_(
+                inst.ev_site == Product.pr_site,
+                inst.ev_unit == Product.pr_inst,
+            )).outerjoin(fund, and_(
+                fund.ev_site == Product.pr_site,
+                fund.ev_unit == Product.pr_fund,
+            )).all()
+
+        finally:
+
+            session.close()
+
+        dto = namedtuple('PositionDto', ('position', 'product', 'inst', 'fund'))
+
+        return [dto(*r) for r in results]
+
+    def _sweep_latest(self, rows, times, keys, column):
+
+        # Rows are applied in time order, and the latest one per key is taken as of each time.
+
+        rows = sorted(rows, key=lambda r: self._to_naive(getattr(r, column)))
+
+        latest = {}
+
+        results = {}
+
+        index = 0
+
+        for timestamp in sorted(times):
+
+            limit = self._to_naive(timestamp)
+
+            while index < len(rows) and self._to_naive(getattr(rows[index], column)) <= limit:
+                latest[tuple(getattr(rows[index], k) for k in keys)] = rows[index]
+                index = index + 1
+
+            results[timestamp] = list(latest.values())
+
+        return results
+
+    def fetch_tickers_batch(self, times, *, include_expired=False):
+
+        dto = namedtuple('TickerDto', ('ticker', 'product', 'inst', 'fund'))
+
+        if len(times) == 0:
+            return {}
+
+        first, last = min(times), max(times)
+
+        session = self.__session()
+
+        try:
+
+            latest = self._fetch_latest_tickers(session, first)
+
+            rows = session.query(Ticker).join(latest, and_(
+                Ticker.tk_site == latest.c.tk_site,
+                Ticker.tk_code == latest.c.tk_code,
+                Ticker.tk_time == latest.c.tk_time,
+            )).all()
+
+            rows.extend(session.query(Ticker).filter(
+                Ticker.tk_time > first,
+                Ticker.tk_time <= last,
+                or_(
+                    and_(Ticker.tk_ask.isnot(None), Ticker.tk_ask != self._ZERO),
+                    and_(Ticker.tk_bid.isnot(None), Ticker.tk_bid != self._ZERO),
+                    and_(Ticker.tk_ltp.isnot(None), Ticker.tk_ltp != self._ZERO),
+                )
+            ).all())
+
+            products = {(p.pr_site, p.pr_code): p for p in session.query(Product).all()}
+
+            evaluations = {(e.ev_site, e.ev_unit): e for e in session.query(Evaluation).all()}
+
+        finally:
+
+            session.close()
+
+        results = {}
+
+        for timestamp, tickers in self._sweep_latest(rows, times, ('tk_site', 'tk_code'), 'tk_time').items():
+
+            results[timestamp] = []
+
+            for t in tickers:
+
+                p = products.get((t.tk_site, t.tk_code))
+
+                if p is None:
+                    continue
+
+                expired = p.pr_expr is not None and self._to_naive(p.pr_expr) < self._to_naive(timestamp)
+
+                if expired and not include_expired:
+                    continue
+
+                results[timestamp].append(dto(t, p, evaluations.get((p.pr_site, p.pr_inst)),
+                                         evaluations.get((p.pr_site, p.pr_fund))))
+
+        return results
+
+    def fetch_balances_batch(self, times):
+
+        dto = namedtuple('BalanceDto', ('balance', 'account', 'evaluation'))
+
+        if len(times) == 0:
+            return {}
+
+        first, last = min(times), max(times)
+
+        session = self.__session()
+
+        try:
+
+            rows = session.query(self._query_latest(session, Balance, Balance.bc_time, first)).all()
+
+            rows.extend(session.query(Balance).filter(Balance.bc_time > first, Balance.bc_time <= last).all())
+
+            accounts = {(a.ac_site, a.ac_acct, a.ac_unit): a for a in session.query(Account).all()}
+
+            evaluations = {(e.ev_site, e.ev_unit): e for e in session.query(Evaluation).all()}
+
+        finally:
+
+            session.close()
+
+        results = {}
+
+        keys = ('bc_site', 'bc_acct', 'bc_unit')
+
+        for timestamp, balances in self._sweep_latest(rows, times, keys, 'bc_time').items():
+
+            results[timestamp] = []
+
+            for b in balances:
+
+                a = accounts.get((b.bc_site, b.bc_acct.name, b.bc_unit.name))
+
+                e = evaluations.get((b.bc_site, b.bc_unit.name))
+
+                if a is None or e is None:
+                    continue
+
+                results[timestamp].append(dto(b, a, e))
+
+        return results
+
+    def fetch_positions_batch(self, times):
+
+        dto = namedtuple('PositionDto', ('position', 'product', 'inst', 'fund'))
+
+        if len(times) == 0:
+            return {}
+
+        first, last = min(times), max(times)
+
+        session = self.__session()
+
+        try:
+
+            rows = session.query(self._query_latest(session, Position, Position.ps_time, first)).all()
+
+            rows.extend(session.query(Position).filter(Position.ps_time > first, Position.ps_time <= last).all())
+
+            products = {(p.pr_site, p.pr_code): p for p in session.query(Product).all()}
+
+            evaluations = {(e.ev_site, e.ev_unit): e for e in session.query(Evaluation).all()}
+
+        finally:
+
+            session.close()
+
+        results = {}
+
+        for timestamp, positions in self._sweep_latest(rows, times, ('ps_site', 'ps_code'), 'ps_time').items():
+
+            results[timestamp] = []
+
+            for x in positions:
+
+                p = products.get((x.ps_site, x.ps_code))
+
+                if p is None or (p.pr_expr is not None and self._to_naive(p.pr_expr) < self._to_naive(timestamp)):
+                    continue
+
+                results[timestamp].append(dto(x, p, evaluations.get((p.pr_site, p.pr_inst)),
+                                         evaluations.get((p.pr_site, p.pr_fund))))
+
+        return results
+
+    def _query_transactions(self, session, start_time, end_time):
+
+        return session.query(
+            Transaction.tx_site,
+            Transaction.tx_code,
+            functions.count(Transaction.tx_time).label('tx_size'),
+            functions.min(Transaction.tx_time).label('tx_time_min'),
+            functions.max(Transaction.tx_time).label('tx_time_max'),
+            functions.sum(Transaction.tx_inst).label('tx_net_inst'),
+            functions.sum(Transaction.tx_fund).label('tx_net_fund'),
+            functions.sum(func.abs(Transaction.tx_inst)).label('tx_grs_inst'),
+            functions.sum(func.abs(Transaction.tx_fund)).label('tx_grs_fund'),
+        ).filter(
+            Transaction.tx_time >= start_time,
+            Transaction.tx_time < end_time
+        ).group_by(
+            Transaction.tx_site,
+            Transaction.tx_code,
+        ).subquery()
+
+    def _is_bucketed(self):
+        return int(self.get_property(self._SECTION, 'transaction_buckets', 0)) > 0
+
+    @staticmethod
+    def _to_hour(time):
+        return time.replace(minute=0, second=0, microsecond=0)
+
+    def _get_bucket_cutoff(self):
+        return self._to_hour(self._to_naive(self.get_now())) - timedelta(
+            days=int(self.get_property(self._SECTION, 'transaction_buckets', 0)))
+
+    def _get_bucket_settled(self):
+        # Hours before this one are no longer expected to receive rows, and are persisted.
+        return self._to_hour(self._to_naive(self.get_now()) - timedelta(
+            minutes=int(self.get_property(self._SECTION, 'transaction_settle', 60))))
+
+    @classmethod
+    def _add_sums(cls, sums, size, time_min, time_max, net_inst, net_fund, grs_inst, grs_fund):
+
+        # [size, time_min, time_max, net_inst, net_fund, grs_inst, grs_fund], with NULLs skipped as SUM does.
+
+        sums[0] = sums[0] + size
+
+        if time_min is not None:
+            time_min = cls._to_naive(time_min)
+            sums[1] = time_min if sums[1] is None or time_min < sums[1] else sums[1]
+
+        if time_max is not None:
+            time_max = cls._to_naive(time_max)
+            sums[2] = time_max if sums[2] is None or time_max > sums[2] else sums[2]
+
+        for i, value in enumerate((net_inst, net_fund, grs_inst, grs_fund), 3):
+
+            if value is not None:
+                value = cls._to_decimal(value)
+                sums[i] = value if sums[i] is None else sums[i] + value
+
+    @classmethod
+    def _add_row(cls, sums, time, inst, fund):
+        cls._add_sums(sums, 1, time, time, inst, fund,
+                      abs(inst) if inst is not None else None, abs(fund) if fund is not None else None)
+
+    def _add_bucket(self, site, code, time, inst, fund):
+
+        time = self._to_naive(time)
+
+        hour = self._to_hour(time)
+
+        bucket = self.__bucket_sums.setdefault(hour, {})
+
+        self._add_row(bucket.setdefault((site, code), [0, None, None, None, None, None, None]), time, inst, fund)
+
+        return hour
+
+    def _increment_counters(self, session, entity, values):
+
+        # Single key and counter columns, incremented per row lock instead of a table-wide sequence.
+        table = entity.__table__
+
+        key = [c for c in table.columns if c.primary_key][0]
+
+        counter = [c for c in table.columns if not c.primary_key][0]
+
+        values = sorted(values)  # Same locking order across the writers.
+
+        if len(values) == 0:
+            return
+
+        dialect = self.__engine.dialect.name
+
+        if dialect == 'postgresql':
+
+            statement = postgresql.insert(table).values([{key.name: v, counter.name: 1} for v in values])
+
+            session.execute(statement.on_conflict_do_update(
+                index_elements=[key.name], set_={counter.name: counter + 1}
+            ))
+
+            return
+
+        if dialect == 'sqlite':
+
+            session.execute(table.insert().prefix_with('OR IGNORE'), [{key.name: v, counter.name: 0} for v in values])
+
+        else:
+
+            existing = {self._to_naive(r[0]) for r in session.execute(select([key]).where(key.in_(values)))}
+
+            missing = [{key.name: v, counter.name: 0} for v in values if self._to_naive(v) not in existing]
+
+            if len(missing) > 0:
+                session.execute(table.insert(), missing)
+
+        session.execute(table.update().where(key.in_(values)).values({counter.name: counter + 1}))
+
+    def _mark_buckets(self, session, times):
+
+        if not self._is_bucketed():
+            return
+
+        cutoff = self._get_bucket_cutoff()
+
+        hours = {h for h in (self._to_hour(self._to_naive(t)) for t in times) if h >= cutoff}
+
+        # Generations of the written hours, which the readers compare to sum them again from the rows.
+        self._increment_counters(session, TransactionMark, [h.replace(tzinfo=utc) for h in hours])
+
+    def _read_marks(self, session, start_hour, end_hour):
+
+        return {self._to_naive(r.tm_hour): r.tm_seq for r in session.query(TransactionMark).filter(
+            TransactionMark.tm_hour >= start_hour.replace(tzinfo=utc),
+            TransactionMark.tm_hour < end_hour.replace(tzinfo=utc),
+        ).all()}
+
+    def _read_buckets(self, session, start_hour, end_hour):
+
+        persisted = set()
+
+        stale = set()
+
+        records = session.query(TransactionHour).filter(
+            TransactionHour.th_hour >= start_hour.replace(tzinfo=utc),
+            TransactionHour.th_hour < end_hour.replace(tzinfo=utc),
+        ).all()
+
+        for r in records:
+
+            hour = self._to_naive(r.th_hour)
+
+            # Persisted before the latest write of the hour.
+            if (r.th_seq or 0) != self.__bucket_marks.get(hour, 0):
+                stale.add(hour)
+
+        for r in records:
+
+            hour = self._to_naive(r.th_hour)
+
+            if hour in stale:
+                continue
+
+            persisted.add(hour)
+
+            if r.th_size == 0:
+                continue  # Marker of an hour without rows.
+
+            self._add_sums(
+                self.__bucket_sums.setdefault(hour, {}).setdefault(
+                    (r.th_site, r.th_code), [0, None, None, None, None, None, None]),
+                r.th_size, r.th_time_min, r.th_time_max, r.th_net_inst, r.th_net_fund, r.th_grs_inst, r.th_grs_fund
+            )
+
+        ranges = []
+
+        hour = start_hour
+
+        while hour < end_hour:
+
+            if hour not in persisted:
+
+                if len(ranges) > 0 and ranges[-1][1] == hour:
+                    ranges[-1][1] = hour + timedelta(hours=1)
+                else:
+                    ranges.append([hour, hour + timedelta(hours=1)])
+
+                self.__bucket_dirty.add(hour)
+
+            hour = hour + timedelta(hours=1)
+
+        self._read_bucket_rows(session, ranges)
+
+        self.__logger.debug('Transaction Buckets : %s - %s (%s hours persisted)', start_hour, end_hour, len(persisted))
+
+    def _read_bucket_rows(self, session, ranges):
+
+        for lo, hi in ranges:
+
+            rows = session.query(
+                Transaction.tx_site,
+                Transaction.tx_code,
+                Transaction.tx_time,
+                Transaction.tx_inst,
+                Transaction.tx_fund,
+            ).filter(
+                Transaction.tx_time >= lo.replace(tzinfo=utc),
+                Transaction.tx_time < hi.replace(tzinfo=utc),
+            ).all()
+
+            for r in rows:
+                self._add_bucket(*r)
+
+            self.__logger.debug('Transaction Buckets : %s - %s (%s rows)', lo, hi, len(rows))
+
+    def _refresh_buckets(self, session, start_hour, end_hour):
+
+        # Generations are read before the rows, so that the hours written afterwards are refreshed in the next call.
+        marks = self._read_marks(session, start_hour, end_hour)
+
+        known, self.__bucket_marks = self.__bucket_marks, marks
+
+        if self.__bucket_range is None:
+            return
+
+        # Hours written since, by this or other processes such as the backfills, are summed again from the rows.
+        lo, hi = self.__bucket_range
+
+        hours = sorted(h for h in set(marks.keys()) | set(known.keys())
+                       if lo <= h < hi and marks.get(h, 0) != known.get(h, 0))
+
+        if len(hours) == 0:
+            return
+
+        ranges = []
+
+        for hour in hours:
+
+            self.__bucket_sums.pop(hour, None)
+
+            self.__bucket_dirty.add(hour)  # Persisted again, replacing the stale ones.
+
+            if len(ranges) > 0 and ranges[-1][1] == hour:
+                ranges[-1][1] = hour + timedelta(hours=1)
+            else:
+                ranges.append([hour, hour + timedelta(hours=1)])
+
+        self.__bucket_windows[:] = [w for w in self.__bucket_windows if not any(w[0] <= h < w[1] for h in hours)]
+
+        self._read_bucket_rows(session, ranges)
+
+        self.__logger.debug('Transaction Buckets : %s hours refreshed', len(hours))
+
+    def _save_buckets(self, session, *, chunk=500):
+
+        if self._is_read_only():
+            return
+
+        settled = self._get_bucket_settled()
+
+        hours = sorted(h for h in self.__bucket_dirty if h < settled)
+
+        if len(hours) == 0:
+            return
+
+        try:
+
+            for i in range(0, len(hours), chunk):
+
+                values = hours[i:i + chunk]
+
+                session.query(TransactionHour).filter(
+                    TransactionHour.th_hour.in_([h.replace(tzinfo=utc) for h in values])
+                ).delete(synchronize_session=False)
+
+                for hour in values:
+
+                    marker = TransactionHour()
+                    marker.th_site = ''
+                    marker.th_code = ''
+                    marker.th_hour = hour.replace(tzinfo=utc)
+                    marker.th_size = 0
+                    marker.th_seq = self.__bucket_marks.get(hour, 0)
+                    session.add(marker)
+
+                    for (site, code), sums in self.__bucket_sums.get(hour, {}).items():
+                        entity = TransactionHour()
+                        entity.th_site = site
+                        entity.th_code = code
+                        entity.th_hour = hour.replace(tzinfo=utc)
+                        entity.th_size = sums[0]
+                        entity.th_time_min = sums[1].replace(tzinfo=utc) if sums[1] is not None else None
+                        entity.th_time_max = sums[2].replace(tzinfo=utc) if sums[2] is not None else None
+                        entity.th_net_inst = sums[3]
+                        entity.th_net_fund = sums[4]
+                        entity.th_grs_inst = sums[5]
+                        entity.th_grs_fund = sums[6]
+                        entity.th_seq = self.__bucket_marks.get(hour, 0)
+                        session.add(entity)
+
+            session.commit()
+
+            self.__bucket_dirty.difference_update(hours)
+
+            self.__logger.debug('Transaction Buckets : %s hours saved', len(hours))
+
+        except BaseException as e:
+
+            self.__logger.warn('Transaction Buckets - %s : %s', type(e), e.args)
+
+            session.rollback()
+
+    def _load_buckets(self, session, start_hour, end_hour):
+
+        cutoff = self._get_bucket_cutoff()
+
+        if self.__bucket_range is not None and self.__bucket_range[0] < cutoff:
+
+            for hour in [h for h in self.__bucket_sums.keys() if h < cutoff]:
+                del self.__bucket_sums[hour]
+
+            self.__bucket_dirty.difference_update([h for h in self.__bucket_dirty if h < cutoff])
+
+            self.__bucket_windows[:] = [w for w in self.__bucket_windows if w[0] >= cutoff]
+
+            self.__bucket_range = (cutoff, max(self.__bucket_range[1], cutoff))
+
+            if not self._is_read_only():
+
+                session.query(TransactionMark).filter(
+                    TransactionMark.tm_hour < cutoff.replace(tzinfo=utc)
+                ).delete(synchronize_session=False)
+
+                session.commit()
+
+        if self.__bucket_range is None:
+            self._refresh_buckets(session, start_hour, end_hour)
+        else:
+            self._refresh_buckets(session, min(self.__bucket_range[0], start_hour),
+                                  max(self.__bucket_range[1], end_hour))
+
+        if self.__bucket_range is None:
+            ranges = [(start_hour, end_hour)]
+        else:
+            ranges = [(start_hour, self.__bucket_range[0]), (self.__bucket_range[1], end_hour)]
+
+        for lo, hi in ranges:
+
+            if lo < hi:
+                self._read_buckets(session, lo, hi)
+
+        if self.__bucket_range is None:
+            self.__bucket_range = (start_hour, end_hour)
+        else:
+            self.__bucket_range = (min(self.__bucket_range[0], start_hour), max(self.__bucket_range[1], end_hour))
+
+        self._save_buckets(session)
+
+    def _add_hours(self, totals, start_hour, end_hour):
+
+        hour = start_hour
+
+        while hour < end_hour:
+
+            for key, sums in self.__bucket_sums.get(hour, {}).items():
+                self._add_sums(totals.setdefault(key, [0, None, None, None, None, None, None]), *sums)
 
-                truncated = Balance()
-                truncated.bc_site = b.bc_site
-                truncated.bc_acct = b.bc_acct
-                truncated.bc_unit = b.bc_unit
-                truncated.bc_time = self._truncate_datetime(b.bc_time)
-                truncated.bc_amnt = b.bc_amnt
+            hour = hour + timedelta(hours=1)
 
-                session.merge(truncated)
+    def _expire_hours(self, totals, start_hour, end_hour, expiry):
 
-                merged.append(b)
+        # Additive sums are subtracted, while the minimum time is taken from the earliest hour remaining.
 
-            if len(merged) > 0:
-                session.commit()
+        expired = set()
 
-        except BaseException as e:
+        hour = start_hour
 
-            self.__logger.error('Balance - %s : %s', type(e), e.args)
+        while hour < expiry:
 
-            session.rollback()
+            for key, sums in self.__bucket_sums.get(hour, {}).items():
 
-            raise e
+                values = totals[key]
 
-        finally:
+                values[0] = values[0] - sums[0]
 
-            session.close()
+                for i in range(3, 7):
+                    if sums[i] is not None:
+                        values[i] = values[i] - sums[i]
 
-        return merged
+                expired.add(key)
 
-    def save_positions(self, positions):
+            hour = hour + timedelta(hours=1)
 
-        merged = []
+        for key in expired:
 
-        session = self.__session()
+            values = totals[key]
 
-        try:
+            if values[0] == 0:
+                del totals[key]
+                continue
 
-            for p in positions if positions is not None else []:
+            if any(values[i] == 0 for i in range(3, 7)):
+                # Ambiguous with a sum of NULLs only, which is NULL instead of zero.
+                values[:] = [0, None, None, None, None, None, None]
+                self._add_hours({key: values}, expiry, end_hour)
+                continue
 
-                if self._is_read_only():
-                    self.__logger.debug("Skipping : %s", p)
-                    continue
+            hour = expiry
 
-                if p is None:
-                    continue
+            while hour < end_hour:
 
-                truncated = Position()
-                truncated.ps_site = p.ps_site
-                truncated.ps_code = p.ps_code
-                truncated.ps_time = self._truncate_datetime(p.ps_time)
-                truncated.ps_inst = p.ps_inst
-                truncated.ps_fund = p.ps_fund
+                sums = self.__bucket_sums.get(hour, {}).get(key)
 
-                session.merge(truncated)
+                if sums is not None:
+                    values[1] = sums[1]
+                    break
 
-                merged.append(p)
+                hour = hour + timedelta(hours=1)
 
-            if len(merged) > 0:
-                session.commit()
+    def _sum_buckets(self, start_hour, end_hour, *, limit=16):
 
-        except BaseException as e:
+        window = None
 
-            self.__logger.error('Position - %s : %s', type(e), e.args)
+        cost = None
 
-            session.rollback()
+        for w in self.__bucket_windows:
 
-            raise e
+            # Windows slide forward only, by adding the new hours and subtracting the expired ones.
+            if not w[0] <= start_hour < w[1] <= end_hour:
+                continue
 
-        finally:
+            delta = (start_hour - w[0]) + (end_hour - w[1])
 
-            session.close()
+            if cost is None or delta < cost:
+                window = w
+                cost = delta
 
-        return merged
+        if window is not None and window[0] == start_hour and window[1] == end_hour:
 
-    def save_transactions(self, transactions):
+            self.__bucket_windows.remove(window)
 
-        candidates = {}
+            self.__bucket_windows.append(window)
 
-        session = self.__session()
+            return {k: list(v) for k, v in window[2].items()}
 
-        try:
+        if window is None:
 
-            for t in transactions if transactions is not None else []:
+            totals = {}
 
-                if self._is_read_only():
-                    self.__logger.debug("Skipping : %s", t)
-                    continue
+            self._add_hours(totals, start_hour, end_hour)
 
-                if t is None:
-                    continue
+        else:
 
-                # TODO: Optimize by querying in batches.
-                first = session.query(Transaction).filter(
-                    Transaction.tx_site == t.tx_site,
-                    Transaction.tx_code == t.tx_code,
-                    Transaction.tx_type == t.tx_type,
-                    Transaction.tx_acct == t.tx_acct,
-                    Transaction.tx_oid == t.tx_oid,
-                    Transaction.tx_eid == t.tx_eid,
-                ).first()
+            totals = {k: list(v) for k, v in window[2].items()}
 
-                if first is not None:
-                    continue  # Skip Existing
+            self._add_hours(totals, window[1], end_hour)
 
-                truncated = Transaction()
-                truncated.tx_site = t.tx_site
-                truncated.tx_code = t.tx_code
-                truncated.tx_type = t.tx_type
-                truncated.tx_acct = t.tx_acct
-                truncated.tx_oid = t.tx_oid
-                truncated.tx_eid = t.tx_eid
-                truncated.tx_time = t.tx_time.astimezone(utc)
-                truncated.tx_inst = t.tx_inst
-                truncated.tx_fund = t.tx_fund
+            self._expire_hours(totals, window[0], end_hour, start_hour)
 
-                candidates[t] = truncated
+        self.__bucket_windows.append([start_hour, end_hour, totals])
 
-            if len(candidates) > 0:
-                session.add_all(candidates.values())
-                session.commit()
+        del self.__bucket_windows[:-limit]
 
-        except BaseException as e:
+        return {k: list(v) for k, v in totals.items()}
 
-            self.__logger.error('Transaction - %s : %s', type(e), e.args)
+    def _query_transaction_windows(self, session, totals, ranges):
 
-            session.rollback()
+        keys = [k for k, v in ranges.items() if len(v) > 0]
 
-            raise e
+        if len(keys) == 0:
+            return
 
-        finally:
+        conditions = [or_(*[and_(
+            Transaction.tx_time >= lo.replace(tzinfo=utc),
+            Transaction.tx_time < hi.replace(tzinfo=utc),
+        ) for lo, hi in ranges[k]]) for k in keys]
 
-            session.close()
+        columns = []
 
-        return candidates.keys()
+        # Conditional aggregates per window, in a single scan of the union.
+        for c in conditions:
+            columns.extend([
+                functions.count(case([(c, Transaction.tx_time)])),
+                functions.min(case([(c, Transaction.tx_time)])),
+                functions.max(case([(c, Transaction.tx_time)])),
+                functions.sum(case([(c, Transaction.tx_inst)])),
+                functions.sum(case([(c, Transaction.tx_fund)])),
+                functions.sum(case([(c, func.abs(Transaction.tx_inst))])),
+                functions.sum(case([(c, func.abs(Transaction.tx_fund))])),
+            ])
 
-    def save_metrics(self, metrics, *,
-                     gauge=Gauge('cryptowelder_metrics', 'Saved metrics values', ('type', 'name'))
-                     ):
+        rows = session.query(
+            Transaction.tx_site,
+            Transaction.tx_code,
+            *columns
+        ).filter(
+            or_(*conditions)
+        ).group_by(
+            Transaction.tx_site,
+            Transaction.tx_code,
+        ).all()
 
-        merged = []
+        for r in rows:
 
-        session = self.__session()
+            for i, key in enumerate(keys):
 
-        try:
+                sums = r[2 + i * 7:9 + i * 7]
 
-            for m in metrics if metrics is not None else []:
+                if sums[0] > 0:
+                    self._add_sums(totals[key].setdefault((r[0], r[1]), [0, None, None, None, None, None, None]), *sums)
 
-                if self._is_read_only():
-                    self.__logger.debug("Skipping : %s", m)
-                    continue
+    def fetch_transaction_windows(self, windows, end_time):
 
-                if m is None:
-                    continue
+        dto = namedtuple('TransactionDto', (
+            'tx_site', 'tx_code', 'tx_size', 'tx_time_min', 'tx_time_max',
+            'tx_net_inst', 'tx_net_fund', 'tx_grs_inst', 'tx_grs_fund',
+            'product', 'ev_inst', 'ev_fund'
+        ))
 
-                value = Metric()
-                value.mc_type = m.mc_type
-                value.mc_time = m.mc_time.astimezone(utc)
-                value.mc_name = m.mc_name
-                value.mc_amnt = m.mc_amnt
+        end = self._to_naive(end_time)
 
-                session.merge(value)
+        end_hour = self._to_hour(end)
 
-                merged.append(m)
+        cutoff = self._get_bucket_cutoff() if self._is_bucketed() else None
 
-            if len(merged) > 0:
-                session.commit()
+        totals = {}
 
-            for m in merged:
-                g = m.mc_amnt if m.mc_amnt is not None else nan
-                gauge.labels(m.mc_type, m.mc_name).set(g)
+        ranges = {}
 
-        except BaseException as e:
+        hours = {}
 
-            self.__logger.error('Metric - %s : %s', type(e), e.args)
+        for key, start_time in windows.items():
 
-            session.rollback()
+            start = self._to_naive(start_time)
 
-            raise e
+            totals[key] = {}
 
-        finally:
+            ranges[key] = [(start, end)]
 
-            session.close()
+            if cutoff is None:
+                continue
 
-        return merged
+            # Whole hours in between are summed from the buckets, and the partial ones at each end are queried.
+            start_hour = self._to_hour(start) + (timedelta(hours=1) if start != self._to_hour(start) else timedelta())
+            start_hour = max(start_hour, cutoff)
 
-    def delete_metrics(self, cutoff_time, *, exclude_minutes=None):
+            if start_hour < end_hour:
+                hours[key] = start_hour
+                ranges[key] = [(lo, hi) for lo, hi in [(start, start_hour), (end_hour, end)] if lo < hi]
 
         session = self.__session()
 
         try:
 
-            if self._is_read_only():
+            if len(hours) > 0:
 
-                self.__logger.debug("Skipping delete : cutoff=[%s], exclude=[%s]", cutoff_time, str(exclude_minutes))
+                with self.__bucket_lock:
 
-                count = 0
+                    self._load_buckets(session, min(hours.values()), end_hour)
 
-            else:
+                    for key, start_hour in hours.items():
+                        totals[key] = self._sum_buckets(start_hour, end_hour)
 
-                filters = [Metric.mc_time < cutoff_time]
+            self._query_transaction_windows(session, totals, ranges)
 
-                if exclude_minutes is not None and len(exclude_minutes) > 0:
-                    filters.append(
-                        cast(
-                            func.extract('minute', Metric.mc_time),
-                            Integer
-                        ).notin_(exclude_minutes)
-                    )
+            products = {(p.pr_site, p.pr_code): p for p in session.query(Product).all()}
 
-                count = session.query(Metric).filter(*filters).delete(synchronize_session='fetch')
+            evaluations = {(e.ev_site, e.ev_unit): e for e in session.query(Evaluation).all()}
 
-                if count > 0:
-                    session.commit()
+        finally:
 
-        except BaseException as e:
+            session.close()
 
-            self.__logger.error('Delete - %s : %s', type(e), e.args)
+        results = {}
 
-            session.rollback()
+        for key, values in totals.items():
 
-            raise e
+            results[key] = []
 
-        finally:
+            for (site, code), sums in values.items():
 
-            session.close()
+                p = products.get((site, code))
 
-        return count
+                if p is None:
+                    continue
+
+                results[key].append(dto(site, code, *sums, p, evaluations.get((p.pr_site, p.pr_inst)),
+                                        evaluations.get((p.pr_site, p.pr_fund))))
+
+        return results
+
+    def fetch_transactions(self, start_time, end_time):
+
+        if self._is_bucketed():
+            return self.fetch_transaction_windows({None: start_time}, end_time)[None]
 
-    def fetch_tickers(self, time, *, include_expired=False):
+        dto = namedtuple('TransactionDto', (
+            'tx_site', 'tx_code', 'tx_size', 'tx_time_min', 'tx_time_max',
+            'tx_net_inst', 'tx_net_fund', 'tx_grs_inst', 'tx_grs_fund',
+            'product', 'ev_inst', 'ev_fund'
+        ))
 
         session = self.__session()
 
         try:
 
-            latest = session.query(
-                Ticker.tk_site,
-                Ticker.tk_code,
-                functions.max(Ticker.tk_time).label('tk_time')
-            ).filter(
-                Ticker.tk_time <= time,
-                or_(
-                    and_(Ticker.tk_ask.isnot(None), Ticker.tk_ask != self._ZERO),
-                    and_(Ticker.tk_bid.isnot(None), Ticker.tk_bid != self._ZERO),
-                    and_(Ticker.tk_ltp.isnot(None), Ticker.tk_ltp != self._ZERO),
-                )
-            ).group_by(
-                Ticker.tk_site,
-                Ticker.tk_code,
-            ).subquery()
+            transactions = self._query_transactions(session, start_time, end_time)
 
             inst = aliased(Evaluation, name='ev_inst')
             fund = aliased(Evaluation, name='ev_fund')
 
             results = session.query(
-                Ticker, Product, inst, fund
-            ).join(latest, and_(
-                Ticker.tk_site == latest.c.tk_site,
-                Ticker.tk_code == latest.c.tk_code,
-                Ticker.tk_time == latest.c.tk_time,
-            )).join(Product, and_(
-                Product.pr_site == Ticker.tk_site,
-                Product.pr_code == Ticker.tk_code,
-                or_(
-                    Product.pr_expr.is_(None),
-                    Product.pr_expr >= time,
-                    include_expired,
-                ),
+                transactions, Product, inst, fund
+            ).join(Product, and_(
+                Product.pr_site == transactions.c.tx_site,
+                Product.pr_code == transactions.c.tx_code,
             )).outerjoin(inst, and_(
                 inst.ev_site == Product.pr_site,
                 inst.ev_unit == Product.pr_inst,
@@ -711,153 +2913,71 @@ class CryptowelderContext:
 
             session.close()
 
-        dto = namedtuple('TickerDto', ('ticker', 'product', 'inst', 'fund'))
-
         return [dto(*r) for r in results]
 
-    def fetch_balances(self, time):
-
-        session = self.__session()
-
-        try:
-
-            latest = session.query(
-                Balance.bc_site,
-                Balance.bc_acct,
-                Balance.bc_unit,
-                functions.max(Balance.bc_time).label('bc_time')
-            ).filter(
-                Balance.bc_time <= time
-            ).group_by(
-                Balance.bc_site,
-                Balance.bc_acct,
-                Balance.bc_unit,
-            ).subquery()
+    def _is_watermarked(self):
+        return int(self.get_property(self._SECTION, 'watermark', 0)) > 0
 
-            results = session.query(
-                Balance, Account, Evaluation
-            ).join(latest, and_(
-                Balance.bc_site == latest.c.bc_site,
-                Balance.bc_acct == latest.c.bc_acct,
-                Balance.bc_unit == latest.c.bc_unit,
-                Balance.bc_time == latest.c.bc_time,
-            )).join(Account, and_(
-                Account.ac_site == Balance.bc_site,
-                Account.ac_acct == Balance.bc_acct,
-                Account.ac_unit == Balance.bc_unit,
-            )).join(Evaluation, and_(
-                Evaluation.ev_site == Balance.bc_site,
-                Evaluation.ev_unit == Balance.bc_unit,
-            )).all()
+    def _update_watermarks(self, session, times):
 
-        finally:
+        if not self._is_watermarked():
+            return
 
-            session.close()
+        # Each written minute counts its writes, so that the counts at or before a time move whenever any of its
+        # inputs is inserted or updated, including late rows and upserts of the same minute.
+        minutes = {self._to_naive(t).replace(second=0, microsecond=0, tzinfo=utc) for t in times}
 
-        dto = namedtuple('BalanceDto', ('balance', 'account', 'evaluation'))
+        self._increment_counters(session, Watermark, list(minutes))
 
-        return [dto(*r) for r in results]
+    def fetch_watermark(self, time):
 
-    def fetch_positions(self, time):
+        if not self._is_watermarked():
+            return None
 
         session = self.__session()
 
         try:
 
-            latest = session.query(
-                Position.ps_site,
-                Position.ps_code,
-                functions.max(Position.ps_time).label('ps_time')
-            ).filter(
-                Position.ps_time <= time
-            ).group_by(
-                Position.ps_site,
-                Position.ps_code,
-            ).subquery()
-
-            inst = aliased(Evaluation, name='ev_inst')
-            fund = aliased(Evaluation, name='ev_fund')
+            # Number of the minutes and their writes visible at the time, shared by all the writer processes.
+            count, total = session.query(functions.count(Watermark.wm_time), functions.sum(Watermark.wm_seq)).filter(
+                Watermark.wm_time <= time.astimezone(utc)
+            ).one()
 
-            results = session.query(
-                Position, Product, inst, fund
-            ).join(latest, and_(
-                Position.ps_site == latest.c.ps_site,
-                Position.ps_code == latest.c.ps_code,
-                Position.ps_time == latest.c.ps_time,
-            )).join(Product, and_(
-                Product.pr_site == Position.ps_site,
-                Product.pr_code == Position.ps_code,
-                or_(
-                    Product.pr_expr.is_(None),
-                    Product.pr_expr >= time,
-                ),
-            )).outerjoin(inst, and_(
-                inst.ev_site == Product.pr_site,
-                inst.ev_unit == Product.pr_inst,
-            )).outerjoin(fund, and_(
-                fund.ev_site == Product.pr_site,
-                fund.ev_unit == Product.pr_fund,
-            )).all()
+            return (count, total) if count > 0 else None
 
         finally:
 
             session.close()
 
-        dto = namedtuple('PositionDto', ('position', 'product', 'inst', 'fund'))
-
-        return [dto(*r) for r in results]
-
-    def fetch_transactions(self, start_time, end_time):
+    def delete_watermarks(self, cutoff_time):
 
         session = self.__session()
 
         try:
 
-            transactions = session.query(
-                Transaction.tx_site,
-                Transaction.tx_code,
-                functions.count(Transaction.tx_time).label('tx_size'),
-                functions.min(Transaction.tx_time).label('tx_time_min'),
-                functions.max(Transaction.tx_time).label('tx_time_max'),
-                functions.sum(Transaction.tx_inst).label('tx_net_inst'),
-                functions.sum(Transaction.tx_fund).label('tx_net_fund'),
-                functions.sum(func.abs(Transaction.tx_inst)).label('tx_grs_inst'),
-                functions.sum(func.abs(Transaction.tx_fund)).label('tx_grs_fund'),
-            ).filter(
-                Transaction.tx_time >= start_time,
-                Transaction.tx_time < end_time
-            ).group_by(
-                Transaction.tx_site,
-                Transaction.tx_code,
-            ).subquery()
+            if self._is_read_only():
+                self.__logger.debug("Skipping delete : watermark cutoff=[%s]", cutoff_time)
+                return 0
 
-            inst = aliased(Evaluation, name='ev_inst')
-            fund = aliased(Evaluation, name='ev_fund')
+            count = session.query(Watermark).filter(
+                Watermark.wm_time < cutoff_time.astimezone(utc)
+            ).delete(synchronize_session=False)
 
-            results = session.query(
-                transactions, Product, inst, fund
-            ).join(Product, and_(
-                Product.pr_site == transactions.c.tx_site,
-                Product.pr_code == transactions.c.tx_code,
-            )).outerjoin(inst, and_(
-                inst.ev_site == Product.pr_site,
-                inst.ev_unit == Product.pr_inst,
-            )).outerjoin(fund, and_(
-                fund.ev_site == Product.pr_site,
-                fund.ev_unit == Product.pr_fund,
-            )).all()
+            session.commit()
 
-        finally:
+            return count
 
-            session.close()
+        except BaseException as e:
 
-        dto = namedtuple('TransactionDto', (
-            'tx_site', 'tx_code', 'tx_size', 'tx_time_min', 'tx_time_max',
-            'tx_net_inst', 'tx_net_fund', 'tx_grs_inst', 'tx_grs_fund',
-            'product', 'ev_inst', 'ev_fund'
-        ))
+            self.__logger.error('Delete - %s : %s', type(e), e.args)
 
-        return [dto(*r) for r in results]
+            session.rollback()
+
+            raise e
+
+        finally:
+
+            session.close()
 
 
 class AccountType(Enum):
@@ -1042,6 +3162,103 @@ class Transaction(CryptowelderContext.ENTITY_BASE, BaseEntity):
         })
 
 
+class TransactionHour(CryptowelderContext.ENTITY_BASE, BaseEntity):
+    __tablename__ = 't_transaction_hour'
+    th_site = Column(String, primary_key=True)
+    th_code = Column(String, primary_key=True)
+    th_hour = Column(DateTime, primary_key=True)
+    th_size = Column(Integer, nullable=False)
+    th_time_min = Column(DateTime)
+    th_time_max = Column(DateTime)
+    th_net_inst = Column(Numeric)
+    th_net_fund = Column(Numeric)
+    th_grs_inst = Column(Numeric)
+    th_grs_fund = Column(Numeric)
+    th_seq = Column(Integer)
+
+    def __str__(self):
+        return BaseEntity._to_string({
+            'table': self.__tablename__,
+            'site': self.th_site,
+            'code': self.th_code,
+            'hour': self.th_hour,
+            'size': self.th_size,
+            'time_min': self.th_time_min,
+            'time_max': self.th_time_max,
+            'net_inst': self.th_net_inst,
+            'net_fund': self.th_net_fund,
+            'grs_inst': self.th_grs_inst,
+            'grs_fund': self.th_grs_fund,
+            'seq': self.th_seq,
+        })
+
+
+class TransactionMark(CryptowelderContext.ENTITY_BASE, BaseEntity):
+    __tablename__ = 't_transaction_mark'
+    tm_hour = Column(DateTime, primary_key=True)
+    tm_seq = Column(Integer, nullable=False)
+
+    def __str__(self):
+        return BaseEntity._to_string({
+            'table': self.__tablename__,
+            'hour': self.tm_hour,
+            'seq': self.tm_seq,
+        })
+
+
+class Checkpoint(CryptowelderContext.ENTITY_BASE, BaseEntity):
+    __tablename__ = 't_checkpoint'
+    ck_name = Column(String, primary_key=True)
+    ck_step = Column(Integer, primary_key=True)
+    ck_start = Column(DateTime, primary_key=True)
+    ck_end = Column(DateTime, primary_key=True)
+    ck_time = Column(DateTime, nullable=False)
+
+    def __str__(self):
+        return BaseEntity._to_string({
+            'table': self.__tablename__,
+            'name': self.ck_name,
+            'step': self.ck_step,
+            'start': self.ck_start,
+            'end': self.ck_end,
+            'time': self.ck_time,
+        })
+
+
+class Cursor(CryptowelderContext.ENTITY_BASE, BaseEntity):
+    __tablename__ = 't_cursor'
+    cr_site = Column(String, primary_key=True)
+    cr_code = Column(String, primary_key=True)
+    cr_acct = Column(Type(AccountType), primary_key=True)
+    cr_seq = Column(String)
+    cr_time = Column(DateTime)
+    cr_updt = Column(DateTime)
+
+    def __str__(self):
+        return BaseEntity._to_string({
+            'table': self.__tablename__,
+            'site': self.cr_site,
+            'code': self.cr_code,
+            'acct': self.cr_acct,
+            'seq': self.cr_seq,
+            'time': self.cr_time,
+            'updated': self.cr_updt,
+        })
+
+
+class Watermark(CryptowelderContext.ENTITY_BASE, BaseEntity):
+    __tablename__ = 't_watermark'
+    wm_time = Column(DateTime, primary_key=True)
+    wm_seq = Column(Integer, nullable=False)
+
+    def __str__(self):
+        return BaseEntity._to_string({
+            'table': self.__tablename__,
+            'time': self.wm_time,
+            'seq': self.wm_seq,
+        })
+
+
 class Metric(CryptowelderContext.ENTITY_BASE, BaseEntity):
     __tablename__ = 't_metric'
     mc_type = Column(String, primary_key=True)
@@ -1,7 +1,6 @@
 from hashlib import sha512
 from hmac import new
 from threading import Thread, Lock
-from time import sleep
 
 from cryptowelder.context import CryptowelderContext, Ticker, Balance, AccountType, UnitType, Transaction, \
     TransactionType
@@ -29,27 +28,22 @@ class FiscoWelder:
 
         self.__logger.info('Processing : %s', self.__endpoint)
 
-        while not self.__context.is_closed():
+        self.__context.run_schedule(self._ID, [
+            ('ticker', self._process_tickers),
+            ('balance', self._process_balance),
+            ('transaction', self._process_transactions),
+        ], default_interval=default_interval)
 
-            codes = self.__context.get_property(self._ID, 'codes', 'btc_jpy').split(',')
-
-            threads = [
-                Thread(target=self._process_balance)
-            ]
-
-            for code in codes:
-                threads.append(Thread(target=self._process_ticker, args=(code,)))
-                threads.append(Thread(target=self._process_trades, args=(code,)))
-
-            for t in threads:
-                t.start()
+        self.__logger.info('Terminated.')
 
-            for t in threads:
-                t.join()
+    def _get_codes(self):
+        return self.__context.get_property(self._ID, 'codes', 'btc_jpy').split(',')
 
-            sleep(float(self.__context.get_property(self._ID, 'interval', default_interval)))
+    def _process_tickers(self):
+        self.__context.run_tasks(self._ID, [(self._process_ticker, code) for code in self._get_codes()])
 
-        self.__logger.info('Terminated.')
+    def _process_transactions(self):
+        self.__context.run_tasks(self._ID, [(self._process_trades, code) for code in self._get_codes()])
 
     def _process_ticker(self, code):
 
@@ -3,7 +3,6 @@ from decimal import Decimal
 from hashlib import sha256
 from hmac import new
 from threading import Thread, Lock
-from time import sleep
 from urllib.parse import urlencode
 
 from cryptowelder.context import CryptowelderContext, Ticker, Balance, AccountType, UnitType, Transaction, \
@@ -34,27 +33,22 @@ class GmoCoinWelder:
 
         self.__logger.info('Processing : %s', self.__endpoint)
 
-        while not self.__context.is_closed():
+        self.__context.run_schedule(self._ID, [
+            ('ticker', self._process_tickers),
+            ('balance', self._process_assets),
+            ('transaction', self._process_transactions),
+        ], default_interval=default_interval)
 
-            codes = self.__context.get_property(self._ID, 'codes', 'BTC,ETH').split(',')
-
-            threads = [
-                Thread(target=self._process_assets),
-            ]
-
-            for code in codes:
-                threads.append(Thread(target=self._process_ticker, args=(code,)))
-                threads.append(Thread(target=self._process_trades, args=(code,)))
-
-            for t in threads:
-                t.start()
+        self.__logger.info('Terminated.')
 
-            for t in threads:
-                t.join()
+    def _get_codes(self):
+        return self.__context.get_property(self._ID, 'codes', 'BTC,ETH').split(',')
 
-            sleep(float(self.__context.get_property(self._ID, 'interval', default_interval)))
+    def _process_tickers(self):
+        self.__context.run_tasks(self._ID, [(self._process_ticker, code) for code in self._get_codes()])
 
-        self.__logger.info('Terminated.')
+    def _process_transactions(self):
+        self.__context.run_tasks(self._ID, [(self._process_trades, code) for code in self._get_codes()])
 
     def _process_ticker(self, code):
 
@@ -3,7 +3,6 @@ from decimal import Decimal
 from hashlib import sha256
 from hmac import new
 from threading import Thread, Lock
-from time import sleep
 from urllib import parse
 
 from cryptowelder.context import CryptowelderContext, Ticker, UnitType, Balance, AccountType, Transaction, \
@@ -34,30 +33,28 @@ class HuobiJapanWelder:
 
         self.__logger.info('Processing : %s', self.__endpoint)
 
-        while not self.__context.is_closed():
+        self.__context.run_schedule(self._ID, [
+            ('ticker', self._process_tickers),
+            ('balance', self._process_balances),
+            ('transaction', self._process_transactions),
+        ], default_interval=default_interval)
 
-            threads = []
-
-            accounts = self.__context.get_property(self._ID, 'accounts', '').split(',')
-
-            for account in accounts:
-                threads.append(Thread(target=self._process_balance, args=(account,)))
+        self.__logger.info('Terminated.')
 
-            symbols = self.__context.get_property(self._ID, 'symbols', 'btcjpy,ethbtc').split(',')
+    def _get_symbols(self):
+        return self.__context.get_property(self._ID, 'symbols', 'btcjpy,ethbtc').split(',')
 
-            for symbol in symbols:
-                threads.append(Thread(target=self._process_ticker, args=(symbol,)))
-                threads.append(Thread(target=self._process_transaction, args=(symbol,)))
+    def _process_tickers(self):
+        self.__context.run_tasks(self._ID, [(self._process_ticker, symbol) for symbol in self._get_symbols()])
 
-            for t in threads:
-                t.start()
+    def _process_balances(self):
 
-            for t in threads:
-                t.join()
+        accounts = self.__context.get_property(self._ID, 'accounts', '').split(',')
 
-            sleep(float(self.__context.get_property(self._ID, 'interval', default_interval)))
+        self.__context.run_tasks(self._ID, [(self._process_balance, account) for account in accounts])
 
-        self.__logger.info('Terminated.')
+    def _process_transactions(self):
+        self.__context.run_tasks(self._ID, [(self._process_transaction, symbol) for symbol in self._get_symbols()])
 
     def _process_ticker(self, symbol):
 
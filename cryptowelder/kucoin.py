@@ -1,5 +1,4 @@
 from threading import Thread
-from time import sleep
 
 from cryptowelder.context import CryptowelderContext, Ticker
 
@@ -25,19 +24,9 @@ class KucoinWelder:
 
         self.__logger.info('Processing : %s', self.__endpoint)
 
-        while not self.__context.is_closed():
-
-            threads = [
-                Thread(target=self._process_ticker)
-            ]
-
-            for t in threads:
-                t.start()
-
-            for t in threads:
-                t.join()
-
-            sleep(float(self.__context.get_property(self._ID, 'interval', default_interval)))
+        self.__context.run_schedule(self._ID, [
+            ('ticker', self._process_ticker),
+        ], default_interval=default_interval)
 
         self.__logger.info('Terminated.')
 
@@ -45,13 +34,15 @@ class KucoinWelder:
 
         try:
 
-            ticks = self.__context.requests_get(self.__endpoint + '/api/v1/market/allTickers')
+            codes = set(self.__context.get_property(self._ID, 'codes', 'BTC-USDT,ETH-BTC').split(','))
+
+            select = lambda o: 'symbol' not in o or o['symbol'] in codes
+
+            ticks = self.__context.requests_get(self.__endpoint + '/api/v1/market/allTickers', select=select)
 
             if ticks is None or ticks.get('code') != '200000':
                 raise Exception(str(ticks))
 
-            codes = self.__context.get_property(self._ID, 'codes', 'BTC-USDT,ETH-BTC').split(',')
-
             data = ticks.get('data', {})
 
             time = self.__context.parse_iso_timestamp(data.get('time') / 1000.0)
@@ -60,7 +51,7 @@ class KucoinWelder:
 
             for tick in data.get('ticker', []):
 
-                if tick.get('symbol') not in codes:
+                if tick is None or tick.get('symbol') not in codes:
                     continue
 
                 ticker = Ticker()
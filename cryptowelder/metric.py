@@ -1,15 +1,24 @@
+from argparse import ArgumentParser
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 from datetime import timedelta
 from decimal import Decimal
 from threading import Thread
-from time import sleep
+from time import sleep, monotonic
 
 from pytz import utc
 
 from cryptowelder.context import CryptowelderContext, Metric
 
 
+class Prices(defaultdict):
+
+    def __init__(self):
+        super().__init__(lambda: dict())
+        self.rates = None
+
+
 class MetricWelder:
     _ID = 'metric'
     _ONE = Decimal('1.0')
@@ -20,6 +29,8 @@ class MetricWelder:
         self.__context = context
         self.__logger = context.get_logger(self)
         self.__thread = Thread(daemon=False, target=self._execute)
+        self.__memo = {}
+        self.__graph = None
 
     def run(self):
 
@@ -70,28 +81,98 @@ class MetricWelder:
 
         self.__logger.debug('Metrics : %s', [t.strftime('%Y-%m-%d %H:%M') for t in timestamps])
 
-        threads = []
+        self._compile_evaluations()
+
+        memoize = int(self.__context.get_property(self._ID, 'memoize', 1)) > 0
+
+        watermarks = {}
+
+        tasks = []
 
         for timestamp in timestamps:
+
+            if memoize:
+
+                watermark = self._fetch_watermark(timestamp)
+
+                if watermark is not None and self.__memo.get(timestamp) == watermark:
+                    self.__logger.debug('Metrics unchanged : %s', timestamp.strftime('%Y-%m-%d %H:%M'))
+                    continue
+
+                watermarks[timestamp] = watermark
+
             prices = self.process_ticker(timestamp)
-            threads.append(Thread(target=self.process_balance, args=(timestamp, prices)))
-            threads.append(Thread(target=self.process_position, args=(timestamp, prices)))
-            threads.append(Thread(target=self.process_transaction_trade, args=(timestamp, prices)))
-            threads.append(Thread(target=self.process_transaction_volume, args=(timestamp, prices)))
 
-        for t in threads:
-            t.start()
+            tasks.append((self.process_balance, timestamp, prices))
+            tasks.append((self.process_position, timestamp, prices))
+            tasks.append((self.process_transaction, timestamp, prices))
 
-        for t in threads:
-            t.join()
+        futures = self.__context.run_tasks(self._ID, tasks)
+
+        completed = True
+
+        for task, future in zip(tasks, futures):
+
+            if task[2] is None or future.exception() is not None or future.result() is None:
+                watermarks.pop(task[1], None)  # Computed again in the next run.
+                completed = False
+
+        for timestamp in [t for t in self.__memo.keys() if t not in timestamps]:
+            del self.__memo[timestamp]
+
+        for timestamp, watermark in watermarks.items():
+
+            if watermark is not None:
+                self.__memo[timestamp] = watermark
 
-    def process_ticker(self, timestamp):
+        return completed
+
+    def process_metric_batch(self, timestamps):
+
+        self._compile_evaluations()
+
+        # Tickers, balances and positions of all the timestamps are loaded at once, and swept in time order.
+        tickers = self.__context.fetch_tickers_batch(timestamps, include_expired=True)
+        balances = self.__context.fetch_balances_batch(timestamps)
+        positions = self.__context.fetch_positions_batch(timestamps)
+
+        tasks = []
+
+        for timestamp in timestamps:
+            prices = self.process_ticker(timestamp, tickers[timestamp])
+            tasks.append((self.process_balance, timestamp, prices, balances[timestamp]))
+            tasks.append((self.process_position, timestamp, prices, positions[timestamp]))
+            tasks.append((self.process_transaction, timestamp, prices))
+
+        futures = self.__context.run_tasks(self._ID, tasks)
+
+        for task, future in zip(tasks, futures):
+
+            if task[2] is None or future.exception() is not None or future.result() is None:
+                return False
+
+        return True
+
+    def _fetch_watermark(self, timestamp):
+
+        try:
+
+            return self.__context.fetch_watermark(timestamp)
+
+        except BaseException as e:
+
+            self.__logger.warn('Watermark : %s : %s', type(e), e.args)
+
+            return None
+
+    def process_ticker(self, timestamp, values=None):
 
         prices = None
 
         try:
 
-            values = self.__context.fetch_tickers(timestamp, include_expired=True)
+            if values is None:
+                values = self.__context.fetch_tickers(timestamp, include_expired=True)
 
             prices = self._calculate_prices(values)
 
@@ -114,9 +195,119 @@ class MetricWelder:
 
         return prices
 
+    def _compile_evaluations(self):
+
+        try:
+
+            evaluations = self.__context.fetch_evaluations()
+
+            signature = sorted((e.ev_site, e.ev_unit, e.ev_ticker_site, e.ev_ticker_code,
+                                e.ev_convert_site, e.ev_convert_code) for e in evaluations or [])
+
+        except BaseException as e:
+
+            self.__logger.warn('Evaluation : %s : %s', type(e), e.args)
+
+            return  # Keep the last one.
+
+        if self.__graph is not None and self.__graph[0] == signature:
+            return
+
+        self.__graph = (signature, *self._compile_graph(signature))
+
+        self.__logger.debug('Evaluations compiled : %s units, %s slots', len(self.__graph[2]), len(self.__graph[1]))
+
+    @staticmethod
+    def _compile_graph(evaluations, *, prefix='unit:'):
+
+        # Each unit is evaluated by multiplying the prices of its slots. A convert code marked with the prefix names
+        # another evaluated unit instead of a ticker, and is followed into that unit's slots, so that rates can hop
+        # through several tickers. Unmarked ones are always tickers, even if a unit of the same name exists.
+
+        entries = {(e[0], e[1]): e for e in evaluations}
+
+        slots = {}
+
+        paths = {}
+
+        def resolve(key, visiting):
+
+            if key in paths:
+                return paths[key]
+
+            if key in visiting:
+                return None  # Circular
+
+            site, unit, ticker_site, ticker_code, convert_site, convert_code = entries[key]
+
+            path = []
+
+            if ticker_site is not None and ticker_code is not None:
+                path.append(slots.setdefault((ticker_site, ticker_code), len(slots)))
+
+            if convert_site is not None and convert_code is not None:
+
+                if convert_code.startswith(prefix):
+
+                    chained = (convert_site, convert_code[len(prefix):])
+
+                    chained = resolve(chained, visiting | {key}) if chained in entries else None
+
+                    if chained is None:
+                        paths[key] = None
+                        return None
+
+                    path.extend(chained)
+
+                else:
+
+                    path.append(slots.setdefault((convert_site, convert_code), len(slots)))
+
+            paths[key] = tuple(path)
+
+            return paths[key]
+
+        for k in entries.keys():
+            resolve(k, frozenset())
+
+        return slots, paths
+
+    def _calculate_rates(self, prices):
+
+        if self.__graph is None:
+            return None
+
+        signature, slots, paths = self.__graph
+
+        values = [None] * len(slots)
+
+        for (site, code), index in slots.items():
+
+            p = prices.get(site, {}).get(code)
+
+            values[index] = p if p != self._ZERO else None
+
+        rates = {}
+
+        for key, path in paths.items():
+
+            rate = self._ONE if path is not None else None
+
+            for index in path or []:
+
+                if values[index] is None:
+                    rate = None
+                    break
+
+                rate = rate * values[index]
+
+            rates[key] = rate
+
+        return rates
+
     def _calculate_prices(self, tickers):
 
-        prices = defaultdict(lambda: dict())
+        prices = Prices()
 
         for dto in tickers if tickers is not None else []:
             ticker = dto.ticker
@@ -133,6 +324,8 @@ class MetricWelder:
 
             prices[ticker.tk_site][ticker.tk_code] = price
 
+        prices.rates = self._calculate_rates(prices)
+
         return prices
 
     def _convert_ticker(self, timestamp, prices, dto):
@@ -172,6 +365,11 @@ class MetricWelder:
         if evaluation is None:
             return None
 
+        rates = getattr(prices, 'rates', None)
+
+        if rates is not None and (evaluation.ev_site, evaluation.ev_unit) in rates:
+            return rates[(evaluation.ev_site, evaluation.ev_unit)]
+
         price = self._ONE
 
         if evaluation.ev_ticker_site is not None and evaluation.ev_ticker_code is not None:
@@ -198,13 +396,14 @@ class MetricWelder:
 
         return price
 
-    def process_balance(self, timestamp, prices):
+    def process_balance(self, timestamp, prices, values=None):
 
         try:
 
             metrics = []
 
-            values = self.__context.fetch_balances(timestamp)
+            if values is None:
+                values = self.__context.fetch_balances(timestamp)
 
             for dto in values if values is not None else []:
 
@@ -224,17 +423,20 @@ class MetricWelder:
 
             self.__context.save_metrics(metrics)
 
+            return metrics
+
         except BaseException as e:
 
             self.__logger.warn('Balance : %s : %s', type(e), e.args)
 
-    def process_position(self, timestamp, prices):
+    def process_position(self, timestamp, prices, values=None):
 
         try:
 
             metrics = []
 
-            values = self.__context.fetch_positions(timestamp)
+            if values is None:
+                values = self.__context.fetch_positions(timestamp)
 
             for dto in values if values is not None else []:
 
@@ -270,93 +472,90 @@ class MetricWelder:
 
             self.__context.save_metrics(metrics)
 
+            return metrics
+
         except BaseException as e:
 
             self.__logger.warn('Position : %s : %s', type(e), e.args)
 
-    def process_transaction_trade(self, timestamp, prices):
+    def process_transaction(self, timestamp, prices):
 
         try:
 
-            metrics = []
-
             offset = timedelta(minutes=int(self.__context.get_property(self._ID, 'offset', 9 * 60)))
 
             t = timestamp + offset
 
+            # Both trade and volume windows are aggregated together, in a single pass.
             windows = {
-                'DAY': t.replace(microsecond=0, second=0, minute=0, hour=0) - offset,
-                'MTD': t.replace(microsecond=0, second=0, minute=0, hour=0, day=1) - offset,
-                'YTD': t.replace(microsecond=0, second=0, minute=0, hour=0, day=1, month=1) - offset,
+                'trade@DAY': t.replace(microsecond=0, second=0, minute=0, hour=0) - offset,
+                'trade@MTD': t.replace(microsecond=0, second=0, minute=0, hour=0, day=1) - offset,
+                'trade@YTD': t.replace(microsecond=0, second=0, minute=0, hour=0, day=1, month=1) - offset,
+                'volume@12H': timestamp - timedelta(hours=12),
+                'volume@01D': timestamp - timedelta(hours=24),
+                'volume@30D': timestamp - timedelta(days=30),
             }
 
-            for key, val in windows.items():
+            values = self.__context.fetch_transaction_windows(windows, timestamp)
 
-                values = self.__context.fetch_transactions(val, timestamp)
+            metrics = []
+
+            for key in windows.keys():
 
-                for dto in values if values is not None else []:
+                convert = self._convert_trade if key.startswith('trade@') else self._convert_volume
 
-                    inst_qty = dto.tx_net_inst
-                    fund_qty = dto.tx_net_fund
+                for dto in values.get(key, []) if values is not None else []:
 
-                    inst_rate = self._calculate_evaluation(dto.ev_inst, prices)
-                    fund_rate = self._calculate_evaluation(dto.ev_fund, prices)
+                    metric = convert(timestamp, prices, key, dto)
 
-                    if dto.product is None \
-                            or inst_qty is None or fund_qty is None \
-                            or inst_rate is None or fund_rate is None:
+                    if metric is None:
                         continue
 
-                    metric = Metric()
-                    metric.mc_type = 'trade@' + key
-                    metric.mc_name = dto.product.pr_disp
-                    metric.mc_time = timestamp
-                    metric.mc_amnt = (inst_qty * inst_rate) + (fund_qty * fund_rate)
                     metrics.append(metric)
 
             self.__context.save_metrics(metrics)
 
-        except BaseException as e:
+            return metrics
 
-            self.__logger.warn('Transaction (trade) : %s : %s', type(e), e.args)
-
-    def process_transaction_volume(self, timestamp, prices):
-
-        try:
-
-            metrics = []
+        except BaseException as e:
 
-            windows = {
-                '12H': timestamp - timedelta(hours=12),
-                '01D': timestamp - timedelta(hours=24),
-                '30D': timestamp - timedelta(days=30),
-            }
+            self.__logger.warn('Transaction : %s : %s', type(e), e.args)
 
-            for key, val in windows.items():
+    def _convert_trade(self, timestamp, prices, key, dto):
 
-                values = self.__context.fetch_transactions(val, timestamp)
+        inst_qty = dto.tx_net_inst
+        fund_qty = dto.tx_net_fund
 
-                for dto in values if values is not None else []:
+        inst_rate = self._calculate_evaluation(dto.ev_inst, prices)
+        fund_rate = self._calculate_evaluation(dto.ev_fund, prices)
 
-                    amount = dto.tx_grs_fund
+        if dto.product is None \
+                or inst_qty is None or fund_qty is None \
+                or inst_rate is None or fund_rate is None:
+            return None
 
-                    rate = self._calculate_evaluation(dto.ev_fund, prices)
+        metric = Metric()
+        metric.mc_type = key
+        metric.mc_name = dto.product.pr_disp
+        metric.mc_time = timestamp
+        metric.mc_amnt = (inst_qty * inst_rate) + (fund_qty * fund_rate)
+        return metric
 
-                    if dto.product is None or amount is None or rate is None:
-                        continue
+    def _convert_volume(self, timestamp, prices, key, dto):
 
-                    metric = Metric()
-                    metric.mc_type = 'volume@' + key
-                    metric.mc_name = dto.product.pr_disp
-                    metric.mc_time = timestamp
-                    metric.mc_amnt = amount * rate
-                    metrics.append(metric)
+        amount = dto.tx_grs_fund
 
-            self.__context.save_metrics(metrics)
+        rate = self._calculate_evaluation(dto.ev_fund, prices)
 
-        except BaseException as e:
+        if dto.product is None or amount is None or rate is None:
+            return None
 
-            self.__logger.warn('Transaction (volume) : %s : %s', type(e), e.args)
+        metric = Metric()
+        metric.mc_type = key
+        metric.mc_name = dto.product.pr_disp
+        metric.mc_time = timestamp
+        metric.mc_amnt = amount * rate
+        return metric
 
     def purge_metric(self, *, intervals=(
 
@@ -379,6 +578,8 @@ class MetricWelder:
 
         now = self.__context.get_now()
 
+        latest = None
+
         for idx, entry in enumerate(intervals):
 
             hours = self.__context.get_property(self._ID, 'purge_%s' % idx, entry[0])
@@ -392,6 +593,14 @@ class MetricWelder:
 
             self.__logger.debug('Purged [%s] cutoff=%s count=%s', idx, cutoff, count)
 
+            latest = max(latest, cutoff) if latest is not None else cutoff
+
+        if latest is not None:
+            # Watermarks of the minutes older than all the cutoffs are no longer compared by the memo.
+            count = self.__context.delete_watermarks(latest)
+
+            self.__logger.debug('Purged watermarks cutoff=%s count=%s', latest, count)
+
 
 def main():
     context = CryptowelderContext(config='~/.cryptowelder', debug=True)
@@ -402,21 +611,117 @@ def main():
 
 
 def main_historical():
-    context = CryptowelderContext(config='~/.cryptowelder', debug=True)
-    context.launch_prometheus()
+    timestamp = datetime.now().astimezone(utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    backfill('~/.cryptowelder', timestamp, datetime.now().astimezone(utc), step=60)
+
+
+_BACKFILL_CONTEXTS = {}
+
+
+def _backfill_chunk(config, start, end, step, batch):
+    context = _BACKFILL_CONTEXTS.get(config)
+
+    if context is None:
+        # One context, and its engine, per worker process.
+        context = CryptowelderContext(config=config, read_only=False, debug=False)
+        context.set_property(MetricWelder._ID, 'memoize', '0')
+        _BACKFILL_CONTEXTS[config] = context
 
     target = MetricWelder(context)
 
-    timestamp = context.get_now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    timestamps = []
+
+    timestamp = start
+
+    while timestamp < end:
+        timestamps.append(timestamp)
+        timestamp = timestamp + timedelta(minutes=step)
+
+    if batch:
+        completed = target.process_metric_batch(timestamps)
+    else:
+        completed = all([target.process_metric(default_time=t, default_count=1) for t in timestamps])
+
+    if not completed:
+        raise Exception('Incomplete chunk : [%s, %s)' % (start, end))  # Retried in the next run.
+
+    context.save_checkpoint(MetricWelder._ID, step, start, end)
+
+    return len(timestamps)
+
+
+def backfill(config, start, end, *, step=1, chunk=60, workers=None, batch=True, executor=ProcessPoolExecutor):
+    context = CryptowelderContext(config=config, read_only=False, debug=False)
+
+    logger = context.get_logger(MetricWelder(context))
+
+    # Only the identical chunks are skipped, since a partial tail or another granularity covers different minutes.
+    completed = {(c.ck_start.replace(tzinfo=utc), c.ck_end.replace(tzinfo=utc))
+                 for c in context.fetch_checkpoints(MetricWelder._ID, step, start, end)}
+
+    chunks = []
+
+    timestamp = start
+
+    while timestamp < end:
+
+        limit = min(timestamp + timedelta(minutes=step * chunk), end)
+
+        if (timestamp.astimezone(utc), limit.astimezone(utc)) not in completed:
+            chunks.append((timestamp, limit))
+
+        timestamp = limit
+
+    logger.info('Backfill : [%s, %s) %s chunks (%s completed)', start, end, len(chunks), len(completed))
+
+    count = 0
+
+    started = monotonic()
+
+    with executor(max_workers=workers) as pool:
+
+        futures = {pool.submit(_backfill_chunk, config, lo, hi, step, batch): (lo, hi) for lo, hi in chunks}
+
+        for i, future in enumerate(as_completed(futures), 1):
+
+            try:
+
+                count = count + future.result()
+
+            except BaseException as e:
+
+                logger.warn('Backfill : [%s, %s) - %s : %s', *futures[future], type(e), e.args)
+
+                continue
+
+            elapsed = monotonic() - started
+
+            logger.info('Backfill : %s/%s chunks, %s minutes (%.2f minutes/sec)',
+                        i, len(chunks), count, count / elapsed if elapsed > 0 else 0)
+
+    return count
+
 
-    while True:
+def main_backfill():
+    parser = ArgumentParser(description='Backfill the metrics within [start, end), resuming from the checkpoints.')
+    parser.add_argument('start', help='Inclusive start time in ISO 8601 (e.g. 2019-01-01T00:00:00Z)')
+    parser.add_argument('end', nargs='?', help='Exclusive end time in ISO 8601 (default: now)')
+    parser.add_argument('--config', default='~/.cryptowelder', help='Configuration file')
+    parser.add_argument('--granularity', choices=['minute', 'hour'], default='minute', help='Interval of the metrics')
+    parser.add_argument('--chunk', type=int, default=60, help='Number of metric timestamps per chunk')
+    parser.add_argument('--workers', type=int, help='Number of worker processes (default: number of processors)')
+    parser.add_argument('--serial', action='store_true', help='Query each timestamp, instead of the batch sweeps')
+    args = parser.parse_args()
 
-        if timestamp >= datetime.now().astimezone(utc):
-            break
+    start = CryptowelderContext._parse_iso_timestamp(args.start)
+    end = CryptowelderContext._parse_iso_timestamp(args.end) if args.end else datetime.now().astimezone(utc)
 
-        target.process_metric(default_time=timestamp, default_count=1)
+    if start is None or end is None:
+        parser.error('Invalid timestamp : %s, %s' % (args.start, args.end))
 
-        timestamp = timestamp + timedelta(minutes=60)
+    backfill(args.config, start, end, step=60 if args.granularity == 'hour' else 1,
+             chunk=args.chunk, workers=args.workers, batch=not args.serial)
 
 
 if __name__ == '__main__':
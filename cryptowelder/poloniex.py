@@ -1,5 +1,4 @@
 from threading import Thread
-from time import sleep
 
 from cryptowelder.context import CryptowelderContext, Ticker
 
@@ -25,19 +24,9 @@ class PoloniexWelder:
 
         self.__logger.info('Processing : %s', self.__endpoint)
 
-        while not self.__context.is_closed():
-
-            threads = [
-                Thread(target=self._process_ticker)
-            ]
-
-            for t in threads:
-                t.start()
-
-            for t in threads:
-                t.join()
-
-            sleep(float(self.__context.get_property(self._ID, 'interval', default_interval)))
+        self.__context.run_schedule(self._ID, [
+            ('ticker', self._process_ticker),
+        ], default_interval=default_interval)
 
         self.__logger.info('Terminated.')
 
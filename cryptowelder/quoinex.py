@@ -1,6 +1,6 @@
 from decimal import Decimal
+from functools import partial
 from threading import Thread, Lock
-from time import sleep
 
 import jwt
 
@@ -32,44 +32,43 @@ class QuoinexWelder:
 
         self.__logger.info('Processing : %s', self.__endpoint)
 
-        while not self.__context.is_closed():
-
-            threads = [
-                Thread(target=self._process_products),
-                Thread(target=self._process_cash),
-            ]
-
-            for t in threads:
-                t.start()
-
-            for t in threads:
-                t.join()
-
-            sleep(float(self.__context.get_property(self._ID, 'interval', default_interval)))
+        self.__context.run_schedule(self._ID, [
+            ('ticker', partial(self._process_products, transaction=False)),
+            ('transaction', partial(self._process_products, ticker=False)),
+            ('balance', self._process_cash),
+        ], default_interval=default_interval)
 
         self.__logger.info('Terminated.')
 
-    def _process_products(self):
+    def _process_products(self, *, ticker=True, transaction=True):
 
         try:
 
             now = self.__context.get_now()
 
-            products = self.__context.requests_get(self.__endpoint + '/products')
+            url = self.__endpoint + '/products'
+
+            # Product ids for the transactions, without the prices, can be served from the cache.
+            if ticker:
+                products = self.__context.requests_get(url)
+            else:
+                products = self.__context.requests_cached(
+                    url, ttl=self.__context.get_property(self._ID, 'products_ttl', 300)
+                )
 
             codes = self.__context.get_property(self._ID, 'products', 'BTCJPY,ETHBTC').split(',')
 
-            threads = []
+            tasks = []
 
             for product in codes:
-                threads.append(Thread(target=self._process_ticker, args=(now, product, products)))
-                threads.append(Thread(target=self._process_transaction, args=(product, products)))
 
-            for t in threads:
-                t.start()
+                if ticker:
+                    tasks.append((self._process_ticker, now, product, products))
+
+                if transaction:
+                    tasks.append((self._process_transaction, product, products))
 
-            for t in threads:
-                t.join()
+            self.__context.run_tasks(self._ID, tasks)
 
             self.__logger.debug('Products : %s', codes)
 
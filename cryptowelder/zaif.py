@@ -1,7 +1,6 @@
 from hashlib import sha512
 from hmac import new
 from threading import Thread, Lock
-from time import sleep
 
 from cryptowelder.context import CryptowelderContext, Ticker, Balance, AccountType, UnitType, Transaction, \
     TransactionType
@@ -29,27 +28,22 @@ class ZaifWelder:
 
         self.__logger.info('Processing : %s', self.__endpoint)
 
-        while not self.__context.is_closed():
+        self.__context.run_schedule(self._ID, [
+            ('ticker', self._process_tickers),
+            ('balance', self._process_balance),
+            ('transaction', self._process_transactions),
+        ], default_interval=default_interval)
 
-            codes = self.__context.get_property(self._ID, 'codes', 'btc_jpy,eth_btc').split(',')
-
-            threads = [
-                Thread(target=self._process_balance)
-            ]
-
-            for code in codes:
-                threads.append(Thread(target=self._process_ticker, args=(code,)))
-                threads.append(Thread(target=self._process_trades, args=(code,)))
+        self.__logger.info('Terminated.')
 
-            for t in threads:
-                t.start()
+    def _get_codes(self):
+        return self.__context.get_property(self._ID, 'codes', 'btc_jpy,eth_btc').split(',')
 
-            for t in threads:
-                t.join()
+    def _process_tickers(self):
+        self.__context.run_tasks(self._ID, [(self._process_ticker, code) for code in self._get_codes()])
 
-            sleep(float(self.__context.get_property(self._ID, 'interval', default_interval)))
-
-        self.__logger.info('Terminated.')
+    def _process_transactions(self):
+        self.__context.run_tasks(self._ID, [(self._process_trades, code) for code in self._get_codes()])
 
     def _process_ticker(self, code):
 
@@ -155,11 +149,21 @@ class ZaifWelder:
                 'count': count,
             }
 
+            # Ascending from the last-seen id when known, instead of descending from the newest.
+            cursor = self.__context.fetch_cursor(self._ID, code, AccountType.CASH)
+
+            if cursor is not None:
+                params['from_id'] = int(cursor.cr_seq) + 1
+                params['order'] = 'ASC'
+
+            latest = None
+
             while True:
 
                 response = self._query_private('trade_history', parameters=params)
 
                 if response is None:
+                    latest = None  # Incomplete, retry from the same cursor.
                     break
 
                 if response.get('success', 1) != 1:
@@ -173,7 +177,11 @@ class ZaifWelder:
                 values = {}
 
                 for i, t in trades.items():
-                    params['end_id'] = min(params.get('end_id', int(i)), int(i) - 1)
+
+                    if cursor is None:
+                        params['end_id'] = min(params.get('end_id', int(i)), int(i) - 1)
+                    else:
+                        params['from_id'] = max(params['from_id'], int(i) + 1)
 
                     side = t.get('your_action')  # 'ask' -> sell, 'bid' -> buy, 'both' -> cross
                     side = +1 if side == 'ask' else -1 if side == 'bid' else 0
@@ -192,12 +200,22 @@ class ZaifWelder:
                     values[i].tx_inst = -side * t.get('amount')
                     values[i].tx_fund = +side * t.get('amount') * t.get('price') - t.get('fee') + bonus
 
-                self.__logger.debug('Transactions : %s - fetched=[%s] id=[%s]', code, len(values), params['end_id'])
+                    if latest is None or int(i) > latest[0]:
+                        latest = (int(i), values[i].tx_time)
+
+                self.__logger.debug('Transactions : %s - fetched=[%s] id=[%s]',
+                                    code, len(values), params.get('end_id', params.get('from_id')))
 
                 results = self.__context.save_transactions(values.values())
 
-                if len(results) <= 0:
-                    break
+                if cursor is None and len(results) <= 0:
+                    break  # Reached the known ones.
+
+                if cursor is not None and len(values) < count:
+                    break  # Reached the newest one.
+
+            if latest is not None:
+                self.__context.save_cursor(self._ID, code, AccountType.CASH, latest[0], latest[1])
 
         except Exception as e:
 
@@ -0,0 +1,135 @@
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from decimal import Decimal
+from os import path
+from tempfile import TemporaryDirectory
+from timeit import timeit
+
+from pytz import utc
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cryptowelder.context import CryptowelderContext, Product, Evaluation, Account, Balance, Position, \
+    AccountType, UnitType
+
+
+def _seed(engine, *, days, keys, start, chunk=10000):
+    engine.execute(Product.__table__.insert(), [
+        {'pr_site': 'bm', 'pr_code': 'c%s' % k, 'pr_inst': 'BTC', 'pr_fund': 'JPY', 'pr_disp': 'c%s' % k}
+        for k in range(0, keys)
+    ])
+
+    engine.execute(Evaluation.__table__.insert(), [
+        {'ev_site': 'bm', 'ev_unit': u} for u in ['BTC', 'JPY']
+    ])
+
+    units = [u for u in UnitType if u.name not in ('BTC', 'JPY')][:keys]
+
+    engine.execute(Account.__table__.insert(), [
+        {'ac_site': 'bm', 'ac_acct': AccountType.CASH.name, 'ac_unit': u.name, 'ac_disp': u.name} for u in units
+    ])
+
+    engine.execute(Evaluation.__table__.insert(), [
+        {'ev_site': 'bm', 'ev_unit': u.name} for u in units
+    ])
+
+    balances = []
+    positions = []
+
+    for minute in range(0, days * 24 * 60):
+
+        time = start + timedelta(minutes=minute)
+
+        for u in units:
+            balances.append({
+                'bc_site': 'bm', 'bc_acct': AccountType.CASH, 'bc_unit': u, 'bc_time': time,
+                'bc_amnt': Decimal(minute)
+            })
+
+        for k in range(0, keys):
+            positions.append({
+                'ps_site': 'bm', 'ps_code': 'c%s' % k, 'ps_time': time,
+                'ps_inst': Decimal(minute), 'ps_fund': Decimal(-minute)
+            })
+
+        if len(balances) >= chunk:
+            engine.execute(Balance.__table__.insert(), balances)
+            engine.execute(Position.__table__.insert(), positions)
+            balances.clear()
+            positions.clear()
+
+    if len(balances) > 0:
+        engine.execute(Balance.__table__.insert(), balances)
+        engine.execute(Position.__table__.insert(), positions)
+
+
+def _explain(context, engine, entity, column, time, strategy):
+    session = sessionmaker(bind=engine)()
+
+    try:
+
+        query = session.query(context._query_latest(session, entity, column, time, strategy=strategy))
+
+        compiled = query.statement.compile(dialect=engine.dialect)
+
+        params = [compiled.params[k] for k in compiled.positiontup] if compiled.positional else compiled.params
+
+        prefix = 'EXPLAIN ANALYZE ' if engine.dialect.name == 'postgresql' else 'EXPLAIN QUERY PLAN '
+
+        return [' '.join(str(c) for c in row) for row in engine.execute(prefix + str(compiled), params)]
+
+    finally:
+
+        session.close()
+
+
+def main():
+    parser = ArgumentParser(description='Compare the latest balance/position query strategies.')
+    parser.add_argument('--database', help='Database URL to seed under site "bm" (default: temporary sqlite)')
+    parser.add_argument('--days', type=int, default=365, help='Days of minute-level rows to seed')
+    parser.add_argument('--keys', type=int, default=4, help='Number of accounts and products')
+    parser.add_argument('--number', type=int, default=5, help='Number of timed executions')
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as directory:
+
+        database = args.database or 'sqlite:///%s' % path.join(directory, 'benchmark.db')
+
+        config = path.join(directory, 'benchmark.cfg')
+
+        with open(config, 'w') as f:
+            f.write('[context]\ndatabase = %s\n' % database)
+
+        context = CryptowelderContext(config=config, read_only=False, debug=False)
+        context._create_all()
+
+        engine = create_engine(database)
+
+        start = datetime(year=2018, month=1, day=1, tzinfo=utc)
+
+        _seed(engine, days=args.days, keys=args.keys, start=start)
+
+        time = start + timedelta(days=args.days) - timedelta(hours=1)
+
+        strategies = ['portable'] + (['lateral'] if engine.dialect.name == 'postgresql' else [])
+
+        for strategy in strategies:
+
+            context.set_property(context._SECTION, 'query_strategy', strategy)
+
+            for name, entity, column, fetch in [
+                ('balance', Balance, Balance.bc_time, context.fetch_balances),
+                ('position', Position, Position.ps_time, context.fetch_positions),
+            ]:
+                print('[%s][%s]' % (strategy, name))
+
+                for line in _explain(context, engine, entity, column, time, strategy):
+                    print('  ' + line)
+
+                elapsed = timeit(lambda: fetch(time), number=args.number)
+
+                print('  => %d rows : %.3f ms' % (len(fetch(time)), elapsed * 1000 / args.number))
+
+
+if __name__ == '__main__':
+    main()
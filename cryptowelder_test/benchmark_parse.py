@@ -0,0 +1,49 @@
+from json import dumps
+from timeit import timeit
+
+from cryptowelder.context import CryptowelderContext, orjson
+
+
+def _payloads(*, size=2000):
+    return {
+        # binance : /api/v3/ticker/price
+        'binance': dumps([
+            {'symbol': 'SYM%04dBTC' % i, 'price': '0.%08d' % i} for i in range(0, size)
+        ]).encode(),
+        # kucoin : /api/v1/market/allTickers
+        'kucoin': dumps({'code': '200000', 'data': {'time': 1555555555555, 'ticker': [{
+            'symbol': 'SYM%04d-USDT' % i, 'symbolName': 'SYM%04d-USDT' % i,
+            'buy': '0.%08d' % i, 'sell': '0.%08d' % (i + 1), 'last': '0.%08d' % i,
+            'changeRate': '0.0123', 'changePrice': '0.00001', 'high': '1.23', 'low': '0.98',
+            'vol': '12345.6789', 'volValue': '123.456789', 'averagePrice': '1.01',
+        } for i in range(0, size)]}}).encode(),
+        # bitmex : /api/v1/instrument/activeAndIndices
+        'bitmex': dumps([{
+            'symbol': 'SYM%04d' % i, 'rootSymbol': 'XBT', 'state': 'Open', 'typ': 'FFWCSX',
+            'timestamp': '2019-04-14T12:34:56.789Z', 'lastPrice': 5123.5 + i, 'bidPrice': 5123.0,
+            'askPrice': 5124.0, 'markPrice': 5123.47, 'volume': 123456, 'openInterest': 98765432,
+            'multiplier': -100000000, 'settlCurrency': 'XBt', 'isInverse': True,
+        } for i in range(0, size // 10)]).encode(),
+    }
+
+
+def main(*, number=100):
+    decoders = ['json'] + (['orjson'] if orjson is not None else [])
+
+    for name, payload in _payloads().items():
+
+        expected = CryptowelderContext._parse(payload)
+
+        for decoder in decoders:
+            actual = CryptowelderContext._parse(payload, decoder=decoder)
+
+            if repr(actual) != repr(expected):
+                raise Exception('Mismatch', name, decoder)
+
+            elapsed = timeit(lambda: CryptowelderContext._parse(payload, decoder=decoder), number=number)
+
+            print('%-8s %-7s %8d bytes : %8.3f ms' % (name, decoder, len(payload), elapsed * 1000 / number))
+
+
+if __name__ == '__main__':
+    main()
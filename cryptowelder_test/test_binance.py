@@ -16,6 +16,10 @@ class TestPoloniexWelder(TestCase):
         self.context.get_logger.return_value = MagicMock()
         self.context.get_property = lambda section, key, val: val
         self.context.parse_iso_timestamp = CryptowelderContext._parse_iso_timestamp
+        self.context.run_tasks = lambda key, tasks: [t[0](*t[1:]) for t in tasks]
+        self.context.run_schedule = lambda key, jobs, **kwargs: [
+            [j[1]() for j in jobs] for _ in iter(self.context.is_closed, True)
+        ]
 
         self.target = BinanceWelder(self.context)
 
@@ -107,6 +111,10 @@ class TestPoloniexWelder(TestCase):
         self.assertEqual(None, tickers[3].tk_bid)
         self.assertEqual(None, tickers[3].tk_ltp)
 
+        select = self.context.requests_get.call_args[1]['select']
+        self.assertTrue(select({'symbol': 'ETHBTC', 'price': '0.05618000'}))
+        self.assertFalse(select({'symbol': 'XRPBTC', 'price': '0.00008000'}))
+
         # Query Empty
         self.context.requests_get.reset_mock()
         self.context.requests_get.side_effect = ([], [])
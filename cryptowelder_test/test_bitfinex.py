@@ -13,6 +13,10 @@ class TestBitfinexWelder(TestCase):
         self.context.get_logger.return_value = MagicMock()
         self.context.get_property = lambda section, key, val: val
         self.context.parse_iso_timestamp = CryptowelderContext._parse_iso_timestamp
+        self.context.run_tasks = lambda key, tasks: [t[0](*t[1:]) for t in tasks]
+        self.context.run_schedule = lambda key, jobs, **kwargs: [
+            [j[1]() for j in jobs] for _ in iter(self.context.is_closed, True)
+        ]
 
         self.target = BitfinexWelder(self.context)
 
@@ -1,9 +1,9 @@
 from datetime import datetime
 from decimal import Decimal
 from unittest import TestCase, main
-from unittest.mock import MagicMock, call
+from unittest.mock import MagicMock, call, patch
 
-from cryptowelder.bitflyer import BitflyerWelder
+from cryptowelder.bitflyer import BitflyerWelder, main_backfill
 from cryptowelder.context import CryptowelderContext, AccountType, UnitType, TransactionType
 
 
@@ -15,6 +15,10 @@ class TestBitflyerWelder(TestCase):
         self.context.get_logger.return_value = MagicMock()
         self.context.get_property = lambda section, key, val: val
         self.context.parse_iso_timestamp = CryptowelderContext._parse_iso_timestamp
+        self.context.run_tasks = lambda key, tasks: [t[0](*t[1:]) for t in tasks]
+        self.context.run_schedule = lambda key, jobs, **kwargs: [
+            [j[1]() for j in jobs] for _ in iter(self.context.is_closed, True)
+        ]
 
         self.target = BitflyerWelder(self.context)
 
@@ -32,13 +36,18 @@ class TestBitflyerWelder(TestCase):
         self.target._process_margin = MagicMock()
         self.target._loop()
         self.assertEqual(3, self.context.is_closed.call_count)
-        self.assertEqual(2, self.context.get_property.call_count)
+        self.assertEqual(2 * 3, self.target._process_markets.call_count)
+        self.assertEqual(2, self.target._process_cash.call_count)
+        self.assertEqual(2, self.target._process_margin.call_count)
+        self.target._process_markets.assert_any_call(position=False, transaction=False)
+        self.target._process_markets.assert_any_call(ticker=False, transaction=False)
+        self.target._process_markets.assert_any_call(ticker=False, position=False)
 
     def test__process_markets(self):
         self.target._process_ticker = MagicMock()
         self.target._process_position = MagicMock()
         self.target._process_transaction = MagicMock()
-        self.context.requests_get = MagicMock(return_value=CryptowelderContext._parse("""
+        self.context.requests_cached = MagicMock(return_value=CryptowelderContext._parse("""
         [
           { "product_code": "BTC_JPY" },
           { "product_code": "FX_BTC_JPY" },
@@ -60,8 +69,19 @@ class TestBitflyerWelder(TestCase):
             self.target._process_position.assert_any_call(product)
             self.target._process_transaction.assert_any_call(product)
 
+        self.context.requests_cached.assert_called_once_with('https://api.bitflyer.jp/v1/markets', ttl=300)
+
+        # Ticker only
+        self.target._process_ticker.reset_mock()
+        self.target._process_position.reset_mock()
+        self.target._process_transaction.reset_mock()
+        self.target._process_markets(position=False, transaction=False)
+        self.assertEqual(5, self.target._process_ticker.call_count)
+        self.target._process_position.assert_not_called()
+        self.target._process_transaction.assert_not_called()
+
         # Query Failure
-        self.context.requests_get = MagicMock(side_effect=Exception('test'))
+        self.context.requests_cached = MagicMock(side_effect=Exception('test'))
         self.target._process_ticker.reset_mock()
         self.target._process_position.reset_mock()
         self.target._process_transaction.reset_mock()
@@ -325,6 +345,8 @@ class TestBitflyerWelder(TestCase):
         self.context.save_positions.assert_not_called()
 
     def test__process_transaction(self):
+        self.context.fetch_cursor = MagicMock(return_value=None)
+        self.context.save_cursor = MagicMock()
         self.context.save_transactions = MagicMock(side_effect=[[None], []])
         self.target._query_private = MagicMock(side_effect=[CryptowelderContext._parse("""
             [
@@ -386,12 +408,51 @@ class TestBitflyerWelder(TestCase):
         transactions = calls[1][0][0]
         self.assertEqual(0, len(transactions))
 
+        self.context.fetch_cursor.assert_called_once_with('bitflyer', 'FOO_BAR', AccountType.CASH)
+        self.context.save_cursor.assert_called_once_with(
+            'bitflyer', 'FOO_BAR', AccountType.CASH, 37233, calls[0][0][0][0].tx_time
+        )
+
+        # Incremental
+        self.context.fetch_cursor = MagicMock(return_value=MagicMock(cr_seq='37233'))
+        self.context.save_cursor.reset_mock()
+        self.context.save_transactions = MagicMock(return_value=[])
+        self.target._query_private = MagicMock(return_value=[])
+        self.target._process_transaction("FOO_BAR")
+        self.target._query_private.assert_called_once_with(
+            '/v1/me/getexecutions?count=100&product_code=FOO_BAR&after=37233'
+        )
+        self.context.save_cursor.assert_not_called()
+
+        # Incremental (Known page, then the gap behind it)
+        self.context.save_cursor.reset_mock()
+        self.context.save_transactions = MagicMock(side_effect=[[], ['gap']])
+        self.target._query_private = MagicMock(side_effect=[
+            [{"id": 37236, "side": "BUY", "price": 100, "size": 1, "exec_date": "2015-07-07T09:57:40.397"},
+             {"id": 37235, "side": "BUY", "price": 100, "size": 1, "exec_date": "2015-07-07T09:57:40.397"}],
+            [{"id": 37234, "side": "BUY", "price": 100, "size": 1, "exec_date": "2015-07-07T09:57:40.397"}],
+        ])
+        self.context.get_property = MagicMock(return_value='2')
+        self.target._process_transaction("FOO_BAR")
+        self.context.get_property = lambda section, key, val: val
+        self.target._query_private.assert_has_calls([
+            call('/v1/me/getexecutions?count=2&product_code=FOO_BAR&after=37233'),
+            call('/v1/me/getexecutions?count=2&product_code=FOO_BAR&after=37233&before=37235'),
+        ])
+        self.assertEqual(2, self.context.save_transactions.call_count)
+        self.context.save_cursor.assert_called_once_with(
+            'bitflyer', 'FOO_BAR', AccountType.CASH, 37236,
+            self.context.save_transactions.call_args_list[0][0][0][0].tx_time
+        )
+
         # Query None
         self.target._query_private = MagicMock(return_value=None)
         self.context.save_transactions.reset_mock()
+        self.context.save_cursor.reset_mock()
         self.target._process_transaction("FOO_BAR")
         self.target._query_private.assert_called_once()
         self.context.save_transactions.assert_not_called()
+        self.context.save_cursor.assert_not_called()
 
         # Query Failure
         self.target._query_private = MagicMock(side_effect=Exception('test'))
@@ -400,6 +461,61 @@ class TestBitflyerWelder(TestCase):
         self.target._query_private.assert_called_once()
         self.context.save_transactions.assert_not_called()
 
+    def test__fetch_executions(self):
+        self.target._query_private = MagicMock(side_effect=[
+            [
+                {"id": 105, "child_order_id": "o5", "side": "BUY", "price": 100, "size": 2,
+                 "commission": 0, "exec_date": "2015-07-07T09:57:40.397"},
+                {"id": 103, "child_order_id": "o3", "side": "SELL", "price": 100, "size": 1,
+                 "commission": 0, "exec_date": "2015-07-07T09:57:39.397"},
+            ],
+            [
+                {"id": 101, "child_order_id": "o1", "side": "BUY", "price": 100, "size": 1,
+                 "commission": 0, "exec_date": "2015-07-07T09:57:38.397"},
+            ],
+            [],
+        ])
+
+        pages = list(self.target._fetch_executions('FX_BTC_JPY', 99, 110))
+        self.assertEqual([['105', '103'], ['101']], [[v.tx_eid for v in p] for p in pages])
+        self.assertEqual(AccountType.MARGIN, pages[0][0].tx_acct)
+        self.assertEqual(Decimal('2'), pages[0][0].tx_inst)
+        self.assertEqual(Decimal('-200'), pages[0][0].tx_fund)
+        self.target._query_private.assert_has_calls([
+            call('/v1/me/getexecutions?count=100&product_code=FX_BTC_JPY&after=99&before=110'),
+            call('/v1/me/getexecutions?count=100&product_code=FX_BTC_JPY&after=99&before=103'),
+            call('/v1/me/getexecutions?count=100&product_code=FX_BTC_JPY&after=99&before=101'),
+        ])
+
+        # Incomplete
+        self.target._query_private = MagicMock(return_value=None)
+        with self.assertRaises(Exception):
+            list(self.target._fetch_executions('FX_BTC_JPY', 99, 110))
+
+    def test_backfill_transactions(self):
+        self.context.backfill_transactions = MagicMock(return_value={'fetched': 0})
+        self.assertEqual({'fetched': 0}, self.target.backfill_transactions('FX_BTC_JPY', 100, 350, span=100))
+        self.context.backfill_transactions.assert_called_once_with('bitflyer', [
+            ('FX_BTC_JPY', 99, 200), ('FX_BTC_JPY', 199, 300), ('FX_BTC_JPY', 299, 350),
+        ], self.target._fetch_executions)
+
+    @patch('cryptowelder.bitflyer.CryptowelderContext')
+    @patch('cryptowelder.bitflyer.BitflyerWelder.backfill_transactions')
+    def test_main_backfill(self, backfill, context):
+        argv = ['bitflyer-backfill', 'FX_BTC_JPY', '100', '350', '--span', '100']
+
+        with patch('sys.argv', argv):
+            backfill.return_value = {'failed': 0, 'write_failed': 0}
+            main_backfill()
+            backfill.assert_called_once_with('FX_BTC_JPY', 100, 350, span=100)
+
+            # Non-zero exit on the failed ranges or writes.
+            for stats in [{'failed': 1, 'write_failed': 0}, {'failed': 0, 'write_failed': 2}]:
+                backfill.return_value = stats
+                with self.assertRaises(SystemExit) as cm:
+                    main_backfill()
+                self.assertEqual(1, cm.exception.code)
+
     def test__process_cash(self):
         self.target._process_balance = MagicMock()
         self.target._process_cash()
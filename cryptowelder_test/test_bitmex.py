@@ -1,12 +1,12 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal
 from unittest import TestCase, main
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, call
 
 from pytz import utc
 
 from cryptowelder.bitmex import BitmexWelder
-from cryptowelder.context import CryptowelderContext
+from cryptowelder.context import CryptowelderContext, AccountType, TransactionType
 
 
 class TestQuoinexWelder(TestCase):
@@ -17,6 +17,10 @@ class TestQuoinexWelder(TestCase):
         self.context.get_logger.return_value = MagicMock()
         self.context.get_property = lambda section, key, val: val
         self.context.parse_iso_timestamp = CryptowelderContext._parse_iso_timestamp
+        self.context.run_tasks = lambda key, tasks: [t[0](*t[1:]) for t in tasks]
+        self.context.run_schedule = lambda key, jobs, **kwargs: [
+            [j[1]() for j in jobs] for _ in iter(self.context.is_closed, True)
+        ]
 
         self.target = BitmexWelder(self.context)
 
@@ -192,6 +196,121 @@ class TestQuoinexWelder(TestCase):
     def test__process_transaction(self):
         pass  # TODO
 
+    def test__fetch_transaction(self):
+        executions = CryptowelderContext._parse("""
+            [
+              {
+                "execID": "e2", "orderID": "o2", "symbol": "XBTUSD", "side": "Sell",
+                "lastQty": 10, "lastPx": 5000, "execComm": 100, "transactTime": "2019-04-14T12:34:57.000Z"
+              },
+              {
+                "execID": "e1", "orderID": "o1", "symbol": "XBTUSD", "side": "Buy",
+                "lastQty": 20, "lastPx": 4000, "execComm": 200, "transactTime": "2019-04-14T12:34:56.000Z"
+              }
+            ]
+        """)
+
+        # Newest first, until the known ones.
+        self.context.fetch_cursor = MagicMock(return_value=None)
+        self.context.save_cursor = MagicMock()
+        self.context.save_transactions = MagicMock(side_effect=[[None], []])
+        self.target._query_private = MagicMock(side_effect=[executions, executions[1:]])
+        self.target._fetch_transaction('XBTUSD', -100000000, limit=2)
+        self.target._query_private.assert_has_calls([
+            call('/api/v1/execution/tradeHistory?reverse=True&count=2&start=0&symbol=XBTUSD'),
+            call('/api/v1/execution/tradeHistory?reverse=True&count=2&start=2&symbol=XBTUSD'),
+        ])
+
+        values = self.context.save_transactions.call_args_list[0][0][0]
+        self.assertEqual('e2', values[0].tx_eid)
+        self.assertEqual(AccountType.MARGIN, values[0].tx_acct)
+        self.assertEqual(TransactionType.TRADE, values[0].tx_type)
+        self.assertEqual(Decimal('-0.00200100'), values[0].tx_inst)
+        self.assertEqual(Decimal('10'), values[0].tx_fund)
+
+        self.context.fetch_cursor.assert_called_once_with('bitmex', 'XBTUSD', AccountType.MARGIN)
+        self.context.save_cursor.assert_called_once_with(
+            'bitmex', 'XBTUSD', AccountType.MARGIN, 'e2', values[0].tx_time
+        )
+
+        # Ascending from the cursor time, until a partial page.
+        cursor = MagicMock(cr_time=values[1].tx_time)
+        self.context.fetch_cursor = MagicMock(return_value=cursor)
+        self.context.save_cursor.reset_mock()
+        self.context.save_transactions = MagicMock(return_value=[])
+        self.target._query_private = MagicMock(side_effect=[list(reversed(executions)), []])
+        self.target._fetch_transaction('XBTUSD', -100000000, limit=2)
+        self.target._query_private.assert_has_calls([
+            call('/api/v1/execution/tradeHistory?reverse=False&count=2&start=0&symbol=XBTUSD'
+                 '&startTime=2019-04-14T12%3A34%3A56.000000Z'),
+            call('/api/v1/execution/tradeHistory?reverse=False&count=2&start=2&symbol=XBTUSD'
+                 '&startTime=2019-04-14T12%3A34%3A56.000000Z'),
+        ])
+        self.context.save_cursor.assert_called_once_with(
+            'bitmex', 'XBTUSD', AccountType.MARGIN, 'e2', values[0].tx_time
+        )
+
+        # Nothing newer
+        cursor.cr_time = values[0].tx_time
+        self.context.save_cursor.reset_mock()
+        self.target._query_private = MagicMock(return_value=executions[:1])
+        self.target._fetch_transaction('XBTUSD', -100000000, limit=2)
+        self.target._query_private.assert_called_once()
+        self.context.save_cursor.assert_not_called()
+
+        # No response
+        cursor.cr_time = values[1].tx_time
+        self.target._query_private = MagicMock(side_effect=[executions, None])
+        self.target._fetch_transaction('XBTUSD', -100000000, limit=2)
+        self.assertEqual(2, self.target._query_private.call_count)
+        self.context.save_cursor.assert_not_called()
+
+
+    def test__fetch_executions(self):
+        start = datetime(year=2019, month=4, day=14, tzinfo=utc)
+        end = datetime(year=2019, month=4, day=15, tzinfo=utc)
+
+        self.target._query_private = MagicMock(side_effect=[[
+            {"execID": "e1", "orderID": "o1", "symbol": "XBTUSD", "side": "Buy",
+             "lastQty": 20, "lastPx": 4000, "execComm": 0, "transactTime": "2019-04-14T12:34:56.000Z"},
+            {"execID": "e2", "orderID": "o2", "symbol": "XBTUSD", "side": "",
+             "execComm": 100, "transactTime": "2019-04-15T00:00:00.000Z"},
+        ], []])
+
+        pages = list(self.target._fetch_executions('XBTUSD', -100000000, start, end))
+        self.assertEqual([['e1']], [[v.tx_eid for v in p] for p in pages])
+        self.target._query_private.assert_has_calls([
+            call('/api/v1/execution/tradeHistory?reverse=False&count=500&start=0&symbol=XBTUSD'
+                 '&startTime=2019-04-14T00%3A00%3A00.000000Z&endTime=2019-04-15T00%3A00%3A00.000000Z'),
+            call('/api/v1/execution/tradeHistory?reverse=False&count=500&start=2&symbol=XBTUSD'
+                 '&startTime=2019-04-14T00%3A00%3A00.000000Z&endTime=2019-04-15T00%3A00%3A00.000000Z'),
+        ])
+
+        # Incomplete
+        self.target._query_private = MagicMock(return_value=None)
+        with self.assertRaises(Exception):
+            list(self.target._fetch_executions('XBTUSD', -100000000, start, end))
+
+    def test_backfill_transactions(self):
+        start = datetime(year=2019, month=4, day=14, tzinfo=utc)
+        end = start + timedelta(hours=60)
+
+        self.context.requests_get = MagicMock(return_value=[{'symbol': 'XBTUSD', 'multiplier': -100000000}])
+        self.context.backfill_transactions = MagicMock(return_value={'fetched': 0})
+        self.assertEqual({'fetched': 0}, self.target.backfill_transactions('XBTUSD', start, end))
+        self.context.requests_get.assert_called_once_with(
+            'https://www.bitmex.com/api/v1/instrument?symbol=XBTUSD&count=1'
+        )
+        self.context.backfill_transactions.assert_called_once_with('bitmex', [
+            ('XBTUSD', -100000000, start, start + timedelta(hours=24)),
+            ('XBTUSD', -100000000, start + timedelta(hours=24), start + timedelta(hours=48)),
+            ('XBTUSD', -100000000, start + timedelta(hours=48), end),
+        ], self.target._fetch_executions)
+
+        # Unknown
+        self.context.requests_get = MagicMock(return_value=[])
+        with self.assertRaises(Exception):
+            self.target.backfill_transactions('XBTUSD', start, end)
 
 if __name__ == '__main__':
     main()
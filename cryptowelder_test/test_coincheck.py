@@ -1,7 +1,7 @@
 from datetime import datetime
 from decimal import Decimal
 from unittest import TestCase, main
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, call
 
 from pytz import utc
 
@@ -17,6 +17,10 @@ class TestCoincheckWelder(TestCase):
         self.context.get_logger.return_value = MagicMock()
         self.context.get_property = lambda section, key, val: val
         self.context.parse_iso_timestamp = CryptowelderContext._parse_iso_timestamp
+        self.context.run_tasks = lambda key, tasks: [t[0](*t[1:]) for t in tasks]
+        self.context.run_schedule = lambda key, jobs, **kwargs: [
+            [j[1]() for j in jobs] for _ in iter(self.context.is_closed, True)
+        ]
 
         self.target = CoincheckWelder(self.context)
 
@@ -322,6 +326,8 @@ class TestCoincheckWelder(TestCase):
         """), None]
 
         # Query 3 times
+        self.context.fetch_cursor = MagicMock(return_value=None)
+        self.context.save_cursor = MagicMock()
         self.target._query_private = MagicMock(side_effect=side_effects)
         self.context.save_transactions = MagicMock(side_effect=([None], []))
         self.target._process_transaction()
@@ -331,6 +337,11 @@ class TestCoincheckWelder(TestCase):
         calls = self.context.save_transactions.call_args_list
         self.assertEqual(2, len(calls))
 
+        self.context.fetch_cursor.assert_called_once_with('coincheck', '*', AccountType.CASH)
+        self.context.save_cursor.assert_called_once_with(
+            'coincheck', '*', AccountType.CASH, 38, calls[0][0][0][0].tx_time
+        )
+
         values = list(calls[0][0][0])
         self.assertEqual(2, len(values))
 
@@ -381,7 +392,28 @@ class TestCoincheckWelder(TestCase):
         self.assertEqual('-0.1', value.tx_inst)
         self.assertEqual('4094.09', value.tx_fund)
 
+        # Incremental
+        self.context.fetch_cursor = MagicMock(return_value=MagicMock(cr_seq='36'))
+        self.context.save_cursor.reset_mock()
+        self.target._query_private = MagicMock(side_effect=[{"success": True, "data": [
+            {"id": 37, "order_id": 48, "created_at": "2015-11-18T07:02:21.000Z", "pair": "btc_jpy",
+             "funds": {"btc": "-0.1", "jpy": "4094.09"}},
+            {"id": 38, "order_id": 49, "created_at": "2015-11-18T07:02:22.000Z", "pair": "btc_jpy",
+             "funds": {"btc": "0.1", "jpy": "-4096.135"}},
+        ]}, {"success": True, "data": []}])
+        self.context.save_transactions = MagicMock(return_value=[])
+        self.target._process_transaction()
+        self.target._query_private.assert_has_calls([
+            call('/api/exchange/orders/transactions_pagination?limit=100&order=asc&starting_after=36'),
+            call('/api/exchange/orders/transactions_pagination?limit=100&order=asc&starting_after=38'),
+        ])
+        self.assertEqual(2, len(self.context.save_transactions.call_args_list))
+        self.context.save_cursor.assert_called_once_with(
+            'coincheck', '*', AccountType.CASH, 38, self.context.save_transactions.call_args_list[0][0][0][1].tx_time
+        )
+
         # Empty Trades
+        self.context.fetch_cursor = MagicMock(return_value=None)
         self.target._query_private = MagicMock(return_value={"success": True})
         self.context.save_transactions = MagicMock(side_effect=[[None], None])
         self.target._process_transaction()
@@ -4,16 +4,24 @@ from decimal import Decimal
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from logging import DEBUG, StreamHandler
 from logging.handlers import BufferingHandler
-from threading import Thread
-from time import sleep
+from os import path
+from tempfile import TemporaryDirectory
+from threading import Thread, Lock, current_thread
+from time import sleep, monotonic, time
 from unittest import TestCase, main
 from unittest.mock import MagicMock
 
+from prometheus_client import REGISTRY
 from pytz import utc
 from requests import get
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
 
 from cryptowelder.context import CryptowelderContext, Metric, \
-    Product, Evaluation, Account, Transaction, Ticker, Balance, Position, AccountType, UnitType, TransactionType
+    Product, Evaluation, Account, Transaction, Ticker, Balance, Position, AccountType, UnitType, TransactionType, \
+    TransactionHour, TransactionMark, Cursor, Watermark
 
 
 class TestHander(BaseHTTPRequestHandler):
@@ -42,17 +50,33 @@ class TestHander(BaseHTTPRequestHandler):
             self.wfile.write(str.encode(self.CONTENT))
 
 
+class TestLimitHander(BaseHTTPRequestHandler):
+
+    @classmethod
+    def init(cls, *, headers=None):
+        cls.HEADERS = headers if headers is not None else {}
+
+    def do_GET(self):
+        self.send_response(429, "TEST-LIMIT")
+        for k, v in self.HEADERS.items():
+            self.send_header(k, v)
+        self.end_headers()
+
+
 class TestCryptowelderContext(TestCase):
 
     @classmethod
     def setUpClass(cls):
         cls.SERVER = HTTPServer(('localhost', 65535), TestHander)
         Thread(target=lambda: cls.SERVER.serve_forever()).start()
+        cls.LIMIT_SERVER = HTTPServer(('localhost', 65534), TestLimitHander)
+        Thread(target=lambda: cls.LIMIT_SERVER.serve_forever()).start()
         sleep(1)  # Wait for the server to start.
 
     @classmethod
     def tearDownClass(cls):
         cls.SERVER.shutdown()
+        cls.LIMIT_SERVER.shutdown()
 
     def setUp(self):
         self.target = CryptowelderContext(read_only=False)
@@ -183,6 +207,39 @@ class TestCryptowelderContext(TestCase):
 
         self.assertIsNone(self.target._parse(None))
         self.assertIsNone(self.target._parse(''))
+        self.assertIsNone(self.target._parse(b''))
+
+    def test__parse_select(self):
+        result = self.target._parse(
+            b'{"code":"200000", "data":{"ticker":[{"symbol":"A", "last":"1.2"}, {"symbol":"B", "last":"3.4"}]}}',
+            select=lambda o: 'symbol' not in o or o['symbol'] in {'B'}
+        )
+        self.assertEqual(result['code'], '200000')
+        self.assertEqual(result['data']['ticker'], [None, {'symbol': 'B', 'last': '3.4'}])
+
+    def test__parse_decoder(self):
+        values = [
+            b'{"str":"foo", "int":123, "flt":1.20, "flg":true, "nil":null}',
+            b'[{"s":"1.2"}, {"s":"3.4", "l":[1, 2, {"f":5.60}]}]',
+            b'{"s":"1.2", "l":[1, 2, 3]}',
+            '{"s":"\\u3042", "f":1e-8}'.encode(),
+        ]
+
+        for value in values:
+            expected = self.target._parse(value.decode())
+            self.assertEqual(repr(self.target._parse(value)), repr(expected))
+            self.assertEqual(repr(self.target._parse(value, decoder='json')), repr(expected))
+            self.assertEqual(repr(self.target._parse(value, decoder='orjson')), repr(expected))
+
+        self.assertTrue(self.target._has_float([1, {'a': [2, 3.0]}]))
+        self.assertFalse(self.target._has_float([1, {'a': [2, '3.0']}]))
+        self.assertFalse(self.target._has_float('3.0'))
+
+        self.assertEqual(self.target._get_decoder('http://localhost:65535'), 'json')
+        self.target.set_property(self.target._SECTION, 'request_decoder', 'orjson')
+        self.assertEqual(self.target._get_decoder('http://localhost:65535'), 'orjson')
+        self.target.set_property(self.target._SECTION, 'request_decoder@localhost:65535', 'json')
+        self.assertEqual(self.target._get_decoder('http://localhost:65535'), 'json')
 
     def test__request(self):
         TestHander.init()
@@ -231,6 +288,67 @@ class TestCryptowelderContext(TestCase):
         except BaseException as e:
             self.assertEqual('test refuse', str(e.args[0]))
 
+    def test__request_TooManyRequests(self):
+        self.target.set_property(self.target._SECTION, 'request_retry', '2')
+        self.target.set_property(self.target._SECTION, 'request_sleep', '0.001')
+        counter = MagicMock()
+
+        # Retried after the advertised delay, then gives up.
+        TestLimitHander.init(headers={'Retry-After': '0.1'})
+        start = monotonic()
+        try:
+            self.target._request(lambda: get("http://localhost:65534"), counter=counter, limit='test')
+            self.fail('Error Expected : 429')
+        except BaseException as e:
+            self.assertEqual('429', str(e.args[0]))
+        self.assertEqual(counter.call_count, 3)
+        self.assertGreaterEqual(monotonic() - start, 0.2)
+
+        # Without Retry-After, fails immediately as other 4xx.
+        counter.reset_mock()
+        TestLimitHander.init()
+        try:
+            self.target._request(lambda: get("http://localhost:65534"), counter=counter, limit='test')
+            self.fail('Error Expected : 429')
+        except BaseException as e:
+            self.assertEqual('429', str(e.args[0]))
+        self.assertEqual(counter.call_count, 1)
+
+    def test__acquire(self):
+        self.target.set_property(self.target._SECTION, 'request_rate', '1000')
+        self.target.set_property(self.target._SECTION, 'request_rate@localhost', '20')
+        self.target.set_property(self.target._SECTION, 'request_burst@localhost/private', '5')
+
+        # No host specific rate, falls back to the default 1000/s.
+        start = monotonic()
+        for i in range(0, 10):
+            self.target._acquire('example.com')
+        self.assertLess(monotonic() - start, 0.1)
+
+        # Burst, then throttled at 20/s
+        start = monotonic()
+        for i in range(0, 10):
+            self.target._acquire('localhost/private')
+        self.assertGreaterEqual(monotonic() - start, 0.2)
+
+    def test__throttle(self):
+        response = MagicMock()
+
+        response.headers = {'Retry-After': '2'}
+        self.assertEqual(self.target._throttle('test', response), 2.0)
+
+        response.headers = {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(int(time()) + 5)}
+        self.assertAlmostEqual(self.target._throttle('test', response), 5.0, delta=1.0)
+
+        response.headers = {'X-RateLimit-Remaining': '9', 'X-RateLimit-Reset': str(int(time()) + 5)}
+        self.assertIsNone(self.target._throttle('test', response))
+
+        response.headers = {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        self.assertEqual(self.target._throttle('test', response), 0.0)
+
+        response.headers = {'Retry-After': 'foo'}
+        self.assertIsNone(self.target._throttle('test', response))
+
     def test_requests_get(self):
         response = "{'foo': 'bar'}"
         self.target._request = MagicMock(return_value=response)
@@ -243,6 +361,159 @@ class TestCryptowelderContext(TestCase):
         self.assertEqual(self.target.requests_post('http://localhost:65535'), response)
         self.target._request.assert_called_once()
 
+    def test__get_session(self):
+        s1 = self.target._get_session('http://localhost:65535/foo')
+        s2 = self.target._get_session('http://localhost:65535/bar?hoge=piyo')
+        s3 = self.target._get_session('https://localhost:65535/foo')
+        s4 = self.target._get_session('http://127.0.0.1:65535/foo')
+        self.assertIs(s1, s2)
+        self.assertIsNot(s1, s3)
+        self.assertIsNot(s1, s4)
+
+    def test__count_connections(self):
+        labels = {'url_host': 'localhost:65535', 'type': 'new'}
+        before = REGISTRY.get_sample_value('cryptowelder_connections_total', labels) or 0
+
+        TestHander.init(content='{"foo":"bar"}')
+        self.assertEqual(self.target.requests_get('http://localhost:65535'), {'foo': 'bar'})
+        self.assertEqual(self.target.requests_get('http://localhost:65535'), {'foo': 'bar'})
+
+        # Server closes HTTP/1.0 connections, so each request opens a new one.
+        after = REGISTRY.get_sample_value('cryptowelder_connections_total', labels)
+        self.assertEqual(after - before, 2)
+
+    def test_run_tasks(self):
+        self.target.set_property('test', 'task_limit', '2')
+
+        lock = Lock()
+        counts = {'active': 0, 'peak': 0}
+
+        def execute(value):
+            pooled = current_thread().name.startswith('cryptowelder-task')
+
+            with lock:
+                counts['active'] = counts['active'] + (1 if pooled else 0)
+                counts['peak'] = max(counts['peak'], counts['active'])
+
+            sleep(0.02)
+
+            with lock:
+                counts['active'] = counts['active'] - (1 if pooled else 0)
+
+            if value < 0:
+                raise Exception(value)
+
+            return value
+
+        futures = self.target.run_tasks('test', [(execute, i) for i in range(0, 8)] + [(execute, -1)])
+        self.assertEqual([f.result() for f in futures[:8]], list(range(0, 8)))
+        self.assertEqual(futures[8].exception().args, (-1,))
+        self.assertEqual(counts['peak'], 2)
+
+        # Nested fan-out under the same quota
+        def nested(value):
+            return sum(f.result() for f in self.target.run_tasks('test', [(execute, value), (execute, value)]))
+
+        futures = self.target.run_tasks('test', [(nested, i) for i in range(0, 4)])
+        self.assertEqual([f.result() for f in futures], [0, 2, 4, 6])
+        self.assertEqual(counts['peak'], 2)
+
+    def test_get_cached(self):
+        values = []
+
+        def load():
+            values.append(len(values))
+
+            if values[-1] >= 3:
+                raise Exception(values[-1])
+
+            return values[-1] if values[-1] != 1 else None
+
+        # Miss, and not cached if None
+        self.assertEqual(0, self.target.get_cached('k', load, ttl=60))
+        self.assertEqual(0, self.target.get_cached('k', load, ttl=60))
+        self.assertIsNone(self.target.get_cached('n', load, ttl=60))
+        self.assertEqual(2, self.target.get_cached('n', load, ttl=60))
+        self.assertEqual(3, len(values))
+
+        # Stale value served while refreshed, and kept on the refresh failure.
+        self.assertEqual(0, self.target.get_cached('k', load, ttl=0))
+        sleep(0.1)
+        self.assertEqual(4, len(values))
+        self.assertEqual(0, self.target.get_cached('k', load, ttl=60))
+
+        # Failure of the initial load
+        with self.assertRaises(Exception):
+            self.target.get_cached('e', load, ttl=60)
+
+        # Refreshed on the shared task workers.
+        self.assertEqual(0, self.target.get_cached('k', lambda: current_thread().name, ttl=0))
+        sleep(0.1)
+        self.assertTrue(self.target.get_cached('k', load, ttl=60).startswith('cryptowelder-task'))
+
+        self.target.requests_get = MagicMock(return_value=[{'id': 1}])
+        self.assertEqual([{'id': 1}], self.target.requests_cached('http://localhost/foo', {'b': 2, 'a': 1}))
+        self.assertEqual([{'id': 1}], self.target.requests_cached('http://localhost/foo', {'a': 1, 'b': 2}))
+        self.target.requests_get.assert_called_once_with('http://localhost/foo', {'b': 2, 'a': 1})
+
+    def test__get_interval(self):
+        self.assertEqual(20.0, self.target._get_interval('test', 'ticker', 20))
+
+        self.target.set_property('test', 'interval', '30')
+        self.assertEqual(30.0, self.target._get_interval('test', 'ticker', 20))
+        self.assertEqual(30.0, self.target._get_interval('test', 'balance', 20))
+
+        self.target.set_property('test', 'ticker_interval', '5')
+        self.assertEqual(5.0, self.target._get_interval('test', 'ticker', 20))
+        self.assertEqual(30.0, self.target._get_interval('test', 'balance', 20))
+
+    def test_run_schedule(self):
+        calls = {'fast': [], 'slow': [], 'fail': []}
+        threads = set()
+
+        def execute(name, duration):
+            calls[name].append(time())
+            threads.add(current_thread().name)
+            sleep(duration)
+
+            if name == 'fail':
+                raise Exception(name)
+
+        def close():
+            sleep(0.5)
+            self.target.set_property(self.target._SECTION, 'closed', 'true')
+
+        labels = {'exchange': 'test', 'task': 'slow'}
+        skipped = REGISTRY.get_sample_value('cryptowelder_schedule_skipped_total', labels) or 0
+
+        Thread(target=close).start()
+
+        self.target.set_property('test', 'fail_interval', '0.1')
+
+        self.target.run_schedule('test', [
+            ('fast', lambda: execute('fast', 0.0), 0.1),
+            ('slow', lambda: execute('slow', 0.25), lambda: 0.1),
+            ('fail', lambda: execute('fail', 0.0)),
+        ], default_interval=60, resolution=0.05)
+
+        # Fixed rate on the wall-clock grid, not delayed by the run itself.
+        self.assertGreaterEqual(len(calls['fast']), 4)
+        self.assertLessEqual(len(calls['fast']), 7)
+        self.assertTrue(all(t % 0.1 < 0.05 for t in calls['fast'][1:]))
+
+        # Overruns are skipped, and failures do not stop the schedule.
+        self.assertGreaterEqual(len(calls['slow']), 2)
+        self.assertLessEqual(len(calls['slow']), 3)
+        self.assertGreater(REGISTRY.get_sample_value('cryptowelder_schedule_skipped_total', labels), skipped)
+        self.assertGreaterEqual(len(calls['fail']), 4)
+
+        # Shared task workers, instead of a thread per run.
+        self.assertTrue(all(n.startswith('cryptowelder-task') for n in threads), threads)
+
+        lag = REGISTRY.get_sample_value('cryptowelder_schedule_lag_seconds', {'exchange': 'test', 'task': 'fast'})
+        self.assertGreaterEqual(lag, 0.0)
+        self.assertLess(lag, 0.1)
+
     def test__truncate_datetime(self):
         # Arbitrary Time
         dt = datetime(year=2017, month=4, day=14, hour=12, minute=34, second=56, microsecond=789123, tzinfo=utc)
@@ -332,6 +603,43 @@ class TestCryptowelderContext(TestCase):
         results = self.target.save_products([p1])
         self.assertEqual(len(results), 0)
 
+    def test_save_products_known(self):
+        self.target._create_all()
+        self.target.set_property(self.target._SECTION, 'known_size', '2')
+
+        products = []
+
+        for i in range(0, 3):
+            p = Product()
+            p.pr_site = 'ps'
+            p.pr_code = 'pc%s' % i
+            products.append(p)
+
+        # Bounded
+        results = self.target.save_products(products)
+        self.assertEqual(len(results), 3)
+        self.assertFalse(self.target._is_known(Product, ('ps', 'pc0')))
+        self.assertTrue(self.target._is_known(Product, ('ps', 'pc1')))
+        self.assertTrue(self.target._is_known(Product, ('ps', 'pc2')))
+        self.assertFalse(self.target._is_known(Evaluation, ('ps', 'pc2')))
+
+        # Evicted key falls back to the database.
+        results = self.target.save_products(products[:1])
+        self.assertEqual(len(results), 0)
+        self.assertTrue(self.target._is_known(Product, ('ps', 'pc0')))
+        self.assertFalse(self.target._is_known(Product, ('ps', 'pc1')))
+
+        # Invalidated on rollback
+        p = copy(products[0])
+        p.pr_code = None
+
+        with self.assertRaises(BaseException):
+            self.target.save_products([p])
+
+        self.assertFalse(self.target._is_known(Product, ('ps', 'pc0')))
+        self.assertFalse(self.target._is_known(Product, ('ps', 'pc1')))
+        self.assertFalse(self.target._is_known(Product, ('ps', 'pc2')))
+
     def test_save_evaluations(self):
         self.target._create_all()
 
@@ -419,6 +727,108 @@ class TestCryptowelderContext(TestCase):
         results = self.target.save_tickers([t1])
         self.assertEqual(len(results), 0)
 
+    def test_save_tickers_upsert(self):
+        self.target._create_all()
+
+        dt = datetime(year=2017, month=4, day=14, hour=12, minute=34, tzinfo=utc)
+
+        p = Product()
+        p.pr_site = 'ts'
+        p.pr_code = 'tp'
+        self.target.save_products([p])
+
+        t1 = Ticker()
+        t1.tk_site = 'ts'
+        t1.tk_code = 'tp'
+        t1.tk_time = dt
+        t1.tk_ltp = Decimal('1.2')
+
+        t2 = copy(t1)
+        t2.tk_ltp = Decimal('2.3')
+
+        t3 = copy(t1)
+        t3.tk_ltp = Decimal('3.4')
+
+        # Duplicate keys in a batch, last one wins.
+        results = self.target.save_tickers([t1, t2])
+        self.assertEqual(len(results), 2)
+        values = self.target.fetch_tickers(dt)
+        self.assertEqual(len(values), 1)
+        self.assertEqual(values[0].ticker.tk_ltp, Decimal('2.3'))
+
+        # Existing key is replaced.
+        results = self.target.save_tickers([t3])
+        self.assertEqual(len(results), 1)
+        values = self.target.fetch_tickers(dt)
+        self.assertEqual(len(values), 1)
+        self.assertEqual(values[0].ticker.tk_ltp, Decimal('3.4'))
+
+    def test_save_tickers_write_behind(self):
+
+        with TemporaryDirectory() as directory:
+
+            # Writer thread requires a shared database, instead of thread-local in-memory ones.
+            config = path.join(directory, 'test.cfg')
+
+            with open(config, 'w') as f:
+                f.write('[context]\ndatabase = sqlite:///%s\n' % path.join(directory, 'test.db'))
+
+            self.target = CryptowelderContext(config=config, read_only=False)
+            self.target._create_all()
+            self.target.set_property(self.target._SECTION, 'write_queue', '1')
+            self.target.set_property(self.target._SECTION, 'write_latency', '0.01')
+
+            dt = datetime(year=2017, month=4, day=14, hour=12, minute=34, tzinfo=utc)
+
+            p = Product()
+            p.pr_site = 'ts'
+            p.pr_code = 'tp'
+            self.target.save_products([p])
+
+            t1 = Ticker()
+            t1.tk_site = 'ts'
+            t1.tk_code = 'tp'
+            t1.tk_time = dt - timedelta(minutes=1)
+            t1.tk_ltp = Decimal('1.2')
+
+            t2 = copy(t1)
+            t2.tk_time = dt
+            t2.tk_ltp = Decimal('2.3')
+
+            try:
+
+                # Overflow written directly
+                results = self.target.save_tickers([t1, None, t2])
+                self.assertEqual(len(results), 2)
+                self.assertTrue(t1 in results)
+                self.assertTrue(t2 in results)
+
+                for i in range(0, 100):
+
+                    values = self.target.fetch_tickers(dt - timedelta(minutes=1))
+
+                    if len(values) > 0 and values[0].ticker.tk_ltp == Decimal('1.2'):
+                        break
+
+                    sleep(0.1)
+
+                values = self.target.fetch_tickers(dt - timedelta(minutes=1))
+                self.assertEqual(len(values), 1)
+                self.assertEqual(values[0].ticker.tk_ltp, Decimal('1.2'))
+
+                values = self.target.fetch_tickers(dt)
+                self.assertEqual(len(values), 1)
+                self.assertEqual(values[0].ticker.tk_ltp, Decimal('2.3'))
+
+                # Read-only
+                self.target._is_read_only = lambda: True
+                results = self.target.save_tickers([t1])
+                self.assertEqual(len(results), 0)
+
+            finally:
+
+                self.target.set_property(self.target._SECTION, 'closed', 'true')
+
     def test_save_balances(self):
         self.target._create_all()
 
@@ -596,6 +1006,84 @@ class TestCryptowelderContext(TestCase):
         results = self.target.save_transactions([t1])
         self.assertEqual(len(results), 0)
 
+    def test_save_transactions_batch(self):
+        self.target._create_all()
+        self.target.set_property(self.target._SECTION, 'query_batch', '2')
+
+        values = []
+
+        for i in range(0, 5):
+            t = Transaction()
+            t.tx_site = 'ts'
+            t.tx_code = 'tp'
+            t.tx_type = TransactionType.TRADE
+            t.tx_acct = AccountType.CASH
+            t.tx_oid = 'to%s' % i
+            t.tx_eid = 'te%s' % i
+            t.tx_time = datetime.now()
+            t.tx_fund = Decimal('-1.2')
+            t.tx_inst = Decimal('+2.3')
+            values.append(t)
+
+        # Existing records across batches
+        results = self.target.save_transactions([values[0], values[2], values[4]])
+        self.assertEqual(len(results), 3)
+
+        results = self.target.save_transactions(values)
+        self.assertEqual(len(results), 2)
+        self.assertTrue(values[1] in results)
+        self.assertTrue(values[3] in results)
+
+        # Duplicate records in a batch
+        t1 = copy(values[0])
+        t1.tx_eid = 'NEW'
+        t2 = copy(t1)
+
+        results = self.target.save_transactions([t1, t2])
+        self.assertEqual(len(results), 1)
+        self.assertTrue(t1 in results)
+
+    def test_backfill_transactions(self):
+        self.target.set_property('test', 'task_limit', '2')
+
+        saved = []
+
+        def save(values):
+            saved.append(list(values))
+            return values[1:]  # First ones are existing.
+
+        def fetch(lower, upper):
+
+            if lower < 0:
+                raise Exception(lower)
+
+            for i in range(lower, upper, 2):
+                yield list(range(i, min(i + 2, upper)))
+
+        self.target.save_transactions = save
+
+        stats = self.target.backfill_transactions('test', [(0, 5), (5, 10), (-1, 0), (10, 11)], fetch, batch=3)
+        self.assertEqual({'total': 4, 'ranges': 3, 'failed': 1, 'fetched': 11, 'saved': 11 - len(saved),
+                          'write_failed': 0}, stats)
+        self.assertEqual(list(range(0, 11)), sorted(v for values in saved for v in values))
+        self.assertTrue(all(len(values) >= 3 for values in saved[:-1]))
+
+        # Failed batches are counted, instead of dropped as saved=0.
+        def fail(values):
+            if 4 in values:
+                raise Exception('test')
+            return values
+
+        self.target.save_transactions = fail
+
+        stats = self.target.backfill_transactions('test', [(0, 5)], fetch, batch=2)
+        self.assertEqual({'total': 1, 'ranges': 1, 'failed': 0, 'fetched': 5, 'saved': 4, 'write_failed': 1}, stats)
+
+        # Original error from the tasks, with the writer terminated.
+        self.target.run_tasks = MagicMock(side_effect=ValueError('test'))
+        with self.assertRaises(ValueError):
+            self.target.backfill_transactions('test', [(0, 5)], fetch)
+
     def test_save_metrics(self):
         self.target._create_all()
 
@@ -704,12 +1192,213 @@ class TestCryptowelderContext(TestCase):
         except BaseException as e:
             self.assertIsNotNone(e)
 
+    def test_delete_metrics_chunks(self):
+        self.target._create_all()
+        self.target.set_property(self.target._SECTION, 'purge_chunk', '45')
+
+        base = datetime(year=2017, month=4, day=14, hour=12, minute=34, tzinfo=utc)
+
+        metrics = []
+
+        for i in range(0, 200):
+            m = Metric()
+            m.mc_type = 'test'
+            m.mc_time = base + timedelta(minutes=i * 7, seconds=i % 3 * 20)
+            m.mc_name = 'm%s' % i
+            metrics.append(m)
+
+        self.target.save_metrics(metrics)
+
+        remaining = {m.mc_name: m.mc_time for m in metrics}
+
+        for cutoff, exclude in [
+            (base + timedelta(hours=20), (0, 15, 30, 45)),
+            (base + timedelta(hours=8), (0,)),
+            (base + timedelta(hours=4), None),
+            (base + timedelta(hours=24), (0, 15, 30, 45)),
+            (base + timedelta(hours=24), (0, 15, 30, 45)),
+        ]:
+            expected = [k for k, v in remaining.items() if v < cutoff and (exclude is None or v.minute not in exclude)]
+
+            count = self.target.delete_metrics(cutoff, exclude_minutes=exclude)
+            self.assertEqual(count, len(expected), (cutoff, exclude))
+
+            for k in expected:
+                del remaining[k]
+
+        self.assertEqual(
+            [(base + timedelta(minutes=1), base + timedelta(minutes=2))],
+            self.target._purge_ranges(base, base + timedelta(minutes=2), (34,))
+        )
+
+        self.assertEqual(
+            [(base.replace(minute=1), base.replace(minute=14)), (base.replace(minute=15), base.replace(minute=16))],
+            self.target._purge_ranges(base.replace(minute=0), base.replace(minute=16), (0, 14))
+        )
+
+    def test_delete_metrics_start(self):
+        self.target._create_all()
+
+        base = datetime(year=2017, month=4, day=14, hour=12, minute=0, tzinfo=utc)
+
+        metrics = []
+
+        for i, t in enumerate([base - timedelta(days=365), base, base + timedelta(minutes=1)]):
+            m = Metric()
+            m.mc_type = 'test'
+            m.mc_time = t
+            m.mc_name = 'm%s' % i
+            metrics.append(m)
+
+        self.target.save_metrics(metrics)
+
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(Engine, 'before_cursor_execute', count)
+
+        try:
+            self.assertEqual(1, self.target.delete_metrics(base + timedelta(hours=1), exclude_minutes=(0, 30)))
+        finally:
+            event.remove(Engine, 'before_cursor_execute', count)
+
+        # Starts from the first purged row, instead of the retained one a year before.
+        self.assertEqual(1, len([s for s in statements if s.startswith('DELETE')]))
+
+        # Plain time ranges, without functions of the row time.
+        self.assertFalse([s for s in statements if 'strftime' in s or 'EXTRACT' in s.upper()])
+
+        self.assertEqual(0, self.target.delete_metrics(base + timedelta(hours=2), exclude_minutes=(0, 30)))
+        self.assertEqual(2, self.target.delete_metrics(base + timedelta(hours=2)))
+
     def test_fetch_tickers(self):
         self.target._create_all()
 
         # TODO : Test data
         self.target.fetch_tickers(datetime.now())
 
+    def test_fetch_tickers_index(self):
+        self.target._create_all()
+
+        dt = datetime(year=2017, month=4, day=14, hour=12, minute=34, tzinfo=utc)
+        self.target.get_now = lambda: dt
+
+        def create(code, minutes, ltp, ask=None):
+            t = Ticker()
+            t.tk_site = 'ts'
+            t.tk_code = code
+            t.tk_time = dt + timedelta(minutes=minutes)
+            t.tk_ask = ask
+            t.tk_ltp = ltp
+            return t
+
+        products = []
+        for code, expiry in [('p1', None), ('p2', dt - timedelta(minutes=2)), ('p3', None)]:
+            p = Product()
+            p.pr_site = 'ts'
+            p.pr_code = code
+            p.pr_inst = 'BTC'
+            p.pr_fund = 'JPY'
+            p.pr_expr = expiry
+            products.append(p)
+        self.target.save_products(products)
+
+        e = Evaluation()
+        e.ev_site = 'ts'
+        e.ev_unit = 'JPY'
+        self.target.save_evaluations([e])
+
+        self.target.save_tickers([
+            create('p1', -30, Decimal('1.0')),
+            create('p1', -20, Decimal('1.1')),
+            create('p1', -2, Decimal('1.2')),
+            create('p2', -25, Decimal('2.0')),
+            create('p2', -4, '2.1'),
+            create('p3', -3, None, Decimal('0')),
+            create('px', -1, Decimal('9.9')),
+        ])
+
+        def fetch(time, include_expired):
+            values = self.target.fetch_tickers(time, include_expired=include_expired)
+            return sorted([(
+                v.ticker.tk_code, v.ticker.tk_time, v.ticker.tk_ltp,
+                v.product.pr_code, v.inst.ev_unit if v.inst else None, v.fund.ev_unit if v.fund else None,
+            ) for v in values])
+
+        def verify(count):
+            before = REGISTRY.get_sample_value('cryptowelder_ticker_index_total', {'result': 'hit'}) or 0
+
+            for include_expired in [True, False]:
+                for minutes in range(-35, 5):
+                    time = dt + timedelta(minutes=minutes)
+
+                    self.target.set_property(self.target._SECTION, 'ticker_index', '0')
+                    expected = fetch(time, include_expired)
+
+                    self.target.set_property(self.target._SECTION, 'ticker_index', '10')
+                    actual = fetch(time, include_expired)
+
+                    self.assertEqual(actual, expected, time)
+
+            hits = REGISTRY.get_sample_value('cryptowelder_ticker_index_total', {'result': 'hit'})
+            self.assertEqual(hits - before, count)
+
+        verify(2 * 15)  # -10 minutes and after
+
+        # Updated after warm, including the one overwritten without any price.
+        self.target.get_now = lambda: dt + timedelta(minutes=3)
+        self.target.save_tickers([
+            create('p1', 1, Decimal('1.3')),
+            create('p1', -2, None),
+            create('p3', 2, None, Decimal('3.1')),
+        ])
+        verify(2 * 12)  # -7 minutes and after
+
+        self.assertEqual(self.target.fetch_tickers(dt)[0].ticker.tk_ltp, Decimal('1.1'))
+
+    def test__query_latest(self):
+        self.target._create_all()
+
+        dt = datetime(year=2017, month=4, day=14, hour=12, minute=34, tzinfo=utc)
+
+        products = []
+        for code in ['c1', 'c2', 'c3']:
+            p = Product()
+            p.pr_site = 'ps'
+            p.pr_code = code
+            products.append(p)
+        self.target.save_products(products)
+
+        positions = []
+        for code, minutes in [('c1', -3), ('c1', -2), ('c1', 1), ('c2', -5), ('c3', 1)]:
+            p = Position()
+            p.ps_site = 'ps'
+            p.ps_code = code
+            p.ps_time = dt + timedelta(minutes=minutes)
+            p.ps_inst = Decimal(minutes)
+            positions.append(p)
+        self.target.save_positions(positions)
+
+        # Portable on SQLite
+        self.assertEqual(self.target._get_query_strategy(), 'portable')
+        results = sorted([(v.position.ps_code, v.position.ps_inst) for v in self.target.fetch_positions(dt)])
+        self.assertEqual(results, [('c1', Decimal('-2')), ('c2', Decimal('-5'))])
+
+        # LATERAL for PostgreSQL, one index descent per product.
+        session = Session()
+        latest = self.target._query_latest(session, Position, Position.ps_time, dt, strategy='lateral')
+        sql = ' '.join(str(session.query(latest).statement.compile(dialect=postgresql.dialect())).split())
+        self.assertTrue('FROM t_product JOIN LATERAL (SELECT' in sql, sql)
+        self.assertTrue('WHERE t_position.ps_site = t_product.pr_site AND t_position.ps_code = t_product.pr_code '
+                        'AND t_position.ps_time <= %(ps_time_1)s ORDER BY t_position.ps_time DESC LIMIT' in sql, sql)
+
+        latest = self.target._query_latest(session, Balance, Balance.bc_time, dt, strategy='lateral')
+        sql = ' '.join(str(session.query(latest).statement.compile(dialect=postgresql.dialect())).split())
+        self.assertTrue('FROM t_account JOIN LATERAL (SELECT' in sql, sql)
+        self.assertTrue('ORDER BY t_balance.bc_time DESC LIMIT' in sql, sql)
+
     def test_fetch_balances(self):
         self.target._create_all()
 
@@ -730,6 +1419,430 @@ class TestCryptowelderContext(TestCase):
         # TODO : Test data
         self.target.fetch_transactions(now - timedelta(days=1), now)
 
+    def test_fetch_transactions_buckets(self):
+        self.target._create_all()
+
+        dt = datetime(year=2017, month=4, day=14, hour=12, minute=34, tzinfo=utc)
+        self.target.get_now = lambda: dt
+
+        for code in ['p1', 'p2']:
+            p = Product()
+            p.pr_site = 'ts'
+            p.pr_code = code
+            p.pr_inst = 'BTC'
+            p.pr_fund = 'JPY'
+            self.target.save_products([p])
+
+        e = Evaluation()
+        e.ev_site = 'ts'
+        e.ev_unit = 'JPY'
+        self.target.save_evaluations([e])
+
+        def create(code, minutes, inst, fund):
+            t = Transaction()
+            t.tx_site = 'ts'
+            t.tx_code = code
+            t.tx_type = TransactionType.TRADE
+            t.tx_acct = AccountType.CASH
+            t.tx_oid = 'o%s' % minutes
+            t.tx_eid = 'e%s' % minutes
+            t.tx_time = dt + timedelta(minutes=minutes)
+            t.tx_inst = inst
+            t.tx_fund = fund
+            return t
+
+        self.target.save_transactions([create('p1' if i % 3 else 'p2', i * 17, Decimal(i), Decimal(-i * 2))
+                                       for i in range(-60, 10)])
+        self.target.save_transactions([create('p1', -1, None, Decimal('1.5')), create('px', -2, Decimal(1), None)])
+
+        def normalize(values):
+            return sorted([(
+                v.tx_site, v.tx_code, v.tx_size, v.tx_time_min.replace(tzinfo=None), v.tx_time_max.replace(tzinfo=None),
+                *[Decimal(str(x)).quantize(Decimal('1E-8')) if x is not None else None  # SQLite sums abs() as float.
+                  for x in (v.tx_net_inst, v.tx_net_fund, v.tx_grs_inst, v.tx_grs_fund)],
+                v.product.pr_code, v.ev_inst, v.ev_fund.ev_unit
+            ) for v in values])
+
+        def fetch(start, end):
+            return normalize(self.target.fetch_transactions(start, end))
+
+        windows = [
+            (dt - timedelta(hours=12), dt),
+            (dt.replace(minute=0) - timedelta(hours=15), dt.replace(minute=0)),
+            (dt - timedelta(hours=3, minutes=1), dt + timedelta(minutes=1)),
+            (dt - timedelta(minutes=30), dt),
+            (dt - timedelta(days=1), dt + timedelta(hours=3)),
+        ]
+
+        def verify():
+            for start, end in windows:
+                self.target.set_property(self.target._SECTION, 'transaction_buckets', '0')
+                expected = fetch(start, end)
+                shifted = fetch(start - timedelta(minutes=7), end)
+                combined = self.target.fetch_transaction_windows({'a': start, 'b': start - timedelta(minutes=7)}, end)
+                self.assertEqual(normalize(combined['a']), expected, (start, end))
+                self.assertEqual(normalize(combined['b']), shifted, (start, end))
+
+                self.target.set_property(self.target._SECTION, 'transaction_buckets', '30')
+                actual = fetch(start, end)
+                combined = self.target.fetch_transaction_windows({'a': start, 'b': start - timedelta(minutes=7)}, end)
+                self.assertEqual(normalize(combined['a']), expected, (start, end))
+                self.assertEqual(normalize(combined['b']), shifted, (start, end))
+
+                self.assertEqual(actual, expected, (start, end))
+                self.assertTrue(len(expected) > 0)
+
+        verify()
+
+        # Inserted after the buckets are loaded, including late ones for the past hours.
+        self.target.save_transactions([create('p2', i * 13, Decimal('0.1'), Decimal(i)) for i in range(-80, 10)])
+        verify()
+
+        # Windows longer than the retention are clamped, instead of reloading the buckets on every call.
+        start = dt - timedelta(days=3)
+        self.target.set_property(self.target._SECTION, 'transaction_buckets', '0')
+        expected = fetch(start, dt)
+        self.target.set_property(self.target._SECTION, 'transaction_buckets', '1')
+        self.assertEqual(fetch(start, dt), expected)
+
+        self.target._read_buckets = MagicMock(side_effect=self.target._read_buckets)
+        self.assertEqual(fetch(start, dt), expected)
+        self.assertEqual(fetch(start, dt), expected)
+        self.target._read_buckets.assert_not_called()
+
+    def test_fetch_transactions_buckets_persisted(self):
+
+        with TemporaryDirectory() as directory:
+
+            # Restarted context requires a shared database, instead of thread-local in-memory ones.
+            database = 'sqlite:///%s' % path.join(directory, 'test.db')
+
+            config = path.join(directory, 'test.cfg')
+
+            with open(config, 'w') as f:
+                f.write('[context]\ndatabase = %s\ntransaction_buckets = 30\n' % database)
+
+            dt = datetime(year=2017, month=4, day=14, hour=12, minute=34, tzinfo=utc)
+
+            self.target = CryptowelderContext(config=config, read_only=False)
+            self.target._create_all()
+            self.target.get_now = lambda: dt
+
+            p = Product()
+            p.pr_site = 'ts'
+            p.pr_code = 'p1'
+            p.pr_inst = 'BTC'
+            p.pr_fund = 'JPY'
+            self.target.save_products([p])
+
+            def create(minutes, inst, fund):
+                t = Transaction()
+                t.tx_site = 'ts'
+                t.tx_code = 'p1'
+                t.tx_type = TransactionType.TRADE
+                t.tx_acct = AccountType.CASH
+                t.tx_oid = 'o%s' % minutes
+                t.tx_eid = 'e%s' % minutes
+                t.tx_time = dt + timedelta(minutes=minutes)
+                t.tx_inst = inst
+                t.tx_fund = fund
+                return t
+
+            self.target.save_transactions([create(i * 17, Decimal(i % 5), Decimal(i)) for i in range(-200, 20)])
+            self.target.save_transactions([create(-601, None, Decimal(3)), create(-602, Decimal(2), Decimal(-3))])
+
+            def fetch(target, start, end):
+                return sorted([(
+                    v.tx_code, v.tx_size, v.tx_time_min.replace(tzinfo=None), v.tx_time_max.replace(tzinfo=None),
+                    *[Decimal(str(x)).quantize(Decimal('1E-8')) if x is not None else None  # SQLite sums as float.
+                      for x in (v.tx_net_inst, v.tx_net_fund, v.tx_grs_inst, v.tx_grs_fund)],
+                ) for v in target.fetch_transactions(start, end)])
+
+            def verify(target, start, end):
+                target.set_property(target._SECTION, 'transaction_buckets', '0')
+                expected = fetch(target, start, end)
+
+                target.set_property(target._SECTION, 'transaction_buckets', '30')
+                actual = fetch(target, start, end)
+
+                self.assertEqual(actual, expected, (start, end))
+                self.assertEqual(len(expected), 1)
+
+            def count():
+                return create_engine(database).execute(
+                    'SELECT COUNT(DISTINCT th_hour) FROM %s' % TransactionHour.__tablename__).scalar()
+
+            # Windows sliding forward, with the expired hours subtracted.
+            for minutes in range(0, 300, 23):
+                now = dt + timedelta(minutes=minutes)
+                self.target.get_now = lambda: now
+                verify(self.target, now - timedelta(hours=12), now)
+                verify(self.target, now - timedelta(hours=24), now)
+                verify(self.target, now - timedelta(hours=1, minutes=30), now)
+
+            # Settled hours, from the earliest window start until an hour before the current one.
+            self.assertEqual(count(), 27)
+
+            def stale():
+                return create_engine(database).execute(
+                    'SELECT COUNT(DISTINCT th_hour) FROM %s LEFT OUTER JOIN %s ON tm_hour = th_hour'
+                    ' WHERE COALESCE(th_seq, 0) != COALESCE(tm_seq, 0)'
+                    % (TransactionHour.__tablename__, TransactionMark.__tablename__)).scalar()
+
+            # Late rows leave the persisted hour stale, until persisted again.
+            self.target.save_transactions([create(-605, Decimal(7), Decimal(7))])
+            self.assertEqual(stale(), 1)
+            verify(self.target, now - timedelta(hours=24), now)
+            self.assertEqual(stale(), 0)
+            self.assertEqual(count(), 27)
+
+            # Rows written by another process, such as the backfills.
+            writer = CryptowelderContext(config=config, read_only=False)
+            writer.get_now = lambda: now
+            writer.save_transactions([create(-606, Decimal(5), Decimal(-9)), create(-60, Decimal(1), Decimal(1))])
+            self.assertEqual(stale(), 2)
+
+            # Stale hours are not read back from the persisted ones.
+            reader = CryptowelderContext(config=config, read_only=True)
+            reader.get_now = lambda: now
+            verify(reader, now - timedelta(hours=24), now)
+            self.assertEqual(stale(), 2)
+
+            verify(self.target, now - timedelta(hours=24), now)
+            verify(self.target, now - timedelta(hours=12), now)
+            self.assertEqual(stale(), 0)
+
+            # Persisted again, with the rows of the other process.
+            self.target = CryptowelderContext(config=config, read_only=False)
+            self.target.get_now = lambda: now
+            verify(self.target, now - timedelta(hours=24), now)
+
+            # Restarted, with the persisted hours only.
+            end = now.replace(minute=0)
+            expected = fetch(self.target, end - timedelta(hours=24), end)
+
+            create_engine(database).execute(Transaction.__table__.delete().where(
+                Transaction.tx_time < end - timedelta(hours=1)))
+
+            self.target = CryptowelderContext(config=config, read_only=False)
+            self.target.get_now = lambda: now
+            self.assertEqual(fetch(self.target, end - timedelta(hours=24), end), expected)
+
+    def test_fetch_batch(self):
+
+        with TemporaryDirectory() as directory:
+
+            # Accounts are inserted directly, which requires a shared database.
+            database = 'sqlite:///%s' % path.join(directory, 'test.db')
+
+            config = path.join(directory, 'test.cfg')
+
+            with open(config, 'w') as f:
+                f.write('[context]\ndatabase = %s\n' % database)
+
+            self.target = CryptowelderContext(config=config, read_only=False)
+            self.target._create_all()
+
+            create_engine(database).execute(Account.__table__.insert(), [
+                {'ac_site': 'ts', 'ac_acct': 'CASH', 'ac_unit': u, 'ac_disp': u} for u in ['BTC', 'JPY']
+            ])
+
+            self._verify_fetch_batch()
+
+    def _verify_fetch_batch(self):
+        dt = datetime(year=2017, month=4, day=14, hour=12, minute=34, tzinfo=utc)
+
+        for code, expiry in [('p1', None), ('p2', dt + timedelta(minutes=3))]:
+            p = Product()
+            p.pr_site = 'ts'
+            p.pr_code = code
+            p.pr_inst = 'BTC'
+            p.pr_fund = 'JPY'
+            p.pr_disp = code
+            p.pr_expr = expiry
+            self.target.save_products([p])
+
+        for unit in ['BTC', 'JPY']:
+            e = Evaluation()
+            e.ev_site = 'ts'
+            e.ev_unit = unit
+            self.target.save_evaluations([e])
+
+        for i in range(-12, 12):
+            t = Ticker()
+            t.tk_site = 'ts'
+            t.tk_code = 'p1' if i % 3 else 'p2'
+            t.tk_time = dt + timedelta(minutes=i, seconds=i * 7 % 60)
+            t.tk_ltp = Decimal(i % 4)
+            self.target.save_tickers([t])
+
+            b = Balance()
+            b.bc_site = 'ts'
+            b.bc_acct = AccountType.CASH
+            b.bc_unit = UnitType.BTC if i % 2 else UnitType.JPY
+            b.bc_time = dt + timedelta(minutes=i * 2)
+            b.bc_amnt = Decimal(i)
+            self.target.save_balances([b])
+
+            x = Position()
+            x.ps_site = 'ts'
+            x.ps_code = 'p2' if i % 5 else 'p1'
+            x.ps_time = dt + timedelta(minutes=i, seconds=30)
+            x.ps_inst = Decimal(i)
+            x.ps_fund = Decimal(-i)
+            self.target.save_positions([x])
+
+        def normalize(values, key):
+            return sorted([tuple(str(v) for v in (getattr(d, key), *d[1:])) for d in values])
+
+        times = [dt + timedelta(minutes=i) for i in range(-15, 15)]
+
+        for expired in [True, False]:
+            batch = self.target.fetch_tickers_batch(times, include_expired=expired)
+            for t in times:
+                expected = normalize(self.target.fetch_tickers(t, include_expired=expired), 'ticker')
+                self.assertEqual(normalize(batch[t], 'ticker'), expected, t)
+
+            self.assertEqual(1 + expired, len(batch[times[-1]]))
+
+        batch = self.target.fetch_balances_batch(times)
+        for t in times:
+            self.assertEqual(normalize(batch[t], 'balance'), normalize(self.target.fetch_balances(t), 'balance'), t)
+        self.assertEqual(2, len(batch[times[-1]]))
+
+        batch = self.target.fetch_positions_batch(times)
+        for t in times:
+            self.assertEqual(normalize(batch[t], 'position'), normalize(self.target.fetch_positions(t), 'position'), t)
+        self.assertEqual(1, len(batch[times[-1]]))
+
+        self.assertEqual({}, self.target.fetch_tickers_batch([]))
+
+    def test_fetch_watermark(self):
+        self.target._create_all()
+
+        dt = datetime(year=2017, month=4, day=14, hour=12, minute=34, tzinfo=utc)
+
+        t = Ticker()
+        t.tk_site = 'ts'
+        t.tk_code = 'tc'
+        t.tk_time = dt
+        t.tk_ltp = Decimal('1')
+
+        # Disabled by default, without counting the writes.
+        self.target.save_tickers([t])
+        self.assertIsNone(self.target.fetch_watermark(dt))
+
+        self.target.set_property(self.target._SECTION, 'watermark', '1')
+        self.assertIsNone(self.target.fetch_watermark(dt))
+
+        self.target.save_tickers([t])
+
+        w1 = self.target.fetch_watermark(dt)
+        self.assertIsNotNone(w1)
+        self.assertEqual(w1, self.target.fetch_watermark(dt))
+
+        # Upsert of the same minute.
+        t.tk_ltp = Decimal('2')
+        self.target.save_tickers([t])
+        w2 = self.target.fetch_watermark(dt)
+        self.assertNotEqual(w2, w1)
+
+        # Later than the time.
+        p = Position()
+        p.ps_site = 'ts'
+        p.ps_code = 'tc'
+        p.ps_time = dt + timedelta(minutes=1)
+        self.target.save_positions([p])
+        self.assertEqual(w2, self.target.fetch_watermark(dt))
+
+        # Late row of an older minute.
+        b = Balance()
+        b.bc_site = 'ts'
+        b.bc_acct = AccountType.CASH
+        b.bc_unit = UnitType.JPY
+        b.bc_time = dt - timedelta(minutes=10)
+        self.target.save_balances([b])
+        w3 = self.target.fetch_watermark(dt)
+        self.assertNotEqual(w3, w2)
+
+        # Transaction saved late with an older time.
+        x = Transaction()
+        x.tx_site = 'ts'
+        x.tx_code = 'tc'
+        x.tx_type = TransactionType.TRADE
+        x.tx_acct = AccountType.CASH
+        x.tx_oid = 'o'
+        x.tx_eid = 'e'
+        x.tx_time = dt - timedelta(days=1, seconds=1)
+        self.target.save_transactions([x])
+        w4 = self.target.fetch_watermark(dt)
+        self.assertNotEqual(w4, w3)
+
+        # Known transactions are not written again.
+        self.target.save_transactions([x])
+        self.assertEqual(w4, self.target.fetch_watermark(dt))
+
+        # Purged
+        self.assertEqual(1, self.target.delete_watermarks(dt - timedelta(minutes=10)))
+        self.assertEqual(1, self.target.delete_watermarks(dt))
+        self.assertEqual(0, self.target.delete_watermarks(dt))
+        self.assertNotEqual(w4, self.target.fetch_watermark(dt))
+
+        self.target._is_read_only = lambda: True
+        self.assertEqual(0, self.target.delete_watermarks(dt + timedelta(minutes=2)))
+        self.assertIsNotNone(self.target.fetch_watermark(dt))
+
+        self.target._is_read_only = lambda: False
+        self.assertEqual(2, self.target.delete_watermarks(dt + timedelta(minutes=2)))
+        self.assertIsNone(self.target.fetch_watermark(dt))
+
+    def test_cursor(self):
+
+        with TemporaryDirectory() as directory:
+
+            # Restarted context requires a shared database, instead of thread-local in-memory ones.
+            database = 'sqlite:///%s' % path.join(directory, 'test.db')
+
+            config = path.join(directory, 'test.cfg')
+
+            with open(config, 'w') as f:
+                f.write('[context]\ndatabase = %s\n' % database)
+
+            dt = datetime(year=2017, month=4, day=14, hour=12, minute=34, tzinfo=utc)
+
+            self.target = CryptowelderContext(config=config, read_only=False)
+            self.target._create_all()
+
+            self.assertIsNone(self.target.fetch_cursor('ts', 'tc', AccountType.CASH))
+
+            self.target.save_cursor('ts', 'tc', AccountType.CASH, 123, dt)
+            self.target.save_cursor('ts', 'tc', AccountType.MARGIN, None, dt + timedelta(seconds=1))
+
+            cursor = self.target.fetch_cursor('ts', 'tc', AccountType.CASH)
+            self.assertEqual('123', cursor.cr_seq)
+            self.assertEqual(dt, cursor.cr_time)
+
+            # Restarted
+            self.target = CryptowelderContext(config=config, read_only=False)
+
+            cursor = self.target.fetch_cursor('ts', 'tc', AccountType.CASH)
+            self.assertEqual('123', cursor.cr_seq)
+            self.assertEqual(dt, cursor.cr_time)
+
+            cursor = self.target.fetch_cursor('ts', 'tc', AccountType.MARGIN)
+            self.assertIsNone(cursor.cr_seq)
+            self.assertEqual(dt + timedelta(seconds=1), cursor.cr_time)
+
+            self.assertIsNone(self.target.fetch_cursor('ts', 'tc', AccountType.FUND))
+
+            # Read-only still advances in memory.
+            self.target = CryptowelderContext(config=config, read_only=True)
+            self.target.save_cursor('ts', 'tc', AccountType.CASH, 456, dt)
+            self.assertEqual('456', self.target.fetch_cursor('ts', 'tc', AccountType.CASH).cr_seq)
+
+            self.target = CryptowelderContext(config=config, read_only=False)
+            self.assertEqual('123', self.target.fetch_cursor('ts', 'tc', AccountType.CASH).cr_seq)
+
     def test_Product(self):
         value = Product()
         self.assertEqual(
@@ -836,6 +1949,30 @@ class TestCryptowelderContext(TestCase):
                          "'time': '2009-02-13 23:31:30.123456 UTC', "
                          "'instrument': '1.2', 'funding': '2.3'}", str(value))
 
+    def test_Cursor(self):
+        value = Cursor()
+        self.assertEqual("{'table': 't_cursor', 'site': 'None', 'code': 'None', 'acct': 'None', "
+                         "'seq': 'None', 'time': 'None', 'updated': 'None'}", str(value))
+
+        value.cr_site = 'foo'
+        value.cr_code = 'bar'
+        value.cr_acct = AccountType.CASH
+        value.cr_seq = '123'
+        value.cr_time = datetime.fromtimestamp(1234567890.123456, tz=utc)
+        value.cr_updt = datetime.fromtimestamp(1234567890.123456, tz=utc)
+        self.assertEqual("{'table': 't_cursor', 'site': 'foo', 'code': 'bar', 'acct': 'CASH', "
+                         "'seq': '123', 'time': '2009-02-13 23:31:30.123456 UTC', "
+                         "'updated': '2009-02-13 23:31:30.123456 UTC'}", str(value))
+
+    def test_Watermark(self):
+        value = Watermark()
+        self.assertEqual("{'table': 't_watermark', 'time': 'None', 'seq': 'None'}", str(value))
+
+        value.wm_time = datetime.fromtimestamp(1234567890.123456, tz=utc)
+        value.wm_seq = 123
+        self.assertEqual("{'table': 't_watermark', 'time': '2009-02-13 23:31:30.123456 UTC', 'seq': '123'}",
+                         str(value))
+
     def test_Metric(self):
         value = Metric()
         self.assertEqual("{'table': 't_metric', 'type': 'None', "
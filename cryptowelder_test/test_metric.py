@@ -1,11 +1,16 @@
 from collections import namedtuple, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from decimal import Decimal
+from os import path
+from tempfile import TemporaryDirectory
 from unittest import TestCase, main
 from unittest.mock import MagicMock
 
-from cryptowelder.context import CryptowelderContext, Ticker, Metric
-from cryptowelder.metric import MetricWelder
+from pytz import utc
+
+from cryptowelder.context import CryptowelderContext, Ticker, Metric, Evaluation, Product
+from cryptowelder.metric import MetricWelder, backfill
 
 
 class TestMetricWelder(TestCase):
@@ -16,9 +21,19 @@ class TestMetricWelder(TestCase):
         self.context.get_logger.return_value = MagicMock()
         self.context.get_property = lambda section, key, val: val
         self.context.parse_iso_timestamp = CryptowelderContext._parse_iso_timestamp
+        self.context.run_tasks = lambda key, tasks: [self._complete(t[0], *t[1:]) for t in tasks]
 
         self.target = MetricWelder(self.context)
 
+    @staticmethod
+    def _complete(func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
     def test_run(self):
         self.target._wrap = MagicMock()
 
@@ -53,16 +68,14 @@ class TestMetricWelder(TestCase):
         self.target.process_ticker = MagicMock(return_value=prices)
         self.target.process_balance = MagicMock()
         self.target.process_position = MagicMock()
-        self.target.process_transaction_trade = MagicMock()
-        self.target.process_transaction_volume = MagicMock()
+        self.target.process_transaction = MagicMock()
 
-        self.target.process_metric()
+        self.assertTrue(self.target.process_metric())
 
         self.assertEqual(3, len(self.target.process_ticker.call_args_list))
         self.assertEqual(3, len(self.target.process_balance.call_args_list))
         self.assertEqual(3, len(self.target.process_position.call_args_list))
-        self.assertEqual(3, len(self.target.process_transaction_trade.call_args_list))
-        self.assertEqual(3, len(self.target.process_transaction_volume.call_args_list))
+        self.assertEqual(3, len(self.target.process_transaction.call_args_list))
 
         for i, t in enumerate((t0, t1, t2)):
             self.assertEqual(t, self.target.process_ticker.call_args_list[i][0][0])
@@ -73,11 +86,99 @@ class TestMetricWelder(TestCase):
             self.assertEqual(t, self.target.process_position.call_args_list[i][0][0])
             self.assertEqual(prices, self.target.process_position.call_args_list[i][0][1])
 
-            self.assertEqual(t, self.target.process_transaction_trade.call_args_list[i][0][0])
-            self.assertEqual(prices, self.target.process_transaction_trade.call_args_list[i][0][1])
+            self.assertEqual(t, self.target.process_transaction.call_args_list[i][0][0])
+            self.assertEqual(prices, self.target.process_transaction.call_args_list[i][0][1])
+
+    def test__process_metric_memoize(self):
+        now = datetime.fromtimestamp(1234567890.123456)
+        t0 = now.replace(second=0, microsecond=0)
+        t1 = t0 - timedelta(minutes=1)
+        t2 = t0 - timedelta(minutes=2)
+        watermarks = {t0: (1, 2), t1: (3, 4), t2: (5, 6)}
+        self.context.get_now = MagicMock(return_value=now)
+        self.context.fetch_watermark = lambda t: watermarks[t]
+        self.target.process_ticker = MagicMock(return_value={})
+        self.target.process_balance = MagicMock(return_value=[])
+        self.target.process_position = MagicMock(return_value=[])
+        self.target.process_transaction = MagicMock(side_effect=lambda t, p: None if t == t1 else [])
+
+        # Not memoized for the failure.
+        self.assertFalse(self.target.process_metric())
+        self.assertEqual([t0, t1, t2], [c[0][0] for c in self.target.process_balance.call_args_list])
+
+        # Unchanged ones skipped.
+        watermarks[t2] = (5, 7)
+        self.target.process_balance.reset_mock()
+        self.assertFalse(self.target.process_metric())
+        self.assertEqual([t1, t2], [c[0][0] for c in self.target.process_balance.call_args_list])
+
+        # Failed to fetch the watermark.
+        self.context.fetch_watermark = MagicMock(side_effect=Exception('test'))
+        self.target.process_balance.reset_mock()
+        self.target.process_metric()
+        self.assertEqual([t0, t1, t2], [c[0][0] for c in self.target.process_balance.call_args_list])
 
-            self.assertEqual(t, self.target.process_transaction_volume.call_args_list[i][0][0])
-            self.assertEqual(prices, self.target.process_transaction_volume.call_args_list[i][0][1])
+        # Disabled.
+        self.context.get_property = lambda section, key, val: 0 if key == 'memoize' else val
+        self.context.fetch_watermark = MagicMock()
+        self.target.process_balance.reset_mock()
+        self.target.process_metric()
+        self.assertEqual([t0, t1, t2], [c[0][0] for c in self.target.process_balance.call_args_list])
+        self.context.fetch_watermark.assert_not_called()
+
+    def test_purge_metric(self):
+        now = datetime(year=2019, month=4, day=14, hour=12, minute=34, tzinfo=utc)
+        self.context.get_now = lambda: now
+        self.context.delete_metrics = MagicMock(return_value=1)
+        self.context.delete_watermarks = MagicMock(return_value=2)
+
+        self.target.purge_metric(intervals=((48, (0,)), (12, (0, 30))))
+
+        calls = self.context.delete_metrics.call_args_list
+        self.assertEqual(2, len(calls))
+        self.assertEqual(((now - timedelta(hours=48),), {'exclude_minutes': (0,)}), calls[0])
+        self.assertEqual(((now - timedelta(hours=12),), {'exclude_minutes': (0, 30)}), calls[1])
+
+        # Watermarks older than the latest cutoff.
+        self.context.delete_watermarks.assert_called_once_with(now - timedelta(hours=12))
+
+        # Nothing to purge.
+        self.context.delete_watermarks.reset_mock()
+        self.target.purge_metric(intervals=())
+        self.context.delete_watermarks.assert_not_called()
+
+    def test_process_metric_batch(self):
+        t0 = datetime(year=2019, month=4, day=14, hour=12, minute=34)
+        t1 = t0 + timedelta(minutes=1)
+        prices = {t0: {'foo': {'bar': 'hoge'}}, t1: {}}
+        self.context.fetch_tickers_batch = MagicMock(return_value={t0: ['t0'], t1: ['t1']})
+        self.context.fetch_balances_batch = MagicMock(return_value={t0: ['b0'], t1: []})
+        self.context.fetch_positions_batch = MagicMock(return_value={t0: [], t1: ['p1']})
+        self.target.process_ticker = MagicMock(side_effect=lambda t, values: prices[t])
+        self.target.process_balance = MagicMock()
+        self.target.process_position = MagicMock()
+        self.target.process_transaction = MagicMock()
+
+        self.assertTrue(self.target.process_metric_batch([t0, t1]))
+
+        self.context.fetch_tickers_batch.assert_called_once_with([t0, t1], include_expired=True)
+        self.assertEqual([((t0, ['t0']),), ((t1, ['t1']),)],
+                         [c[0:1] for c in self.target.process_ticker.call_args_list])
+        self.assertEqual([((t0, prices[t0], ['b0']),), ((t1, prices[t1], []),)],
+                         [c[0:1] for c in self.target.process_balance.call_args_list])
+        self.assertEqual([((t0, prices[t0], []),), ((t1, prices[t1], ['p1']),)],
+                         [c[0:1] for c in self.target.process_position.call_args_list])
+        self.assertEqual([((t0, prices[t0]),), ((t1, prices[t1]),)],
+                         [c[0:1] for c in self.target.process_transaction.call_args_list])
+
+        # Failures
+        self.target.process_transaction = MagicMock(side_effect=lambda t, p: None if t == t1 else [])
+        self.assertFalse(self.target.process_metric_batch([t0, t1]))
+        self.target.process_transaction = MagicMock(side_effect=Exception('test'))
+        self.assertFalse(self.target.process_metric_batch([t0, t1]))
+        self.target.process_transaction = MagicMock(return_value=[])
+        self.target.process_ticker = MagicMock(return_value=None)
+        self.assertFalse(self.target.process_metric_batch([t0, t1]))
 
     def test_process_ticker(self):
         now = datetime.fromtimestamp(1234567890.123456)
@@ -104,6 +205,47 @@ class TestMetricWelder(TestCase):
         self.context.fetch_tickers = MagicMock(side_effect=Exception('test'))
         self.assertIsNone(self.target.process_ticker(now))
 
+    def test_process_transaction(self):
+        now = datetime(year=2019, month=4, day=14, hour=12, minute=34)
+        prices = {'foo': {'bar': 'hoge'}}
+
+        dto = namedtuple('TransactionDto', (
+            'tx_net_inst', 'tx_net_fund', 'tx_grs_fund', 'product', 'ev_inst', 'ev_fund'
+        ))
+        product = MagicMock()
+        product.pr_disp = 'test'
+        values = {k: [dto(Decimal('1.5'), Decimal('-2'), Decimal('4'), product, 'i', 'f')] for k in [
+            'trade@DAY', 'trade@YTD', 'volume@12H', 'volume@01D', 'volume@30D'
+        ]}
+        values['trade@MTD'] = [dto(None, Decimal('-2'), None, product, 'i', 'f')]
+        self.context.fetch_transaction_windows = MagicMock(return_value=values)
+        self.target._calculate_evaluation = lambda ev, p: {'i': Decimal('3'), 'f': Decimal('0.5')}[ev]
+
+        self.context.save_metrics = MagicMock()
+        self.target.process_transaction(now, prices)
+
+        windows = self.context.fetch_transaction_windows.call_args[0][0]
+        self.assertEqual(now, self.context.fetch_transaction_windows.call_args[0][1])
+        self.assertEqual(datetime(year=2019, month=4, day=13, hour=15), windows['trade@DAY'])
+        self.assertEqual(datetime(year=2019, month=3, day=31, hour=15), windows['trade@MTD'])
+        self.assertEqual(datetime(year=2018, month=12, day=31, hour=15), windows['trade@YTD'])
+        self.assertEqual(datetime(year=2019, month=4, day=14, hour=0, minute=34), windows['volume@12H'])
+        self.assertEqual(datetime(year=2019, month=4, day=13, hour=12, minute=34), windows['volume@01D'])
+        self.assertEqual(datetime(year=2019, month=3, day=15, hour=12, minute=34), windows['volume@30D'])
+
+        metrics = {m.mc_type: m for m in self.context.save_metrics.call_args[0][0]}
+        self.assertEqual(5, len(metrics))
+        self.assertEqual(Decimal('3.5'), metrics['trade@DAY'].mc_amnt)
+        self.assertEqual(Decimal('3.5'), metrics['trade@YTD'].mc_amnt)
+        self.assertEqual(Decimal('2'), metrics['volume@30D'].mc_amnt)
+        self.assertEqual('test', metrics['volume@30D'].mc_name)
+        self.assertEqual(now, metrics['volume@30D'].mc_time)
+
+        self.context.fetch_transaction_windows = MagicMock(side_effect=Exception('test'))
+        self.context.save_metrics = MagicMock()
+        self.target.process_transaction(now, prices)
+        self.context.save_metrics.assert_not_called()
+
     def test__calculate_prices(self):
         t1 = Ticker()
         t1.tk_site = 's1'
@@ -148,6 +290,222 @@ class TestMetricWelder(TestCase):
         self.assertEqual(Decimal('1.2'), prices['s3']['c3'])
         self.assertIsNone(prices['s4']['c4'])
 
+    def test__calculate_evaluation(self):
+        def create(site, unit, ticker_site=None, ticker_code=None, convert_site=None, convert_code=None):
+            e = Evaluation()
+            e.ev_site = site
+            e.ev_unit = unit
+            e.ev_ticker_site = ticker_site
+            e.ev_ticker_code = ticker_code
+            e.ev_convert_site = convert_site
+            e.ev_convert_code = convert_code
+            return e
+
+        evaluations = [
+            create('s1', 'JPY'),
+            create('s1', 'USD', 'fx', 'USD_JPY'),
+            create('s1', 'BTC', 's1', 'BTC_USD', 'fx', 'USD_JPY'),
+            create('s1', 'BCH', 's1', 'BCH_BTC', 's1', 'unit:BTC'),  # BCH -> BTC -> USD -> JPY
+            create('s1', 'ETH', 's1', 'ETH_BTC', 's1', 'unit:ETC'),
+            create('s1', 'ETC', 's1', 'ETC_BTC', 's1', 'unit:ETH'),  # Circular
+            create('s1', 'XRP', 's1', 'XRP_BTC', 's1', 'unit:BTC'),  # Missing price
+            create('s1', 'LTC', 's1', 'LTC_BTC', 's1', 'unit:FOO'),  # Missing unit
+            create('s2', 'BTC', 's2', 'BTC', 'fx', 'USD_JPY'),  # Ticker code same as the unit
+            create('s2', 'ETH', 's2', 'ETH_BTC', 's2', 'BTC'),
+        ]
+        self.context.fetch_evaluations = MagicMock(return_value=evaluations)
+
+        dto = namedtuple('TickerDto', ('ticker',))
+
+        def ticker(site, code, ltp):
+            t = Ticker()
+            t.tk_site = site
+            t.tk_code = code
+            t.tk_ltp = ltp
+            return dto(t)
+
+        tickers = [
+            ticker('fx', 'USD_JPY', Decimal('110')),
+            ticker('s1', 'BTC_USD', Decimal('5000')),
+            ticker('s1', 'BCH_BTC', Decimal('0.05')),
+            ticker('s1', 'ETH_BTC', Decimal('0.03')),
+            ticker('s1', 'ETC_BTC', Decimal('0.001')),
+            ticker('s1', 'XRP_BTC', Decimal('0')),
+            ticker('s1', 'LTC_BTC', Decimal('0.01')),
+            ticker('s2', 'BTC', Decimal('5000')),
+            ticker('s2', 'ETH_BTC', Decimal('0.03')),
+        ]
+
+        legacy = self.target._calculate_prices(tickers)
+        self.assertIsNone(legacy.rates)
+
+        self.target._compile_evaluations()
+        compiled = self.target._calculate_prices(tickers)
+        self.assertIsNotNone(compiled.rates)
+
+        for e in evaluations[:3]:
+            expected = self.target._calculate_evaluation(e, legacy)
+            self.assertIsNotNone(expected)
+            self.assertEqual(expected, self.target._calculate_evaluation(e, compiled))
+
+        self.assertEqual(Decimal('27500'), self.target._calculate_evaluation(evaluations[3], compiled))
+        self.assertIsNone(self.target._calculate_evaluation(evaluations[4], compiled))
+        self.assertIsNone(self.target._calculate_evaluation(evaluations[5], compiled))
+        self.assertIsNone(self.target._calculate_evaluation(evaluations[6], compiled))
+        self.assertIsNone(self.target._calculate_evaluation(evaluations[7], compiled))
+
+        # Unmarked converts are tickers, not the units of the same name.
+        for e in evaluations[8:]:
+            expected = self.target._calculate_evaluation(e, legacy)
+            self.assertIsNotNone(expected)
+            self.assertEqual(expected, self.target._calculate_evaluation(e, compiled))
+
+        self.assertEqual(Decimal('150'), self.target._calculate_evaluation(evaluations[9], compiled))
+        self.assertIsNone(self.target._calculate_evaluation(None, compiled))
+
+        # Unknown ones are evaluated directly.
+        self.assertEqual(Decimal('110'), self.target._calculate_evaluation(
+            create('s2', 'USD', 'fx', 'USD_JPY'), compiled))
+
+        # Recompiled only when changed.
+        evaluations[0].ev_ticker_site = 'fx'
+        evaluations[0].ev_ticker_code = 'USD_JPY'
+        self.target._compile_evaluations()
+        self.assertEqual(Decimal('110'), self.target._calculate_evaluation(
+            evaluations[0], self.target._calculate_prices(tickers)))
+
+    def test__compile_graph(self):
+        slots, paths = MetricWelder._compile_graph([
+            ('s', 'USD', 'fx', 'USD_JPY', None, None),
+            ('s', 'BTC', 's', 'BTC_USD', 's', 'USD'),
+            ('s', 'ETH', 's', 'ETH_BTC', 's', 'unit:BTC'),
+        ])
+
+        # Plain code is always a ticker, even if a unit of the same name exists.
+        self.assertIn(('s', 'USD'), slots)
+        self.assertEqual((slots[('s', 'BTC_USD')], slots[('s', 'USD')]), paths[('s', 'BTC')])
+
+        # Marked code is followed into the unit, and is never a ticker.
+        self.assertNotIn(('s', 'unit:BTC'), slots)
+        self.assertEqual((slots[('s', 'ETH_BTC')],) + paths[('s', 'BTC')], paths[('s', 'ETH')])
+
+
+class TestBackfill(TestCase):
+
+    def test_backfill(self):
+
+        with TemporaryDirectory() as directory:
+
+            # Worker contexts require a shared database, instead of thread-local in-memory ones.
+            config = path.join(directory, 'test.cfg')
+
+            with open(config, 'w') as f:
+                f.write('[context]\ndatabase = sqlite:///%s\n' % path.join(directory, 'test.db'))
+
+            context = CryptowelderContext(config=config, read_only=False)
+            context._create_all()
+
+            start = datetime(year=2019, month=4, day=14, hour=12, tzinfo=utc)
+            end = start + timedelta(minutes=7)
+
+            processed = []
+            process_metric = MetricWelder.process_metric
+
+            def capture(target, *, default_time=None, default_count=3):
+                processed.append((default_time, default_count))
+                return process_metric(target, default_time=default_time, default_count=default_count)
+
+            MetricWelder.process_metric = capture
+
+            try:
+
+                self.assertEqual(7, backfill(config, start, end, chunk=3, workers=2, batch=False,
+                                             executor=ThreadPoolExecutor))
+                self.assertEqual([(start + timedelta(minutes=i), 1) for i in range(0, 7)], sorted(processed))
+
+                checkpoints = context.fetch_checkpoints(MetricWelder._ID, 1, start, end)
+                self.assertEqual(3, len(checkpoints))
+
+                # Resumed from the checkpoints.
+                self.assertEqual(0, backfill(config, start, end, chunk=3, executor=ThreadPoolExecutor))
+
+                # Partial tail [6, 7) does not cover the longer chunk [6, 9).
+                self.assertEqual(6, backfill(config, start, start + timedelta(minutes=12), chunk=3,
+                                             executor=ThreadPoolExecutor))
+
+                # Hourly chunks are not covered by the per-minute ones.
+                self.assertEqual(7, backfill(config, start - timedelta(hours=6), end, step=60,
+                                             chunk=3, executor=ThreadPoolExecutor))
+                self.assertEqual(0, backfill(config, start - timedelta(hours=6), end, step=60,
+                                             chunk=3, executor=ThreadPoolExecutor))
+
+                # Not checkpointed on failures.
+                MetricWelder.process_metric = lambda target, **kwargs: False
+                later = start + timedelta(days=1)
+                self.assertEqual(0, backfill(config, later, later + timedelta(minutes=3), chunk=3, batch=False,
+                                             executor=ThreadPoolExecutor))
+                self.assertEqual(0, len(context.fetch_checkpoints(MetricWelder._ID, 1, later, end + timedelta(days=2))))
+
+            finally:
+
+                MetricWelder.process_metric = process_metric
+
+class TestWatermark(TestCase):
+
+    def test_process_metric(self):
+
+        with TemporaryDirectory() as directory:
+
+            # Task threads require a shared database, instead of thread-local in-memory ones.
+            config = path.join(directory, 'test.cfg')
+
+            with open(config, 'w') as f:
+                f.write('[context]\ndatabase = sqlite:///%s\nwatermark = 1\n' % path.join(directory, 'test.db'))
+
+            context = CryptowelderContext(config=config, read_only=False)
+            context._create_all()
+
+            now = datetime(year=2019, month=4, day=14, hour=12, minute=34, tzinfo=utc)
+
+            product = Product()
+            product.pr_site = 'ts'
+            product.pr_code = 'tc'
+            product.pr_inst = 'BTC'
+            product.pr_fund = 'JPY'
+            product.pr_disp = 'TS TC'
+            context.save_products([product])
+
+            ticker = Ticker()
+            ticker.tk_site = 'ts'
+            ticker.tk_code = 'tc'
+            ticker.tk_time = now
+            ticker.tk_ltp = Decimal('1')
+            context.save_tickers([ticker])
+
+            target = MetricWelder(context)
+
+            computed = []
+            process_ticker = target.process_ticker
+
+            def capture(timestamp, values=None):
+                prices = process_ticker(timestamp, values)
+                computed.append(prices['ts']['tc'])
+                return prices
+
+            target.process_ticker = capture
+
+            self.assertTrue(target.process_metric(default_time=now, default_count=1))
+            self.assertEqual([Decimal('1')], computed)
+
+            # Unchanged
+            self.assertTrue(target.process_metric(default_time=now, default_count=1))
+            self.assertEqual([Decimal('1')], computed)
+
+            # Upserted the same minute.
+            ticker.tk_ltp = Decimal('2')
+            context.save_tickers([ticker])
+            self.assertTrue(target.process_metric(default_time=now, default_count=1))
+            self.assertEqual([Decimal('1'), Decimal('2')], computed)
 
 if __name__ == '__main__':
     main()
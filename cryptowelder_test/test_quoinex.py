@@ -17,6 +17,10 @@ class TestQuoinexWelder(TestCase):
         self.context.get_logger.return_value = MagicMock()
         self.context.get_property = lambda section, key, val: val
         self.context.parse_iso_timestamp = CryptowelderContext._parse_iso_timestamp
+        self.context.run_tasks = lambda key, tasks: [t[0](*t[1:]) for t in tasks]
+        self.context.run_schedule = lambda key, jobs, **kwargs: [
+            [j[1]() for j in jobs] for _ in iter(self.context.is_closed, True)
+        ]
 
         self.target = QuoinexWelder(self.context)
 
@@ -32,8 +36,10 @@ class TestQuoinexWelder(TestCase):
         self.target._process_cash = MagicMock()
         self.target._loop(default_interval=0.1)
         self.assertEqual(3, self.context.is_closed.call_count)
-        self.assertEqual(2, self.target._process_products.call_count)
+        self.assertEqual(2 * 2, self.target._process_products.call_count)
         self.assertEqual(2, self.target._process_cash.call_count)
+        self.target._process_products.assert_any_call(transaction=False)
+        self.target._process_products.assert_any_call(ticker=False)
 
     def test__process_products(self):
         self.context.requests_get = MagicMock()
@@ -44,6 +50,17 @@ class TestQuoinexWelder(TestCase):
         self.assertEqual(2, self.target._process_ticker.call_count)
         self.assertEqual(2, self.target._process_transaction.call_count)
 
+        # Transaction only, from the cache
+        self.context.requests_get.reset_mock()
+        self.context.requests_cached = MagicMock()
+        self.target._process_ticker.reset_mock()
+        self.target._process_transaction.reset_mock()
+        self.target._process_products(ticker=False)
+        self.context.requests_get.assert_not_called()
+        self.context.requests_cached.assert_called_once_with('https://api.liquid.com/products', ttl=300)
+        self.target._process_ticker.assert_not_called()
+        self.assertEqual(2, self.target._process_transaction.call_count)
+
         # Failure
         self.context.requests_get.reset_mock()
         self.context.requests_get.side_effect = Exception('test')
@@ -17,6 +17,10 @@ class TestZaifWelder(TestCase):
         self.context.get_logger.return_value = MagicMock()
         self.context.get_property = lambda section, key, val: val
         self.context.parse_iso_timestamp = CryptowelderContext._parse_iso_timestamp
+        self.context.run_tasks = lambda key, tasks: [t[0](*t[1:]) for t in tasks]
+        self.context.run_schedule = lambda key, jobs, **kwargs: [
+            [j[1]() for j in jobs] for _ in iter(self.context.is_closed, True)
+        ]
 
         self.target = ZaifWelder(self.context)
 
@@ -247,6 +251,8 @@ class TestZaifWelder(TestCase):
         ]
 
         # Query 3 times
+        self.context.fetch_cursor = MagicMock(return_value=None)
+        self.context.save_cursor = MagicMock()
         self.target._query_private = MagicMock(side_effect=side_effects)
         self.context.save_transactions = MagicMock(return_value=[None])
         self.target._process_trades('foo_bar')
@@ -256,6 +262,11 @@ class TestZaifWelder(TestCase):
         calls = self.context.save_transactions.call_args_list
         self.assertEqual(2, len(calls))
 
+        self.context.fetch_cursor.assert_called_once_with('zaif', 'foo_bar', AccountType.CASH)
+        self.context.save_cursor.assert_called_once_with(
+            'zaif', 'foo_bar', AccountType.CASH, 182, list(calls[0][0][0])[0].tx_time
+        )
+
         values = list(calls[0][0][0])
         self.assertEqual(1, len(values))
         self.assertEqual('zaif', values[0].tx_site)
@@ -280,7 +291,22 @@ class TestZaifWelder(TestCase):
         self.assertEqual(Decimal('0.04'), values[0].tx_inst)
         self.assertEqual(Decimal('-2243.24'), values[0].tx_fund)
 
+        # Incremental
+        self.context.fetch_cursor = MagicMock(return_value=MagicMock(cr_seq='179'))
+        self.context.save_cursor.reset_mock()
+        self.target._query_private = MagicMock(side_effect=side_effects[1:2])
+        self.context.save_transactions = MagicMock(return_value=[])
+        self.target._process_trades('foo_bar', count=2)
+        self.target._query_private.assert_called_once_with('trade_history', parameters={
+            'currency_pair': 'foo_bar', 'count': 2, 'from_id': 181, 'order': 'ASC',
+        })
+        self.context.save_transactions.assert_called_once()
+        self.context.save_cursor.assert_called_once_with(
+            'zaif', 'foo_bar', AccountType.CASH, 180, list(self.context.save_transactions.call_args[0][0])[0].tx_time
+        )
+
         # Nothing saved
+        self.context.fetch_cursor = MagicMock(return_value=None)
         self.target._query_private = MagicMock(side_effect=side_effects)
         self.context.save_transactions = MagicMock(return_value=None)
         self.target._process_trades('foo_bar')
@@ -210,6 +210,53 @@ CREATE INDEX i_transaction_1
     tx_acct
   );
 
+--
+-- Transaction (Hourly)
+--
+CREATE TABLE IF NOT EXISTS t_transaction_hour
+(
+  th_site     VARCHAR(16) NOT NULL,
+  th_code     VARCHAR(32) NOT NULL,
+  th_hour     TIMESTAMP   NOT NULL,
+  th_size     INTEGER     NOT NULL,
+  th_time_min TIMESTAMP,
+  th_time_max TIMESTAMP,
+  th_net_inst DECIMAL(32, 16),
+  th_net_fund DECIMAL(32, 16),
+  th_grs_inst DECIMAL(32, 16),
+  th_grs_fund DECIMAL(32, 16),
+  th_seq      INTEGER
+);
+
+DROP INDEX IF EXISTS i_transaction_hour_0;
+
+ALTER TABLE t_transaction_hour
+  ADD CONSTRAINT i_transaction_hour_0
+PRIMARY KEY
+  (
+    th_hour,
+    th_site,
+    th_code
+  );
+
+--
+-- Transaction Mark
+--
+CREATE TABLE IF NOT EXISTS t_transaction_mark
+(
+  tm_hour TIMESTAMP NOT NULL,
+  tm_seq  INTEGER   NOT NULL
+);
+
+DROP INDEX IF EXISTS i_transaction_mark_0;
+
+ALTER TABLE t_transaction_mark
+  ADD CONSTRAINT i_transaction_mark_0
+PRIMARY KEY
+  (
+    tm_hour
+  );
+
 --
 -- Metric
 --
@@ -276,3 +323,69 @@ $$
 RETURNS NULL ON NULL
 INPUT
 LANGUAGE SQL;
+
+--
+-- Cursor
+--
+CREATE TABLE IF NOT EXISTS t_cursor
+(
+  cr_site VARCHAR(16) NOT NULL,
+  cr_code VARCHAR(32) NOT NULL,
+  cr_acct VARCHAR(16) NOT NULL,
+  cr_seq  VARCHAR(64),
+  cr_time TIMESTAMP,
+  cr_updt TIMESTAMP
+);
+
+DROP INDEX IF EXISTS i_cursor_0;
+
+ALTER TABLE t_cursor
+  ADD CONSTRAINT i_cursor_0
+PRIMARY KEY
+  (
+    cr_site,
+    cr_code,
+    cr_acct
+  );
+
+--
+-- Checkpoint
+--
+CREATE TABLE IF NOT EXISTS t_checkpoint
+(
+  ck_name  VARCHAR(32) NOT NULL,
+  ck_step  INTEGER     NOT NULL,
+  ck_start TIMESTAMP   NOT NULL,
+  ck_end   TIMESTAMP   NOT NULL,
+  ck_time  TIMESTAMP   NOT NULL
+);
+
+DROP INDEX IF EXISTS i_checkpoint_0;
+
+ALTER TABLE t_checkpoint
+  ADD CONSTRAINT i_checkpoint_0
+PRIMARY KEY
+  (
+    ck_name,
+    ck_step,
+    ck_start,
+    ck_end
+  );
+
+--
+-- Watermark
+--
+CREATE TABLE IF NOT EXISTS t_watermark
+(
+  wm_time TIMESTAMP NOT NULL,
+  wm_seq  INTEGER   NOT NULL
+);
+
+DROP INDEX IF EXISTS i_watermark_0;
+
+ALTER TABLE t_watermark
+  ADD CONSTRAINT i_watermark_0
+PRIMARY KEY
+  (
+    wm_time
+  );
@@ -27,6 +27,11 @@ VALUES ('binance', 'BTCUSDT', 'BTC', 'USD', 'BNC BTC', NULL),
 --
 -- Evaluation
 --
+-- Each unit is evaluated by the ticker price, multiplied by the price of the convert ticker.
+-- A convert code prefixed with 'unit:' (e.g. 'unit:BTC') names another unit of the convert site instead,
+-- whose own evaluation is chained. Codes without the prefix are always tickers, even if a unit of the
+-- same name exists, so the prefix is reserved and never used by a ticker code.
+--
 TRUNCATE TABLE t_evaluation;
 
 INSERT INTO t_evaluation (ev_site, ev_unit, ev_ticker_site, ev_ticker_code, ev_convert_site, ev_convert_code)